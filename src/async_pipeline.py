@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import quote
+
+import boto3
+import httpx
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+import metrics
+import pipeline
+from debug_log import configure_debug_log, get_debug_logger
+
+class ConverseHTTPError(Exception):
+    """
+    Error response from a Converse endpoint. `response` mirrors botocore's ClientError
+    layout, so rate_limiter classifies throttling and transient failures the same way.
+    """
+
+    def __init__(self, status_code, code, message):
+        super().__init__(f"{code} ({status_code}): {message}")
+        self.response = {
+            "Error": {"Code": code, "Message": message},
+            "ResponseMetadata": {"HTTPStatusCode": status_code},
+        }
+
+class AsyncConverseClient:
+    """
+    Minimal asyncio client for the Bedrock Converse REST API on an httpx connection pool.
+
+    endpoint_url defaults to the regional bedrock-runtime endpoint; point it at any
+    Converse-compatible server (e.g. a local stub) and pass sign=False to skip SigV4.
+    """
+
+    def __init__(self, endpoint_url=None, region_name=None, sign=True, max_connections=100, timeout=300.0):
+        session = boto3.session.Session(region_name=region_name)
+        self.region_name = session.region_name or "us-east-1"
+        self.endpoint_url = (endpoint_url or f"https://bedrock-runtime.{self.region_name}.amazonaws.com").rstrip("/")
+        self.credentials = session.get_credentials() if sign else None
+        self.http = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    def _signed_headers(self, url, body):
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        if self.credentials is None:
+            return headers
+        request = AWSRequest(method="POST", url=url, data=body, headers=headers)
+        SigV4Auth(self.credentials.get_frozen_credentials(), "bedrock", self.region_name).add_auth(request)
+        return dict(request.headers.items())
+
+    async def converse(self, **converse_kwargs):
+        """
+        Same arguments and response shape as boto3's bedrock-runtime converse.
+        """
+        payload = pipeline.serialize_converse_request(converse_kwargs)
+        model_id = payload.pop("modelId")
+        url = f"{self.endpoint_url}/model/{quote(model_id, safe='')}/converse"
+        body = json.dumps(payload).encode("utf-8")
+        response = await self.http.post(url, content=body, headers=self._signed_headers(url, body))
+        if response.status_code >= 400:
+            code = response.headers.get("x-amzn-ErrorType", "").split(":")[0]
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            if not code:
+                code = "ThrottlingException" if response.status_code == 429 else f"HTTP{response.status_code}"
+            raise ConverseHTTPError(response.status_code, code, message)
+        return response.json()
+
+async def invoke_converse_async(client, converse_kwargs, cache_mode=None):
+    """
+    Async counterpart of pipeline.invoke_converse: same response cache, same shared rate
+    limiter (awaited rather than slept on), same code-fence stripping.
+    """
+    log = get_debug_logger()
+    cache_mode = cache_mode or pipeline.RESPONSE_CACHE_MODE
+    limiter = pipeline.BEDROCK_RATE_LIMITER
+    cache_key = None
+    if cache_mode != "off":
+        cache_key = pipeline.response_cache_key(converse_kwargs)
+        if cache_mode == "use":
+            cached = pipeline.RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                metrics.count("response_cache_hits")
+                return pipeline.strip_code_fence(cached.decode("utf-8"))
+
+    def log_retry(attempt, exc, delay):
+        metrics.count("retries")
+        log.warning("Async Converse call failed (%s: %s); retry %d/%d in %.1fs (rate now %.2f req/s)",
+                    type(exc).__name__, exc, attempt, limiter.max_retries, delay, limiter.rate)
+
+    try:
+        with metrics.timed("api"):
+            response = await limiter.call_async(
+                lambda: client.converse(**converse_kwargs),
+                tokens=pipeline.estimate_input_tokens(converse_kwargs),
+                usage_tokens=lambda r: r.get("usage", {}).get("totalTokens"),
+                on_retry=log_retry,
+            )
+        pipeline.count_usage(response.get("usage"))
+    except Exception:
+        log.exception("Exception in invoke_converse_async for %s", converse_kwargs["modelId"])
+        raise
+    text = pipeline.converse_response_text(response)
+    if cache_key is not None:
+        pipeline.RESPONSE_CACHE.put(cache_key, text.encode("utf-8"))
+    return pipeline.strip_code_fence(text)
+
+async def process_pdf_async(pdf_path, client, executor, chunk_dir=None, model_id="us.amazon.nova-pro-v1:0", prompt=None):
+    """
+    Async counterpart of pipeline.process_pdf. Rendering and request building run on
+    executor so the event loop only waits on the network; the requests of a chunked
+    document run concurrently.
+    """
+    loop = asyncio.get_running_loop()
+    document = await loop.run_in_executor(executor, metrics.bind(pipeline.prepare_document), pdf_path, chunk_dir, prompt)
+
+    async def run_chunk(chunk):
+        converse_kwargs = await loop.run_in_executor(executor, metrics.bind(pipeline.document_converse_request), document, model_id, chunk)
+        model_response = await invoke_converse_async(client, converse_kwargs)
+        return pipeline.parse_model_response(model_response, pdf_path), model_response
+
+    chunks = document["chunks"]
+    chunk_jsons, model_responses = zip(*await asyncio.gather(*(run_chunk(chunk) for chunk in chunks)))
+    if len(chunks) == 1:
+        return pipeline.build_pdf_result(pdf_path, document["type"], chunk_jsons[0], document["prompt_version"], model_responses[0])
+    return pipeline.build_chunked_pdf_result(pdf_path, document["type"], chunks, list(chunk_jsons), document["prompt_version"],
+                                             list(model_responses))
+
+async def process_folder_async(folder_path, prompt, model_id="us.amazon.nova-pro-v1:0", max_in_flight=64,
+                               cpu_workers=None, endpoint_url=None, region_name=None, sign=True, resume=True,
+                               metrics_path=None):
+    """
+    Async counterpart of pipeline.process_folder. Up to max_in_flight documents are in
+    progress at once on one event loop; CPU-bound rendering uses a cpu_workers thread pool.
+    Results are returned and written in filename order. Uses the same run journal, so a
+    rerun skips documents either pipeline already finished, and reports failed documents
+    the same way (pipeline.FolderRunError, after the other documents finished and the
+    Excel file was written). Collects the same metrics, written to metrics_path as JSON
+    lines if given.
+    """
+    folder = Path(folder_path)
+    pipeline.clean_chunks_folders(folder)
+    pdf_files = sorted(folder.glob("*.pdf"), key=lambda p: p.name)
+    semaphore = asyncio.Semaphore(max_in_flight)
+    executor = ThreadPoolExecutor(max_workers=cpu_workers or os.cpu_count() or 1)
+    journal = pipeline.open_run_journal(folder, resume)
+    metrics.METRICS.reset()
+
+    async def process_one(pdf_file, client):
+        lfid = Path(pdf_file).stem
+        loop = asyncio.get_running_loop()
+        fingerprint = await loop.run_in_executor(executor, pipeline.document_fingerprint, pdf_file, prompt, model_id)
+        done = journal.completed(lfid, fingerprint)
+        if done is not None:
+            results[lfid] = done
+            return
+        # Each task runs in its own context, so this attributes only this document's work
+        with metrics.document(lfid):
+            try:
+                async with semaphore:
+                    result = await process_pdf_async(pdf_file, client, executor, chunk_dir=folder/"chunks", model_id=model_id, prompt=prompt)
+                result = pipeline.normalize_result(result, lfid)
+            except Exception as e:
+                # Caught here so one failure doesn't end the run under the other documents
+                failures[lfid] = f"{type(e).__name__}: {e}"
+                journal.record(lfid, fingerprint, error=failures[lfid])
+                return
+        journal.record(lfid, fingerprint, result)
+        results[lfid] = result
+
+    results = {}
+    failures = {}
+    try:
+        async with AsyncConverseClient(endpoint_url=endpoint_url, region_name=region_name, sign=sign,
+                                       max_connections=max_in_flight) as client:
+            await asyncio.gather(*(process_one(pdf_file, client) for pdf_file in pdf_files))
+        await asyncio.get_running_loop().run_in_executor(
+            executor, pipeline.write_index_excel, journal.rows([p.stem for p in pdf_files]), folder, model_id,
+        )
+    finally:
+        executor.shutdown(wait=False)
+    if metrics_path:
+        metrics.METRICS.write_jsonl(metrics_path)
+    return pipeline.folder_results(pdf_files, results, failures)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract legislation fields from a folder of PDFs on one asyncio event loop.")
+    parser.add_argument("folder_path", help="Folder containing the PDFs to process")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Documents in progress at once (default: 64)")
+    parser.add_argument("--cpu-workers", type=int, default=None, help="Threads for rendering and request building (default: CPU count)")
+    parser.add_argument("--endpoint-url", default=None, help="Converse-compatible endpoint (default: regional bedrock-runtime)")
+    parser.add_argument("--region", default=None, help="AWS region for the default endpoint and SigV4 signing")
+    parser.add_argument("--no-sign", action="store_true", help="Don't SigV4-sign requests (for local stub servers)")
+    parser.add_argument("--rps", type=float, default=1.0, help="Initial Converse requests/sec; adapts up to --max-rps and backs off on throttling")
+    parser.add_argument("--max-rps", type=float, default=10.0, help="Upper bound for the adaptive request rate")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens/min budget (default: unlimited)")
+    parser.add_argument("--cache", choices=pipeline.CACHE_MODES, default="use", help="Response cache: use, refresh or off")
+    parser.add_argument("--prompt-version", choices=pipeline.list_prompt_versions(), default=pipeline.DEFAULT_PROMPT_VERSION, help="Prompt template from data/prompts")
+    parser.add_argument("--fresh", action="store_true", help=f"Ignore the folder's {pipeline.JOURNAL_FILENAME} and reprocess every PDF")
+    parser.add_argument("--metrics", default=None, help="Write per-document stage timings and counters to this JSON-lines file")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="INFO", help="bedrock_api_debug.log level; DEBUG also logs every request payload")
+    args = parser.parse_args()
+    configure_debug_log(level=args.log_level)
+    pipeline.configure_rate_limiter(requests_per_second=args.rps, tokens_per_minute=args.tpm, max_requests_per_second=args.max_rps)
+    pipeline.configure_response_cache(mode=args.cache)
+    pipeline.configure_prompt_template(args.prompt_version)
+    try:
+        output, failures = asyncio.run(process_folder_async(
+            args.folder_path, args.prompt_version, model_id="us.amazon.nova-pro-v1:0", max_in_flight=args.max_in_flight,
+            cpu_workers=args.cpu_workers, endpoint_url=args.endpoint_url, region_name=args.region, sign=not args.no_sign,
+            resume=not args.fresh, metrics_path=args.metrics,
+        )), {}
+    except pipeline.FolderRunError as e:
+        output, failures = e.results, e.failures
+    print(json.dumps(output, indent=2))
+    print(metrics.METRICS.summary_table(), file=sys.stderr)
+    for lfid, error in failures.items():
+        print(f"FAILED {lfid}: {error}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
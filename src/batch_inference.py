@@ -0,0 +1,408 @@
+import argparse
+import json
+import re
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import boto3
+
+import pipeline
+
+TERMINAL_JOB_STATES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+# Bedrock job names: letters, digits, '+', '-' and '.', starting with a letter or digit
+JOB_NAME_MAX_LENGTH = 63
+
+def sanitize_job_name(name):
+    """
+    Fits name to Bedrock's batch job-name charset and length limit.
+    """
+    name = re.sub(r"[^A-Za-z0-9+.-]+", "-", name)
+    name = re.sub(r"-{2,}", "-", name).lstrip("+-.")[:JOB_NAME_MAX_LENGTH]
+    if not name:
+        raise ValueError("Batch job name has no letters or digits")
+    return name
+
+def default_job_name(folder):
+    """
+    legislation-<parent>-<folder>-<timestamp>, with the folder part shortened so the
+    timestamp always fits.
+    """
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    prefix = sanitize_job_name(f"legislation-{folder.parent.name}-{folder.name}")
+    prefix = prefix[:JOB_NAME_MAX_LENGTH - len(stamp) - 1].rstrip("+-.")
+    return f"{prefix}-{stamp}".lower()
+
+def converse_to_model_input(converse_kwargs):
+    """
+    Converts a Converse request (as built by pipeline.build_converse_request) into the
+    model-native InvokeModel body that Bedrock batch jobs expect in each record's modelInput.
+    """
+    model_id = converse_kwargs["modelId"]
+    payload = pipeline.serialize_converse_request(converse_kwargs)
+    # Batch jobs don't use prompt caching; drop cachePoint markers
+    for message in payload["messages"]:
+        message["content"] = [block for block in message["content"] if "cachePoint" not in block]
+    config = payload.get("inferenceConfig", {})
+    if "amazon.nova" in model_id:
+        inference_config = {"temperature": config.get("temperature"), "top_p": config.get("topP")}
+        if "maxTokens" in config:
+            inference_config["max_new_tokens"] = config["maxTokens"]
+        body = {
+            "schemaVersion": "messages-v1",
+            "messages": payload["messages"],
+            "inferenceConfig": {k: v for k, v in inference_config.items() if v is not None},
+        }
+        if payload.get("system"):
+            body["system"] = payload["system"]
+        return body
+    if "anthropic.claude" in model_id:
+        messages = []
+        for message in payload["messages"]:
+            content = []
+            for block in message["content"]:
+                if "text" in block:
+                    content.append({"type": "text", "text": block["text"]})
+                elif "image" in block:
+                    content.append({"type": "image", "source": {
+                        "type": "base64",
+                        "media_type": f"image/{block['image']['format']}",
+                        "data": block["image"]["source"]["bytes"],
+                    }})
+            messages.append({"role": message["role"], "content": content})
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": config.get("maxTokens", 4096),
+            "messages": messages,
+        }
+        if "temperature" in config:
+            body["temperature"] = config["temperature"]
+        if "topP" in config:
+            body["top_p"] = config["topP"]
+        if payload.get("system"):
+            body["system"] = " ".join(block["text"] for block in payload["system"] if "text" in block)
+        return body
+    raise ValueError(f"Batch inference is not supported for model {model_id!r}")
+
+def model_output_text(model_output):
+    """
+    Extracts the reply text from a batch record's modelOutput (Nova or Anthropic native format).
+    """
+    if "output" in model_output:
+        return pipeline.converse_response_text(model_output)
+    if isinstance(model_output.get("content"), list):
+        return "".join(part.get("text", "") for part in model_output["content"])
+    return str(model_output)
+
+class LocalBatchStore:
+    """
+    Local directory standing in for the S3 input/output buckets of a batch job.
+    Manifests go to <root>/input/, job output is read from <root>/output/.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def input_uri(self, job_name):
+        return str(self.root / "input" / f"{job_name}.jsonl")
+
+    def output_uri(self, job_name):
+        return str(self.root / "output" / job_name)
+
+    def write_manifest(self, job_name, records):
+        path = Path(self.input_uri(job_name))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        return str(path)
+
+    def read_manifest(self, input_uri):
+        with open(input_uri, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def write_output(self, output_uri, name, lines):
+        path = Path(output_uri) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line) + "\n")
+
+    def read_outputs(self, output_uri):
+        for path in sorted(Path(output_uri).rglob("*.jsonl.out")):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+class S3BatchStore:
+    """
+    S3 input/output locations for a real Bedrock batch job: s3://<bucket>/<prefix>/input|output/.
+    """
+
+    def __init__(self, bucket, prefix=""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.s3 = boto3.client("s3")
+
+    def _key(self, *parts):
+        return "/".join(p for p in (self.prefix, *parts) if p)
+
+    def input_uri(self, job_name):
+        return f"s3://{self.bucket}/{self._key('input', f'{job_name}.jsonl')}"
+
+    def output_uri(self, job_name):
+        return f"s3://{self.bucket}/{self._key('output', job_name)}/"
+
+    def write_manifest(self, job_name, records):
+        # Spooled through a temporary file so the manifest is never held in memory whole;
+        # upload_fileobj switches to a multipart upload for large manifests
+        with tempfile.TemporaryFile() as f:
+            for record in records:
+                f.write((json.dumps(record) + "\n").encode("utf-8"))
+            f.seek(0)
+            self.s3.upload_fileobj(f, self.bucket, self._key("input", f"{job_name}.jsonl"))
+        return self.input_uri(job_name)
+
+    def read_outputs(self, output_uri):
+        prefix = output_uri.split(f"s3://{self.bucket}/", 1)[1]
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in sorted(page.get("Contents", []), key=lambda o: o["Key"]):
+                if not obj["Key"].endswith(".jsonl.out"):
+                    continue
+                body = self.s3.get_object(Bucket=self.bucket, Key=obj["Key"])["Body"].read().decode("utf-8")
+                for line in body.splitlines():
+                    if line.strip():
+                        yield json.loads(line)
+
+class BedrockBatchJobRunner:
+    """
+    Submits and polls Bedrock model invocation (batch) jobs. Bedrock enforces a minimum
+    number of records per job, so this is meant for large overnight corpora.
+    """
+
+    def __init__(self, role_arn, region_name=None):
+        self.role_arn = role_arn
+        self.bedrock = boto3.client("bedrock", region_name=region_name)
+
+    def submit(self, job_name, model_id, input_uri, output_uri):
+        response = self.bedrock.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=self.role_arn,
+            modelId=model_id,
+            inputDataConfig={"s3InputDataConfig": {"s3Uri": input_uri}},
+            outputDataConfig={"s3OutputDataConfig": {"s3Uri": output_uri}},
+        )
+        return response["jobArn"]
+
+    def status(self, job_id):
+        return self.bedrock.get_model_invocation_job(jobIdentifier=job_id)["status"]
+
+class LocalBatchJobRunner:
+    """
+    Stand-in for the batch service over a LocalBatchStore: runs every manifest record through
+    invoke(model_input, model_id) and writes Bedrock-format <manifest>.out output. The default
+    invoke calls bedrock-runtime InvokeModel with the record body, which is what the batch
+    service does server-side; pass a stub to run fully offline.
+    """
+
+    def __init__(self, store, invoke=None, max_workers=4):
+        self.store = store
+        self.invoke = invoke or self._invoke_model
+        self.max_workers = max_workers
+        self.jobs = {}
+
+    def _invoke_model(self, model_input, model_id):
+        client = pipeline.get_bedrock_client()
+        response = pipeline.BEDROCK_RATE_LIMITER.call(
+            lambda: client.invoke_model(modelId=model_id, body=json.dumps(model_input)),
+        )
+        return json.loads(response["body"].read())
+
+    def _run_record(self, record, model_id):
+        out = {"recordId": record["recordId"], "modelInput": record["modelInput"]}
+        try:
+            out["modelOutput"] = self.invoke(record["modelInput"], model_id)
+        except Exception as e:
+            out["error"] = {"errorCode": type(e).__name__, "errorMessage": str(e)}
+        return out
+
+    def submit(self, job_name, model_id, input_uri, output_uri):
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            lines = bounded_map(executor, lambda r: self._run_record(r, model_id), self.store.read_manifest(input_uri),
+                                window=2 * self.max_workers)
+            self.store.write_output(str(Path(output_uri) / job_id), f"{Path(input_uri).name}.out", lines)
+        self.jobs[job_id] = "Completed"
+        return job_id
+
+    def status(self, job_id):
+        return self.jobs[job_id]
+
+def prepare_batch_record(pdf_file, chunk_dir, model_id, prompt_version=None):
+    """
+    Renders one PDF and builds its batch records from the same Converse requests the
+    synchronous path sends: one record, or one per chunk ("<lfid>_part<k>") for documents
+    over the per-request limits. Returns (records, metadata); image bytes live only in the
+    records, and metadata keeps their record IDs and response cache keys.
+    """
+    document = pipeline.prepare_document(pdf_file, chunk_dir, prompt_version)
+    lfid = Path(pdf_file).stem
+    metadata = {"lfid": lfid, "pdf_path": Path(pdf_file), "type": document["type"],
+                "prompt_version": document["prompt_version"], "chunks": document["chunks"], "record_ids": [], "cache_keys": []}
+    records = []
+    for k, chunk in enumerate(document["chunks"]):
+        converse_kwargs = pipeline.document_converse_request(document, model_id=model_id, chunk=chunk)
+        record_id = lfid if len(document["chunks"]) == 1 else f"{lfid}_part{k + 1}"
+        records.append({"recordId": record_id, "modelInput": converse_to_model_input(converse_kwargs)})
+        metadata["record_ids"].append(record_id)
+        metadata["cache_keys"].append(pipeline.response_cache_key(converse_kwargs))
+    # Page images are in the records already; don't keep a second copy per document
+    metadata["chunks"] = [{"page_numbers": chunk["page_numbers"]} for chunk in document["chunks"]]
+    return records, metadata
+
+def bounded_map(executor, fn, items, window):
+    """
+    Like executor.map, but keeps at most window calls submitted ahead of the consumer, so
+    finished results don't pile up in memory while earlier ones are still being consumed.
+    """
+    items = iter(items)
+    futures = []
+    for item in items:
+        futures.append(executor.submit(fn, item))
+        if len(futures) >= window:
+            break
+    while futures:
+        result = futures.pop(0).result()
+        for item in items:
+            futures.append(executor.submit(fn, item))
+            break
+        yield result
+
+def process_folder_batch(folder_path, prompt, store, runner, model_id="us.amazon.nova-pro-v1:0",
+                         job_name=None, poll_interval=60, max_workers=4, resume=True):
+    """
+    Batch-mode counterpart of pipeline.process_folder. Every PDF's request is written to one
+    JSONL manifest, submitted as an offline batch job and polled until it finishes; the job
+    output then goes through the same JSON parsing, post-processing and Excel writing.
+    Records are streamed into the manifest as documents are rendered, so only a few
+    documents' page images are in memory at a time.
+    Documents whose response is already in the response cache are not sent, and job output
+    is added to the cache, so sync reruns reuse it. Chunked documents are merged with
+    pipeline.merge_chunk_records. Documents already in the folder's run journal are not
+    prepared or sent again. A document with a record the job returned no output for is
+    journaled as an error, so the next run sends it again, and is reported through
+    pipeline.FolderRunError once the Excel file has been written for the rest.
+    """
+    folder = Path(folder_path)
+    pipeline.clean_chunks_folders(folder)
+    pdf_files = sorted(folder.glob("*.pdf"), key=lambda p: p.name)
+    job_name = sanitize_job_name(job_name) if job_name else default_job_name(folder)
+    journal = pipeline.open_run_journal(folder, resume)
+    prepared = []
+    texts = {}
+    record_errors = {}
+    pending = [0]
+
+    def manifest_records(executor, todo):
+        # Cached replies are kept as text; only uncached records go to the manifest
+        for records, metadata in bounded_map(executor, lambda p: prepare_batch_record(p, folder/"chunks", model_id, prompt),
+                                             todo, window=2 * max_workers):
+            prepared.append(metadata)
+            for record, cache_key in zip(records, metadata["cache_keys"]):
+                cached = pipeline.RESPONSE_CACHE.get(cache_key) if pipeline.RESPONSE_CACHE_MODE == "use" else None
+                if cached is not None:
+                    texts[record["recordId"]] = cached.decode("utf-8")
+                else:
+                    pending[0] += 1
+                    yield record
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fingerprints = dict(zip((p.stem for p in pdf_files),
+                                executor.map(lambda p: pipeline.document_fingerprint(p, prompt, model_id), pdf_files)))
+        done = {lfid: journal.completed(lfid, fingerprint) for lfid, fingerprint in fingerprints.items()}
+        todo = [p for p in pdf_files if done[p.stem] is None]
+        if todo:
+            input_uri = store.write_manifest(job_name, manifest_records(executor, todo))
+    if pending[0]:
+        output_uri = store.output_uri(job_name)
+        job_id = runner.submit(job_name, model_id, input_uri, output_uri)
+        status = runner.status(job_id)
+        while status not in TERMINAL_JOB_STATES:
+            time.sleep(poll_interval)
+            status = runner.status(job_id)
+        if status not in ("Completed", "PartiallyCompleted"):
+            raise RuntimeError(f"Batch job {job_id} ended with status {status}")
+        for line in store.read_outputs(output_uri):
+            if "modelOutput" in line:
+                texts[line["recordId"]] = model_output_text(line["modelOutput"])
+            elif "error" in line:
+                error = line["error"]
+                record_errors[line["recordId"]] = (f"{error.get('errorCode')}: {error.get('errorMessage')}"
+                                                   if isinstance(error, dict) else str(error))
+    results = {lfid: result for lfid, result in done.items() if result is not None}
+    failures = {}
+    for metadata in prepared:
+        lfid = metadata["lfid"]
+        missing = [record_id for record_id in metadata["record_ids"] if record_id not in texts]
+        if missing:
+            failures[lfid] = "; ".join(f"{record_id}: {record_errors.get(record_id, 'no output in the batch job')}"
+                                       for record_id in missing)
+            journal.record(lfid, fingerprints[lfid], error=failures[lfid])
+            continue
+        chunk_jsons, model_responses = [], []
+        for record_id, cache_key in zip(metadata["record_ids"], metadata["cache_keys"]):
+            text = texts[record_id]
+            if pipeline.RESPONSE_CACHE_MODE != "off":
+                pipeline.RESPONSE_CACHE.put(cache_key, text.encode("utf-8"))
+            model_responses.append(pipeline.strip_code_fence(text))
+            chunk_jsons.append(pipeline.parse_model_response(model_responses[-1], metadata["pdf_path"]))
+        if len(chunk_jsons) == 1:
+            result = pipeline.build_pdf_result(metadata["pdf_path"], metadata["type"], chunk_jsons[0], metadata["prompt_version"],
+                                               model_responses[0])
+        else:
+            result = pipeline.build_chunked_pdf_result(metadata["pdf_path"], metadata["type"], metadata["chunks"],
+                                                       chunk_jsons, metadata["prompt_version"], model_responses)
+        results[lfid] = pipeline.normalize_result(result, lfid)
+        journal.record(lfid, fingerprints[lfid], results[lfid])
+    pipeline.write_index_excel(journal.rows([p.stem for p in pdf_files]), folder, model_id)
+    return pipeline.folder_results(pdf_files, results, failures)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract legislation fields from a folder of PDFs with a Bedrock batch inference job.")
+    parser.add_argument("folder_path", help="Folder containing the PDFs to process")
+    parser.add_argument("--store", required=True, help="s3://bucket/prefix for a real job, or a local directory standing in for S3")
+    parser.add_argument("--role-arn", help="IAM service role for the Bedrock batch job (required for s3:// stores)")
+    parser.add_argument("--job-name", default=None, help="Batch job name, sanitized to Bedrock's limits (default: derived from the folder and time)")
+    parser.add_argument("--poll-interval", type=int, default=60, help="Seconds between job status checks")
+    parser.add_argument("--workers", type=int, default=4, help="Threads for rendering PDFs into the manifest")
+    parser.add_argument("--prompt-version", choices=pipeline.list_prompt_versions(), default=pipeline.DEFAULT_PROMPT_VERSION, help="Prompt template from data/prompts")
+    parser.add_argument("--fresh", action="store_true", help=f"Ignore the folder's {pipeline.JOURNAL_FILENAME} and resubmit every PDF")
+    args = parser.parse_args()
+    if args.store.startswith("s3://"):
+        if not args.role_arn:
+            parser.error("--role-arn is required for s3:// stores")
+        bucket, _, prefix = args.store[len("s3://"):].partition("/")
+        store = S3BatchStore(bucket, prefix)
+        runner = BedrockBatchJobRunner(args.role_arn)
+    else:
+        store = LocalBatchStore(args.store)
+        runner = LocalBatchJobRunner(store)
+    try:
+        output, failures = process_folder_batch(
+            args.folder_path, args.prompt_version, store, runner, model_id="us.amazon.nova-pro-v1:0",
+            job_name=args.job_name, poll_interval=args.poll_interval, max_workers=args.workers,
+            resume=not args.fresh,
+        ), {}
+    except pipeline.FolderRunError as e:
+        output, failures = e.results, e.failures
+    print(json.dumps(output, indent=2))
+    for lfid, error in failures.items():
+        print(f"FAILED {lfid}: {error}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,314 @@
+import argparse
+import json
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+import metrics
+import pipeline
+
+DATA_SETS = ("Train", "Test")
+BASELINE_PATH = Path("data/benchmark_baseline.json")
+# A stage regresses when its wall time or peak RSS grows by more than this fraction,
+# or when it does more JPEG encodes than the baseline (those counts are deterministic)
+REGRESSION_TOLERANCE = 0.2
+
+CANNED_RECORD = {
+    "CITY/TOWN": "Springfield", "STATE": "RI", "LEGTYPE": "Ordinance", "LEGNO": "2025-14",
+    "ADOPTION_DATE": "April 28, 2025", "LONG_TITLE_SUMMARY": "An ordinance amending the zoning code",
+    "ACTION_CLASSIFICATION": "Amend", "CHAPTER/TITLE": "17", "ARTICLE": "", "SECTION": "17.04.010",
+    "DISPOSITION": "§17.04.010", "REDLINE": "X",
+}
+CANNED_REPLY = json.dumps([CANNED_RECORD], indent=2)
+# Reply shapes the parsing helpers see in practice
+PARSE_CASES = {
+    "plain": CANNED_REPLY,
+    "fenced": f"```json\n{CANNED_REPLY}\n```",
+    "preamble": f"Here is the extracted data:\n\n{CANNED_REPLY}\n\nLet me know if you need anything else.",
+    "multi_record": json.dumps([CANNED_RECORD] * 8),
+}
+MISSING_COMMAS = json.dumps([CANNED_RECORD] * 8).replace("}, {", "} {")
+
+class CannedConverseClient:
+    """
+    Offline stand-in for the bedrock-runtime client: every converse call returns
+    CANNED_REPLY after an optional fixed latency.
+    """
+
+    def __init__(self, reply=CANNED_REPLY, latency=0.0):
+        self.reply = reply
+        self.latency = latency
+        self.calls = 0
+
+    def converse(self, **converse_kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": self.reply}]}},
+            "stopReason": "end_turn",
+            "usage": {"inputTokens": pipeline.estimate_input_tokens(converse_kwargs), "outputTokens": len(self.reply) // 4,
+                      "totalTokens": pipeline.estimate_input_tokens(converse_kwargs) + len(self.reply) // 4},
+        }
+
+def reset_peak_rss():
+    """
+    Resets the kernel's peak-RSS counter for this process (Linux); returns False where unsupported.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KB on Linux, bytes on macOS; either way it is the process lifetime peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def measure(fn, repeat=1):
+    """
+    Runs fn() repeat times. Returns the fastest wall time, the peak RSS over all runs,
+    the metrics captured in the fastest run and its return value.
+    """
+    best = None
+    reset_peak_rss()
+    for _ in range(repeat):
+        with metrics.capture() as captured:
+            start = time.perf_counter()
+            value = fn()
+            wall = time.perf_counter() - start
+        if best is None or wall < best[0]:
+            best = (wall, captured, value)
+    wall, captured, value = best
+    return wall, peak_rss_mb(), captured, value
+
+def stage_stats(wall, rss, captured, items, bytes_out):
+    counters = captured["counters"]
+    return {
+        "wall_s": round(wall, 4),
+        "peak_rss_mb": round(rss, 1),
+        "items": items,
+        "bytes_out": bytes_out,
+        "jpeg_encodes": counters.get("jpeg_encodes", 0),
+        "jpeg_probe_encodes": counters.get("jpeg_probe_encodes", 0),
+    }
+
+def collect_folders(root, data_sets=DATA_SETS):
+    """
+    The data/<set>/<category> folders that contain PDFs.
+    """
+    folders = []
+    for data_set in data_sets:
+        for folder in sorted((Path(root) / data_set).iterdir()):
+            if folder.is_dir() and any(folder.glob("*.pdf")):
+                folders.append(folder)
+    return folders
+
+def bench_render(pdf_files, repeat):
+    def run():
+        return [pipeline.pdf_to_images(pdf, cache_mode="off", write_chunks=False) for pdf in pdf_files]
+    wall, rss, captured, images = measure(run, repeat)
+    pages = sum(len(doc_images) for doc_images in images)
+    return stage_stats(wall, rss, captured, pages, sum(len(img) for doc_images in images for img in doc_images))
+
+def write_page_pngs(pdf_files, out_dir, max_pages):
+    """
+    Full-DPI PNG renders of the first max_pages pages of each PDF (setup for the
+    file-based compression stages; not timed).
+    """
+    paths = []
+    zoom = pipeline.RENDER_DPI / 72
+    for pdf in pdf_files:
+        with fitz.open(pdf) as doc:
+            for page_num in range(min(max_pages, len(doc))):
+                path = Path(out_dir) / f"{pdf.stem}_{page_num + 1}.png"
+                doc[page_num].get_pixmap(matrix=fitz.Matrix(zoom, zoom)).save(str(path))
+                paths.append(path)
+    return paths
+
+def bench_compress(png_paths, work_dir, repeat):
+    def run():
+        # resize_and_compress_image overwrites its input, so each run starts from fresh copies
+        copies = []
+        for path in png_paths:
+            copy = Path(work_dir) / path.name
+            shutil.copyfile(path, copy)
+            copies.append(copy)
+        start = time.perf_counter()
+        for copy in copies:
+            pipeline.resize_and_compress_image(copy)
+        return copies, time.perf_counter() - start
+    # Only the compression itself counts toward the wall time
+    best = None
+    reset_peak_rss()
+    for _ in range(repeat):
+        with metrics.capture() as captured:
+            copies, wall = run()
+        if best is None or wall < best[0]:
+            best = (wall, captured, sum(c.stat().st_size for c in copies))
+    wall, captured, bytes_out = best
+    return stage_stats(wall, peak_rss_mb(), captured, len(png_paths), bytes_out), copies
+
+def bench_base64(jpeg_paths, repeat):
+    def run():
+        for path in jpeg_paths:
+            pipeline.ensure_base64_under_limit(path)
+        return sum(path.stat().st_size for path in jpeg_paths)
+    wall, rss, captured, bytes_out = measure(run, repeat)
+    stats = stage_stats(wall, rss, captured, len(jpeg_paths), bytes_out)
+    stats["base64_recompressions"] = captured["counters"].get("base64_recompressions", 0)
+    return stats
+
+def bench_parse(iterations, repeat):
+    def run():
+        parsed = 0
+        for _ in range(iterations):
+            for reply in PARSE_CASES.values():
+                json.loads(pipeline.extract_json_from_response(pipeline.strip_code_fence(reply)))
+                parsed += 1
+            json.loads(pipeline.fix_missing_commas_in_json_array(MISSING_COMMAS))
+            parsed += 1
+        return parsed
+    wall, rss, captured, parsed = measure(run, repeat)
+    return stage_stats(wall, rss, captured, parsed, 0)
+
+def bench_end_to_end(folders, work_dir, repeat, latency):
+    """
+    process_folder over copies of the data folders with the canned client; response
+    and page caches are off so every run renders and "calls" the model.
+    """
+    client = CannedConverseClient(latency=latency)
+    pipeline._BEDROCK_CLIENT = client
+
+    def run():
+        bytes_out = 0
+        for folder in folders:
+            # Not named Train/Test, so write_index_excel keeps its output inside the copy
+            copy = Path(work_dir) / f"bench-{folder.parent.name}" / folder.name
+            shutil.rmtree(copy, ignore_errors=True)
+            copy.mkdir(parents=True)
+            for pdf in folder.glob("*.pdf"):
+                shutil.copyfile(pdf, copy / pdf.name)
+            pipeline.process_folder(copy, None, resume=False)
+            bytes_out += sum(p.stat().st_size for p in copy.iterdir() if p.suffix in (".xlsx", ".jsonl"))
+        return bytes_out
+    wall, rss, captured, bytes_out = measure(run, repeat)
+    stats = stage_stats(wall, rss, captured, client.calls // repeat, bytes_out)
+    stats["api_requests"] = client.calls // repeat
+    return stats
+
+def run_benchmarks(data_root="data", data_sets=DATA_SETS, stages=None, limit=None, max_pages=2, repeat=1,
+                   parse_iterations=2000, latency=0.0):
+    """
+    Runs the selected stages ("render", "compress", "base64", "parse", "end_to_end") over
+    the PDFs in data_root/<set>/<category> and returns {stage: stats}. Everything runs
+    offline: caches are off and Bedrock is replaced by CannedConverseClient.
+    """
+    stages = stages or ("render", "compress", "base64", "parse", "end_to_end")
+    folders = collect_folders(data_root, data_sets)
+    pdf_files = sorted((p for folder in folders for p in folder.glob("*.pdf")), key=lambda p: (p.parent.as_posix(), p.name))
+    if limit:
+        pdf_files = pdf_files[:limit]
+        folders = sorted({p.parent for p in pdf_files})
+    pipeline.configure_response_cache(mode="off")
+    pipeline.configure_page_cache(mode="off")
+    pipeline.configure_rate_limiter(requests_per_second=1000, max_requests_per_second=1000)
+    results = {"_meta": {"pdfs": len(pdf_files), "folders": len(folders), "repeat": repeat,
+                         "render_workers": pipeline.RENDER_WORKERS, "python": sys.version.split()[0]}}
+    work_dir = Path(tempfile.mkdtemp(prefix="pipeline-bench-"))
+    try:
+        if "render" in stages:
+            results["render"] = bench_render(pdf_files, repeat)
+        if "compress" in stages or "base64" in stages:
+            png_dir = work_dir / "png"
+            png_dir.mkdir()
+            jpeg_dir = work_dir / "jpeg"
+            jpeg_dir.mkdir()
+            png_paths = write_page_pngs(pdf_files, png_dir, max_pages)
+            stats, jpeg_paths = bench_compress(png_paths, jpeg_dir, repeat)
+            if "compress" in stages:
+                results["compress"] = stats
+            if "base64" in stages:
+                results["base64"] = bench_base64(jpeg_paths, repeat)
+        if "parse" in stages:
+            results["parse"] = bench_parse(parse_iterations, repeat)
+        if "end_to_end" in stages:
+            results["end_to_end"] = bench_end_to_end(folders, work_dir, repeat, latency)
+    finally:
+        pipeline._BEDROCK_CLIENT = None
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def compare_to_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Returns a list of human-readable regressions of results against baseline.
+    """
+    regressions = []
+    for stage, stats in results.items():
+        base = baseline.get(stage)
+        if stage.startswith("_") or not base:
+            continue
+        for key in ("wall_s", "peak_rss_mb"):
+            if base.get(key) and stats[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{stage}: {key} {stats[key]} vs baseline {base[key]} (+{stats[key] / base[key] - 1:.0%})")
+        for key in ("jpeg_encodes", "jpeg_probe_encodes"):
+            if stats.get(key, 0) > base.get(key, 0) and base.get("items") == stats["items"]:
+                regressions.append(f"{stage}: {key} {stats[key]} vs baseline {base[key]}")
+    return regressions
+
+def format_results(results, baseline=None):
+    baseline = baseline or {}
+    lines = [f"{'stage':<12}{'items':>8}{'wall s':>10}{'base s':>10}{'peak MB':>10}{'bytes out':>14}{'encodes':>9}{'probes':>8}"]
+    for stage, stats in results.items():
+        if stage.startswith("_"):
+            continue
+        base = baseline.get(stage, {}).get("wall_s")
+        lines.append(f"{stage:<12}{stats['items']:>8}{stats['wall_s']:>10.3f}{(f'{base:.3f}' if base else '-'):>10}"
+                     f"{stats['peak_rss_mb']:>10.1f}{stats['bytes_out']:>14,}{stats['jpeg_encodes']:>9}{stats['jpeg_probe_encodes']:>8}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the local pipeline stages over the bundled Train/Test PDFs, offline.")
+    parser.add_argument("--data-root", default="data", help="Folder holding the Train/Test sets (default: data)")
+    parser.add_argument("--sets", nargs="+", default=list(DATA_SETS), help="Data sets to include (default: Train Test)")
+    parser.add_argument("--stages", nargs="+", choices=("render", "compress", "base64", "parse", "end_to_end"), default=None, help="Stages to run (default: all)")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N PDFs")
+    parser.add_argument("--max-pages", type=int, default=2, help="Pages per PDF for the file-based compress/base64 stages")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is reported")
+    parser.add_argument("--render-workers", type=int, default=1, help="Render pool processes (default: 1, in-process)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the canned client sleeps per request in end_to_end")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help=f"Baseline JSON to compare against (default: {BASELINE_PATH})")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="Allowed slowdown/RSS growth before a stage is flagged (fraction)")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    pipeline.configure_render_pool(workers=args.render_workers)
+    results = run_benchmarks(args.data_root, args.sets, args.stages, args.limit, args.max_pages, args.repeat, latency=args.latency)
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() and not args.save_baseline else {}
+    print(format_results(results, baseline))
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"Baseline written to {baseline_path}")
+    elif baseline:
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
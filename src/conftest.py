@@ -0,0 +1,62 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+import converse_stub
+import debug_log
+import pipeline
+from rate_limiter import RateLimiter
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SAMPLE_FOLDER = REPO_ROOT / "data" / "Test" / "Amends"
+
+@pytest.fixture
+def sample_folder(tmp_path, monkeypatch):
+    """
+    A folder with copies of the sample PDFs, with the pipeline's caches and render pool
+    off. The test runs in tmp_path (with data/ linked in) so logs stay out of the repo.
+    """
+    folder = tmp_path / "pdfs"
+    folder.mkdir()
+    for pdf in sorted(SAMPLE_FOLDER.glob("*.pdf")):
+        shutil.copy(pdf, folder)
+    (tmp_path / "data").symlink_to(REPO_ROOT / "data")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("AWS_DEFAULT_REGION", raising=False)
+    monkeypatch.delenv("AWS_REGION", raising=False)
+    monkeypatch.setattr(pipeline, "RESPONSE_CACHE_MODE", "off")
+    monkeypatch.setattr(pipeline, "PAGE_CACHE_MODE", "off")
+    monkeypatch.setattr(pipeline, "RENDER_WORKERS", 1)
+    monkeypatch.setattr(pipeline, "BEDROCK_RATE_LIMITER", RateLimiter(requests_per_second=50.0, max_requests_per_second=50.0))
+    debug_log.configure_debug_log(path=tmp_path / "bedrock_api_debug.log")
+    yield folder
+    debug_log.stop_debug_log()
+
+@pytest.fixture
+def stub_server():
+    """
+    Starts converse_stub servers: stub_server(**options) returns (server, endpoint_url).
+    """
+    servers = []
+
+    def start(**options):
+        server, url = converse_stub.serve_in_thread(**options)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def stub_bedrock(stub_server, monkeypatch):
+    """
+    A converse_stub server with the pipeline's shared client pointed at it, unsigned.
+    """
+    monkeypatch.setattr(pipeline, "BEDROCK_CLIENT_CONFIG", dict(pipeline.BEDROCK_CLIENT_CONFIG))
+    server, url = stub_server(latency=0.01)
+    pipeline.configure_bedrock_client(endpoint_url=url, sign=False)
+    yield server
+    pipeline.configure_bedrock_client()
@@ -0,0 +1,286 @@
+import argparse
+import csv
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote
+
+LABELS_PATH = Path("data/labels_test.csv")
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+REPLY_MODES = ("canned", "sampled")
+# Injected server-side failures, as (HTTP status, x-amzn-ErrorType); all are retried by rate_limiter
+INJECTED_ERRORS = (
+    (500, "InternalServerException"),
+    (503, "ServiceUnavailableException"),
+    (408, "ModelTimeoutException"),
+)
+CANNED_RECORD = {
+    "CITY/TOWN": "Springfield", "STATE": "RI", "LEGTYPE": "Ordinance", "LEGNO": "2025-14",
+    "ADOPTION_DATE": "April 28, 2025", "LONG_TITLE_SUMMARY": "An ordinance amending the zoning code",
+    "ACTION_CLASSIFICATION": "Amend", "CHAPTER/TITLE": "17", "ARTICLE": "", "SECTION": "17.04.010",
+    "DISPOSITION": "§17.04.010", "REDLINE": "",
+}
+MALFORMED_REPLY = "I'm sorry, I could not find any legislation details in these images."
+# Characters of model text per contentBlockDelta event of a streamed reply
+STREAM_DELTA_CHARS = 24
+
+def event_stream_message(headers, payload):
+    """
+    One binary frame of the AWS event-stream encoding (vnd.amazon.eventstream): prelude with
+    total and header lengths and its CRC32, string-valued headers, payload, message CRC32.
+    """
+    header_bytes = b""
+    for name, value in headers.items():
+        name, value = name.encode("utf-8"), value.encode("utf-8")
+        header_bytes += struct.pack(">B", len(name)) + name + struct.pack(">BH", 7, len(value)) + value
+    prelude = struct.pack(">II", 12 + len(header_bytes) + len(payload) + 4, len(header_bytes))
+    message = prelude + struct.pack(">I", zlib.crc32(prelude)) + header_bytes + payload
+    return message + struct.pack(">I", zlib.crc32(message))
+
+def converse_stream_events(text, usage):
+    """
+    The ConverseStream events of a reply: messageStart, the text in STREAM_DELTA_CHARS
+    contentBlockDelta pieces, contentBlockStop, messageStop and the trailing metadata.
+    """
+    events = [("messageStart", {"role": "assistant"})]
+    for i in range(0, len(text), STREAM_DELTA_CHARS):
+        events.append(("contentBlockDelta", {"contentBlockIndex": 0, "delta": {"text": text[i:i + STREAM_DELTA_CHARS]}}))
+    events += [
+        ("contentBlockStop", {"contentBlockIndex": 0}),
+        ("messageStop", {"stopReason": "end_turn"}),
+        ("metadata", {"usage": usage, "metrics": {"latencyMs": 0}}),
+    ]
+    return [
+        event_stream_message(
+            {":event-type": event_type, ":content-type": "application/json", ":message-type": "event"},
+            json.dumps(payload).encode("utf-8"),
+        )
+        for event_type, payload in events
+    ]
+
+def load_label_records(path=LABELS_PATH):
+    """
+    Turns a labels CSV (a flags banner row, then the header) into model-style records.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    header = rows[1]
+    records = []
+    for row in rows[2:]:
+        label = dict(zip(header, row))
+        if not label.get("LFID"):
+            continue
+        records.append({
+            "CITY/TOWN": "", "STATE": label.get("STATE", ""), "LEGTYPE": label.get("LEGTYPE", ""),
+            "LEGNO": label.get("LEGNO", ""), "ADOPTION_DATE": label.get("ADOPTION_DATE", ""),
+            "LONG_TITLE_SUMMARY": " ".join(label.get("LONG_TITLE", "").split()),
+            "ACTION_CLASSIFICATION": label.get("ACTION_CLASSIFICATION", ""), "CHAPTER/TITLE": "",
+            "ARTICLE": "", "SECTION": "", "DISPOSITION": label.get("DISPOSITION", ""),
+            "REDLINE": "X" if label.get("Redline", "").strip() else "",
+        })
+    return records
+
+class ConverseStubServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the bedrock-runtime Converse REST endpoint
+    (POST /model/<modelId>/converse and /converse-stream), for load and retry testing
+    without Bedrock.
+
+    Every request sleeps for a latency drawn from latency_dist (mean latency seconds,
+    spread latency_jitter), then may be throttled (429 ThrottlingException) at random with
+    throttle_rate or when it exceeds the max_rps quota, fail with a random INJECTED_ERRORS
+    entry at error_rate, or return a non-JSON reply at malformed_rate. Otherwise it answers
+    with CANNED_RECORD ("canned") or a record sampled from the labels CSV ("sampled"). The
+    request doesn't say which PDF it is, so a sampled record is picked by a hash of the
+    request body: realistic field values, stable per document, but not that document's
+    labels, so sampled replies can't be scored against the CSV. converse-stream replies
+    carry the same text as event-stream frames ending in the metadata event. GET /stats
+    returns the request counters.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.5, latency_jitter=0.0, latency_dist="fixed", throttle_rate=0.0,
+                 max_rps=None, error_rate=0.0, malformed_rate=0.0, reply_mode="canned", labels_path=LABELS_PATH, seed=None):
+        if reply_mode not in REPLY_MODES:
+            raise ValueError(f"Unknown reply mode {reply_mode!r}; expected one of {REPLY_MODES}")
+        super().__init__(address, ConverseStubHandler)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.latency_dist = latency_dist
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.records = load_label_records(labels_path) if reply_mode == "sampled" else [CANNED_RECORD]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = float(max_rps or 0)
+        self.refilled_at = time.monotonic()
+        self.started_at = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "throttled": 0, "errors": 0, "malformed": 0}
+
+    def draw_latency(self):
+        with self.lock:
+            if self.latency_dist == "uniform":
+                value = self.random.uniform(self.latency - self.latency_jitter, self.latency + self.latency_jitter)
+            elif self.latency_dist == "normal":
+                value = self.random.gauss(self.latency, self.latency_jitter)
+            elif self.latency_dist == "lognormal":
+                # latency is the median; latency_jitter is sigma of the underlying normal
+                value = self.latency * self.random.lognormvariate(0.0, self.latency_jitter)
+            else:
+                value = self.latency
+        return max(0.0, value)
+
+    def admit(self):
+        """
+        Decides a request's fate: "throttle", an INJECTED_ERRORS entry, "malformed" or "ok".
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.max_rps:
+                now = time.monotonic()
+                self.tokens = min(self.max_rps, self.tokens + (now - self.refilled_at) * self.max_rps)
+                self.refilled_at = now
+                if self.tokens < 1:
+                    self.stats["throttled"] += 1
+                    return "throttle"
+                self.tokens -= 1
+            draw = self.random.random()
+            if draw < self.throttle_rate:
+                self.stats["throttled"] += 1
+                return "throttle"
+            if draw < self.throttle_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return self.random.choice(INJECTED_ERRORS)
+            if draw < self.throttle_rate + self.error_rate + self.malformed_rate:
+                self.stats["malformed"] += 1
+                return "malformed"
+            self.stats["ok"] += 1
+            return "ok"
+
+    def stats_snapshot(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started_at
+            return {**self.stats, "elapsed_s": round(elapsed, 1),
+                    "ok_per_minute": round(self.stats["ok"] * 60 / elapsed, 1) if elapsed else 0.0}
+
+class ConverseStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, error_type=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if error_type:
+            self.send_header("x-amzn-ErrorType", f"{error_type}:http://internal.amazon.com/coral/com.amazonaws.bedrock/")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self.send_json(200, self.server.stats_snapshot())
+        else:
+            self.send_json(404, {"message": f"Unknown path {self.path}"}, "ResourceNotFoundException")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "model" or parts[2] not in ("converse", "converse-stream"):
+            self.send_json(404, {"message": f"Unknown path {self.path}"}, "ResourceNotFoundException")
+            return
+        server = self.server
+        fate = server.admit()
+        # Throttling is decided on arrival and answered at once, like the real service
+        if fate == "throttle":
+            self.send_json(429, {"message": "Too many requests, please wait before trying again."}, "ThrottlingException")
+            return
+        time.sleep(server.draw_latency())
+        if isinstance(fate, tuple):
+            status, error_type = fate
+            self.send_json(status, {"message": f"Injected {error_type}"}, error_type)
+            return
+        if fate == "malformed":
+            text = MALFORMED_REPLY
+        else:
+            index = int(hashlib.sha256(body).hexdigest(), 16) % len(server.records)
+            text = json.dumps([server.records[index]], indent=2, ensure_ascii=False)
+        input_tokens = max(1, len(body) // 4)
+        output_tokens = max(1, len(text) // 4)
+        usage = {"inputTokens": input_tokens, "outputTokens": output_tokens, "totalTokens": input_tokens + output_tokens}
+        if parts[2] == "converse-stream":
+            self.send_event_stream(converse_stream_events(text, usage))
+            return
+        self.send_json(200, {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "stopReason": "end_turn",
+            "usage": usage,
+            "metrics": {"latencyMs": 0},
+            "modelId": unquote(parts[1]),
+        })
+
+    def send_event_stream(self, messages):
+        """
+        Sends event-stream frames as HTTP chunks, one per event, as ConverseStream does.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for message in messages:
+                self.wfile.write(f"{len(message):x}\r\n".encode("ascii") + message + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early (e.g. a derailed reply)
+            self.close_connection = True
+
+def serve_in_thread(host="127.0.0.1", port=0, **options):
+    """
+    Starts a ConverseStubServer on a background thread; returns (server, endpoint_url).
+    Call server.shutdown() when done.
+    """
+    server = ConverseStubServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Bedrock Converse stub for load and retry testing.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8089, help="Port to listen on (default: 8089)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean (median for lognormal) response latency in seconds")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="Latency spread: half-width (uniform), SD (normal) or sigma (lognormal)")
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="fixed", help="Latency distribution")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with ThrottlingException")
+    parser.add_argument("--max-rps", type=float, default=None, help="Simulated quota; requests above it are throttled")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with a 5xx/timeout error")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of replies that are prose instead of JSON")
+    parser.add_argument("--replies", choices=REPLY_MODES, default="canned", help="canned record, or records sampled from --labels (not matched to the document)")
+    parser.add_argument("--labels", default=str(LABELS_PATH), help=f"Labels CSV for --replies sampled (default: {LABELS_PATH})")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible fault injection")
+    args = parser.parse_args()
+    server = ConverseStubServer(
+        (args.host, args.port), latency=args.latency, latency_jitter=args.latency_jitter, latency_dist=args.latency_dist,
+        throttle_rate=args.throttle_rate, max_rps=args.max_rps, error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate, reply_mode=args.replies, labels_path=args.labels, seed=args.seed,
+    )
+    print(f"Converse stub listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats_snapshot()), flush=True)
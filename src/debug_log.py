@@ -0,0 +1,82 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+LOGGER_NAME = "bedrock_api"
+DEBUG_LOG_PATH = os.path.join(os.getcwd(), "bedrock_api_debug.log")
+LOG_FORMAT = "[%(asctime)s] [%(levelname)s] [%(threadName)s] %(message)s"
+
+_LOGGER = logging.getLogger(LOGGER_NAME)
+_LISTENER = None
+_LISTENER_LOCK = threading.Lock()
+
+def _stop_listener():
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        for handler in _LISTENER.handlers:
+            handler.close()
+        _LISTENER = None
+
+def _start_listener(level, path, max_bytes, backup_count):
+    global _LISTENER
+    _stop_listener()
+    file_handler = logging.handlers.RotatingFileHandler(
+        path or DEBUG_LOG_PATH, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True,
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    _LISTENER = logging.handlers.QueueListener(log_queue, file_handler)
+    _LOGGER.handlers = [logging.handlers.QueueHandler(log_queue)]
+    _LOGGER.setLevel(level)
+    _LOGGER.propagate = False
+    _LISTENER.start()
+
+def configure_debug_log(level="INFO", path=None, max_bytes=10_000_000, backup_count=5):
+    """
+    Routes the Bedrock debug log through a queue to a background thread that owns a
+    rotating file handler (path, default bedrock_api_debug.log in the working directory;
+    rotated at max_bytes with backup_count old files kept). Callers only enqueue
+    records, so concurrent workers never contend on the file. Payload dumps are logged at
+    DEBUG and only serialized when level is DEBUG.
+    """
+    with _LISTENER_LOCK:
+        _start_listener(level, path, max_bytes, backup_count)
+
+def stop_debug_log():
+    """
+    Flushes queued records and stops the writer thread (also runs at exit).
+    """
+    with _LISTENER_LOCK:
+        _stop_listener()
+
+atexit.register(stop_debug_log)
+
+def get_debug_logger():
+    """
+    Returns the shared Bedrock logger, configuring the default file log on first use.
+    """
+    if _LISTENER is None:
+        with _LISTENER_LOCK:
+            if _LISTENER is None:
+                _start_listener("INFO", None, 10_000_000, 5)
+    return _LOGGER
+
+class RedactedPayload:
+    """
+    Wraps a Converse request for logging. It is serialized (with image bytes replaced by
+    [BINARY]) only when a handler formats the record, i.e. never below DEBUG.
+    """
+
+    def __init__(self, converse_kwargs):
+        self.converse_kwargs = converse_kwargs
+
+    def __str__(self):
+        return json.dumps(
+            self.converse_kwargs, indent=2,
+            default=lambda o: "[BINARY]" if isinstance(o, (bytes, bytearray)) else str(o),
+        )
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import threading
+import uuid
+from pathlib import Path
+
+def content_key(*parts):
+    """
+    Builds a SHA-256 cache key from str/bytes parts. Each part is length-prefixed so
+    different splits of the same bytes never collide.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+class DiskCache:
+    """
+    Content-addressed on-disk blob store with size-bounded LRU eviction.
+
+    Entries live at <root>/<key[:2]>/<key>. Reads refresh the entry's mtime, which is the
+    LRU clock; once the total size exceeds max_bytes the least recently used entries are
+    deleted. Writes go through a temp file + os.replace, so concurrent writers (threads or
+    processes) never expose a partial entry.
+    """
+
+    def __init__(self, root, max_bytes=2_000_000_000):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def _path(self, key):
+        return self.root / key[:2] / key
+
+    def _entries(self):
+        if not self.root.exists():
+            return []
+        return [p for p in self.root.glob("*/*") if p.is_file() and not p.name.endswith(".tmp")]
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        try:
+            previous_size = path.stat().st_size
+        except FileNotFoundError:
+            previous_size = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(p.stat().st_size for p in self._entries())
+            else:
+                self._total_bytes += len(data) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for p in self._entries():
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        # Evict down to 90% so we don't rescan on every subsequent put
+        target = int(self.max_bytes * 0.9)
+        for _, size, p in entries:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+
+    def clear(self):
+        with self._lock:
+            for p in self._entries():
+                p.unlink(missing_ok=True)
+            self._total_bytes = 0
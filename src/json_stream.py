@@ -0,0 +1,88 @@
+import json
+
+class StreamDerailed(Exception):
+    """
+    Raised by IncrementalJSONParser when the model output clearly isn't going to be JSON.
+    """
+
+class IncrementalJSONParser:
+    """
+    Incremental parser for model output that should be a JSON array of objects (or a single object).
+
+    Text is fed in arbitrary chunks as it streams in; feed() returns every record whose
+    closing brace arrived in that chunk: each element object of a top-level array, or the
+    top-level object itself. Markdown code fences around the JSON are tolerated. If more
+    than max_preamble_chars of non-whitespace prose arrive before the JSON starts, feed()
+    raises StreamDerailed so the caller can stop paying for output tokens.
+    """
+
+    def __init__(self, max_preamble_chars=200):
+        self.max_preamble_chars = max_preamble_chars
+        self.preamble_chars = 0
+        self.started = False
+        self.done = False
+        self.root = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.record_chars = []
+        self.records = []
+        self.invalid_records = []
+
+    def feed(self, text):
+        emitted = []
+        for ch in text:
+            if self.done:
+                break
+            if not self.started:
+                if ch in "[{":
+                    self.started = True
+                    self.root = ch
+                elif not ch.isspace() and ch != "`":
+                    self.preamble_chars += 1
+                    if self.preamble_chars > self.max_preamble_chars:
+                        raise StreamDerailed(f"more than {self.max_preamble_chars} characters of preamble before any JSON")
+                    continue
+                else:
+                    continue
+            record = self._consume(ch)
+            if record is not None:
+                emitted.append(record)
+        return emitted
+
+    def _consume(self, ch):
+        # Depth at which record objects live: 1 for a bare object, 2 inside an array
+        record_depth = 1 if self.root == "{" else 2
+        if self.depth >= record_depth:
+            self.record_chars.append(ch)
+        elif ch == "{" and self.depth == record_depth - 1:
+            self.record_chars = [ch]
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+            return None
+        if ch == '"':
+            self.in_string = True
+        elif ch in "[{":
+            self.depth += 1
+        elif ch in "]}":
+            self.depth -= 1
+            if self.depth <= 0:
+                self.done = True
+            if ch == "}" and self.depth == record_depth - 1:
+                return self._emit("".join(self.record_chars))
+        return None
+
+    def _emit(self, raw):
+        self.record_chars = []
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            self.invalid_records.append(raw)
+            return None
+        self.records.append(record)
+        return record
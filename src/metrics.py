@@ -0,0 +1,146 @@
+import contextlib
+import contextvars
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# Summary rows come in pipeline order; stages not listed here follow in first-seen order
+STAGE_ORDER = ("open", "filter", "text_layer", "render", "rasterize", "compress", "build", "api", "parse", "postprocess")
+
+_DOCUMENT = contextvars.ContextVar("metrics_document", default=None)
+_CAPTURE = contextvars.ContextVar("metrics_capture", default=None)
+
+def new_record():
+    return {"timings": {}, "counters": {}}
+
+def add_to(record, timings=None, counters=None):
+    for name, seconds in (timings or {}).items():
+        record["timings"][name] = record["timings"].get(name, 0.0) + seconds
+    for name, n in (counters or {}).items():
+        record["counters"][name] = record["counters"].get(name, 0) + n
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+class RunMetrics:
+    """
+    Per-document stage timings (seconds, summed over calls) and counters for one run.
+    Thread-safe; work done outside any document is kept under lfid None.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = OrderedDict()
+
+    def reset(self):
+        with self._lock:
+            self._documents = OrderedDict()
+
+    def add(self, lfid, timings=None, counters=None):
+        with self._lock:
+            add_to(self._documents.setdefault(lfid, new_record()), timings, counters)
+
+    def documents(self):
+        """
+        A snapshot: [{"lfid", "timings", "counters"}] in first-seen order.
+        """
+        with self._lock:
+            return [{"lfid": lfid, "timings": dict(r["timings"]), "counters": dict(r["counters"])}
+                    for lfid, r in self._documents.items()]
+
+    def write_jsonl(self, path):
+        """
+        Writes one JSON line per document and returns the path.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for doc in self.documents():
+                f.write(json.dumps(doc) + "\n")
+        return path
+
+    def summary_table(self):
+        """
+        Plain-text table: per stage, the number of documents, total/mean/p95/max seconds
+        per document; then every counter's total.
+        """
+        docs = self.documents()
+        stages = list(OrderedDict.fromkeys(
+            [s for s in STAGE_ORDER if any(s in d["timings"] for d in docs)]
+            + [s for d in docs for s in d["timings"]]
+        ))
+        lines = [f"{'stage':<14}{'docs':>6}{'total s':>10}{'mean s':>10}{'p95 s':>10}{'max s':>10}"]
+        for stage in stages:
+            values = [d["timings"][stage] for d in docs if stage in d["timings"]]
+            lines.append(f"{stage:<14}{len(values):>6}{sum(values):>10.3f}{sum(values) / len(values):>10.3f}"
+                         f"{percentile(values, 0.95):>10.3f}{max(values):>10.3f}")
+        counters = OrderedDict()
+        for d in docs:
+            for name, n in d["counters"].items():
+                counters[name] = counters.get(name, 0) + n
+        if counters:
+            lines.append("")
+            lines.append(f"{'counter':<24}{'total':>16}")
+            lines += [f"{name:<24}{n:>16,}" for name, n in counters.items()]
+        return "\n".join(lines)
+
+METRICS = RunMetrics()
+
+def _record(timings=None, counters=None):
+    captured = _CAPTURE.get()
+    if captured is not None:
+        add_to(captured, timings, counters)
+    else:
+        METRICS.add(_DOCUMENT.get(), timings, counters)
+
+@contextlib.contextmanager
+def document(lfid):
+    """
+    Attributes everything timed or counted inside the block (in this thread or task) to lfid.
+    """
+    token = _DOCUMENT.set(lfid)
+    try:
+        yield
+    finally:
+        _DOCUMENT.reset(token)
+
+def add_time(stage, seconds):
+    _record(timings={stage: seconds})
+
+@contextlib.contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(stage, time.perf_counter() - start)
+
+def count(name, n=1):
+    _record(counters={name: n})
+
+@contextlib.contextmanager
+def capture():
+    """
+    Collects the block's timings and counters into the yielded record instead of METRICS,
+    e.g. in a worker process, whose record the parent then passes to merge().
+    """
+    captured = new_record()
+    token = _CAPTURE.set(captured)
+    try:
+        yield captured
+    finally:
+        _CAPTURE.reset(token)
+
+def merge(captured):
+    _record(captured["timings"], captured["counters"])
+
+def bind(fn):
+    """
+    Wraps fn to run in (a copy of) the caller's context, so work handed to a thread pool
+    is still attributed to the current document.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
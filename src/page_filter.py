@@ -0,0 +1,127 @@
+import re
+
+import fitz
+from PIL import Image, ImageStat
+
+# Pages whose text layer has fewer characters than this get the pixel-level checks
+MIN_TEXT_CHARS = 40
+# Thumbnail used for the pixel checks; long side in pixels
+THUMBNAIL_DIM = 256
+# A low-text page is blank if its thumbnail is this flat or has this little ink
+BLANK_MAX_STDDEV = 6.0
+BLANK_MAX_INK_FRACTION = 0.002
+INK_THRESHOLD = 160
+# Difference-hash size (bits = HASH_SIZE ** 2) and the max Hamming distance for a near-duplicate
+HASH_SIZE = 16
+DUPLICATE_MAX_DISTANCE = 8
+# Pages of an appendix/exhibit kept before the rest of it is dropped
+APPENDIX_KEEP_PAGES = 2
+
+# Only the start of a page's text is matched, so a passing mention in the body never drops a page
+BOILERPLATE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r"^\W*(legal notice|notice of (a )?public hearing)\b",
+    r"^\W*(affidavit|proof|certificate) of publication\b",
+)]
+APPENDIX_PATTERN = re.compile(r"^\W*((?:exhibit|appendix|attachment)\s+[A-Z0-9]{1,3})\b", re.IGNORECASE)
+# A page opening with one of these is back in the legislation itself (more sections, or the
+# signature and adoption block after an exhibit), so it ends the current appendix
+LEGISLATION_HEADING_PATTERN = re.compile(
+    r"^\W*(section|article|chapter|ordinance|resolution|local\s+law|bill|be\s+it|now,?\s+therefore|"
+    r"adopted|passed|approved|enacted|attest|in\s+witness\s+whereof)\b",
+    re.IGNORECASE,
+)
+BLANK_PAGE_PATTERN = re.compile(r"intentionally\s+(left\s+)?blank", re.IGNORECASE)
+
+def page_thumbnail(page, max_dim=THUMBNAIL_DIM):
+    """
+    Renders a small grayscale image of the page; costs a fraction of the full-DPI render.
+    """
+    zoom = max_dim / max(page.rect.width, page.rect.height, 1)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+def is_blank_image(img):
+    if ImageStat.Stat(img).stddev[0] <= BLANK_MAX_STDDEV:
+        return True
+    ink = sum(img.histogram()[:INK_THRESHOLD])
+    return ink / (img.width * img.height) <= BLANK_MAX_INK_FRACTION
+
+def difference_hash(img, hash_size=HASH_SIZE):
+    """
+    Perceptual (difference) hash: one bit per horizontally adjacent pixel pair of a
+    (hash_size+1) x hash_size downscale. Near-identical scans differ in only a few bits.
+    """
+    small = img.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = px[row * (hash_size + 1) + col]
+            bits = (bits << 1) | (left > px[row * (hash_size + 1) + col + 1])
+    return bits
+
+def normalized_text(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def select_pages(doc, pages):
+    """
+    Decides which pages of an open fitz document are worth sending to the model.
+
+    pages is analyze_pdf's per-page metadata. Returns (kept, dropped): the kept page
+    indices in order and a {page_index: reason} dict. The first and last pages are always
+    kept (the last usually holds the signatures and adoption date).
+    Pages are dropped as "blank" (no ink, or an intentionally-blank notice), "duplicate"
+    (same content stream, same text, or for text-less scans a near-identical perceptual
+    hash), "boilerplate" (legal notices and publication affidavits) or "appendix" (the
+    pages of an exhibit/appendix beyond the first APPENDIX_KEEP_PAGES, up to the next
+    page that opens with a legislation heading).
+    """
+    kept = []
+    dropped = {}
+    seen_content = set()
+    seen_text = set()
+    seen_hashes = []
+    appendix_pages = 0
+    appendix_label = None
+    last_index = pages[-1]["index"] if pages else 0
+    for meta in pages:
+        index = meta["index"]
+        text = meta["text"]
+        head = text[:200]
+        appendix = APPENDIX_PATTERN.match(head) if index else None
+        # A running "Exhibit A" header continues the appendix; a new label starts another one
+        label = normalized_text(appendix.group(1)) if appendix else None
+        if appendix and label != appendix_label:
+            appendix_pages, appendix_label = 1, label
+        elif appendix_pages and (appendix or not LEGISLATION_HEADING_PATTERN.match(head)):
+            appendix_pages += 1
+        else:
+            appendix_pages, appendix_label = 0, None
+        reason = None
+        if appendix_pages > APPENDIX_KEEP_PAGES:
+            reason = "appendix"
+        elif any(p.match(head) for p in BOILERPLATE_PATTERNS):
+            reason = "boilerplate"
+        elif meta["text_length"] < 200 and BLANK_PAGE_PATTERN.search(text):
+            reason = "blank"
+        elif meta["text_length"] >= MIN_TEXT_CHARS:
+            key = normalized_text(text)
+            if key in seen_text or meta["content_hash"] in seen_content:
+                reason = "duplicate"
+            seen_text.add(key)
+        else:
+            thumbnail = page_thumbnail(doc[index])
+            page_hash = difference_hash(thumbnail)
+            if is_blank_image(thumbnail):
+                reason = "blank"
+            elif meta["content_hash"] in seen_content or any(
+                    bin(page_hash ^ h).count("1") <= DUPLICATE_MAX_DISTANCE for h in seen_hashes):
+                reason = "duplicate"
+            if reason is None:
+                seen_hashes.append(page_hash)
+        seen_content.add(meta["content_hash"])
+        if reason is None or index in (0, last_index):
+            kept.append(index)
+        else:
+            dropped[index] = reason
+    return kept, dropped
@@ -5,39 +5,190 @@ from pathlib import Path
 import fitz  # PyMuPDF
 import boto3
 import base64
+import hashlib
 import io
 from PIL import Image
 import re
-import csv
-import time
 import botocore
+import botocore.config
 import datetime
+import time
+import argparse
+import functools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import pandas as pd
 from zoneinfo import ZoneInfo
+import metrics
+from debug_log import RedactedPayload, configure_debug_log, get_debug_logger
+from rate_limiter import RateLimiter
+from disk_cache import DiskCache, content_key
+from json_stream import IncrementalJSONParser, StreamDerailed
+from page_filter import MIN_TEXT_CHARS, select_pages
+from prompt_templates import DEFAULT_PROMPT_VERSION, list_prompt_versions, load_prompt_template
+from rule_extractor import extract_fields, format_hints
+from run_journal import RunJournal
+from text_layer import format_document_text, page_markup_text
 
-def detect_pdf_type(pdf_path):
-    doc = fitz.open(pdf_path)
-    has_text = False
+# Model families that accept Converse cachePoint blocks (prompt caching)
+PROMPT_CACHING_MODELS = ("amazon.nova-", "claude-3-7-sonnet", "claude-3-5-haiku", "claude-sonnet-4", "claude-opus-4")
+# Shared by every Converse call in the process; see configure_rate_limiter
+BEDROCK_RATE_LIMITER = RateLimiter()
+# One bedrock-runtime client per process; see get_bedrock_client / configure_bedrock_client
+BEDROCK_CLIENT_CONFIG = {"max_pool_connections": 50, "connect_timeout": 10, "read_timeout": 300, "endpoint_url": None, "sign": True,
+                         "region_name": None}
+_BEDROCK_CLIENT = None
+_BEDROCK_CLIENT_LOCK = threading.Lock()
+# Raw model text keyed by the full request content; see configure_response_cache
+RESPONSE_CACHE = DiskCache(os.path.join(os.getcwd(), ".cache", "bedrock_responses"), max_bytes=500_000_000)
+# "use" reads and writes the cache, "refresh" ignores hits but stores new responses, "off" bypasses it
+RESPONSE_CACHE_MODE = "use"
+CACHE_MODES = ("use", "refresh", "off")
+# Final compressed JPEG per page keyed by PDF content hash and render settings; see configure_page_cache
+PAGE_CACHE = DiskCache(os.path.join(os.getcwd(), ".cache", "page_images"), max_bytes=2_000_000_000)
+PAGE_CACHE_MODE = "use"
+RENDER_DPI = 300
+MAX_IMAGE_DIM = 4096
+# Crop each page to the bounding box of its drawn content before rendering
+CLIP_TO_CONTENT = False
+# Process pool for rendering long documents; see configure_render_pool
+RENDER_WORKERS = os.cpu_count() or 1
+RENDER_POOL_MIN_PAGES = 4
+_RENDER_POOL = None
+_RENDER_POOL_LOCK = threading.Lock()
+# PyMuPDF isn't thread-safe (MuPDF's global context is shared by every document), so
+# fitz calls from the worker threads go through this lock; rendering runs in parallel
+# only in the render process pool, where each worker has its own MuPDF
+FITZ_LOCK = threading.RLock()
+# Drop blank, duplicate and boilerplate pages before rendering; see page_filter.select_pages.
+# Off until it has been compared against sending every page on the labelled set
+FILTER_PAGES = False
+# Send the text layer (with strikethrough markup) instead of every page image for "text" PDFs
+TEXT_FIRST = False
+# Rule-based pre-extraction for "text" PDFs: "off" or "hints" (add to the prompt); see
+# prepare_document. Off until the hints have been compared against the plain prompt on the
+# labelled set
+RULES_MODE = "off"
+RULES_MODES = ("off", "hints")
+# Per-request limits for the images of one Converse call, example images included; larger
+# documents are split into chunks that are sent concurrently and merged (see plan_page_chunks)
+MAX_IMAGES_PER_REQUEST = 20
+MAX_REQUEST_IMAGE_BYTES = 15_000_000
+CHUNK_WORKERS = 4
+# Debug aid: also write each rendered page to <folder>/chunks/<stem>_<page>.jpg
+WRITE_CHUNK_FILES = False
+# Per-folder run journal; finished documents are skipped when a run is restarted
+JOURNAL_FILENAME = "run_journal.jsonl"
+
+def detect_pdf_type(doc):
+    """
+    Classifies an open PDF as "text", "scanned" or "other". Stops at the first page with
+    text, since nothing after it can change the answer.
+    """
     has_images = False
     for page in doc:
         if page.get_text().strip():
-            has_text = True
-        img_list = page.get_images(full=True)
-        if img_list:
+            return "text"
+        if not has_images and page.get_images(full=True):
             has_images = True
-    if has_text:
-        return "text"
-    elif has_images:
-        return "scanned"
-    else:
-        return "other"
+    return "scanned" if has_images else "other"
 
-def resize_and_compress_image(image_path, max_size_bytes=3_700_000, max_dim=4096, jpeg_quality_min=30):
+def page_details(doc):
     """
-    Resize and compress an image to fit within max_size_bytes and max_dim (pixels).
-    Uses JPEG for better compression. Overwrites the original image if changes are made.
+    Per-page metadata for the page filter, text-first mode and rules: the page text, its
+    length and the content-stream hash.
     """
-    with Image.open(image_path) as img:
+    pages = []
+    for page in doc:
+        text = page.get_text().strip()
+        pages.append({
+            "index": page.number,
+            "text": text,
+            "text_length": len(text),
+            "content_hash": hashlib.sha256(page.read_contents()).hexdigest(),
+        })
+    return pages
+
+def analyze_pdf(pdf_path, details=False):
+    """
+    Opens the PDF once and collects what the later stages need: the file's SHA-256, the
+    text/scanned/other type (see detect_pdf_type) and, with details, per-page metadata
+    (see page_details; None otherwise). The open fitz document is kept under "doc" so
+    rendering can reuse it; release it with close_analysis.
+    """
+    with metrics.timed("open"):
+        data = Path(pdf_path).read_bytes()
+        with FITZ_LOCK:
+            doc = fitz.open(stream=data, filetype="pdf")
+            pdf_type = detect_pdf_type(doc)
+            pages = page_details(doc) if details else None
+            page_count = len(doc)
+    metrics.count("pages", page_count)
+    metrics.count("pdf_bytes", len(data))
+    return {
+        "path": Path(pdf_path),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "type": pdf_type,
+        "page_count": page_count,
+        "pages": pages,
+        "doc": doc,
+    }
+
+def close_analysis(analysis):
+    doc = analysis.pop("doc", None)
+    if doc is not None:
+        with FITZ_LOCK:
+            doc.close()
+
+def base64_length(n_bytes):
+    """
+    Exact length of the base64 encoding of n_bytes bytes (4 chars per 3-byte group, padded).
+    """
+    return 4 * ((n_bytes + 2) // 3)
+
+def encode_jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def jpeg_byte_budget(max_size_bytes, max_b64_bytes):
+    """
+    Largest raw JPEG size that satisfies both the raw and the base64 limit. Base64 expands
+    by exactly 4/3 (rounded up to a 4-char group), so this is computed once up front.
+    """
+    return min(max_size_bytes, (max_b64_bytes // 4) * 3)
+
+def predict_jpeg_quality(img, full_size_at_max, budget, quality_max, quality_min, probe_factor=4):
+    """
+    Picks the highest JPEG quality predicted to fit the budget, using a downscaled probe image.
+    The probe is calibrated against the real full-size encode at quality_max, then binary
+    searched over quality, so the full-resolution image is never re-encoded during the search.
+    """
+    probe = img.reduce(probe_factor) if min(img.size) >= probe_factor * 64 else img
+    scale = full_size_at_max / max(1, len(encode_jpeg(probe, quality_max)))
+    metrics.count("jpeg_probe_encodes")
+    lo, hi, best = quality_min, quality_max - 1, quality_min
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        metrics.count("jpeg_probe_encodes")
+        # 5% headroom for the probe's prediction error
+        if len(encode_jpeg(probe, mid)) * scale <= budget * 0.95:
+            best, lo = mid, mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+def compress_image(img, max_size_bytes=3_700_000, max_dim=MAX_IMAGE_DIM, jpeg_quality_min=30, max_b64_bytes=5_000_000, jpeg_quality_max=85):
+    """
+    Resize and compress a PIL image to fit within max_size_bytes, the base64 limit
+    max_b64_bytes and max_dim (pixels). Returns the JPEG bytes.
+    Typically takes one full-resolution encode, at most three in the normal case:
+    quality_max, the predicted quality, and a predicted downscale if quality alone can't fit.
+    """
+    with metrics.timed("compress"):
+        budget = jpeg_byte_budget(max_size_bytes, max_b64_bytes)
         # Convert to RGB for JPEG
         if img.mode != "RGB":
             img = img.convert("RGB")
@@ -46,133 +197,621 @@ def resize_and_compress_image(image_path, max_size_bytes=3_700_000, max_dim=4096
             scale = max_dim / max(img.size)
             new_size = tuple([int(x * scale) for x in img.size])
             img = img.resize(new_size, Image.LANCZOS)
-        # Compress to fit size
-        quality = 85
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG", quality=quality, optimize=True)
-        while buffer.tell() > max_size_bytes and quality > jpeg_quality_min:
-            quality -= 5
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=quality, optimize=True)
-            if buffer.tell() <= max_size_bytes:
-                break
-            # If still too large, reduce dimensions further
-            img = img.resize((int(img.size[0]*0.9), int(img.size[1]*0.9)), Image.LANCZOS)
-        # Save back to disk as JPEG
-        with open(image_path, "wb") as f:
-            f.write(buffer.getvalue())
+        data = encode_jpeg(img, jpeg_quality_max)
+        metrics.count("jpeg_encodes")
+        if len(data) <= budget:
+            return data
+        quality = predict_jpeg_quality(img, len(data), budget, jpeg_quality_max, jpeg_quality_min)
+        data = encode_jpeg(img, quality)
+        metrics.count("jpeg_encodes")
+        # JPEG size scales roughly with pixel area, so one predicted downscale usually fits;
+        # keep shrinking as a safety net for pathological images.
+        while len(data) > budget and max(img.size) > 500:
+            scale = min(0.9, (budget * 0.9 / len(data)) ** 0.5)
+            img = img.resize((max(1, int(img.size[0]*scale)), max(1, int(img.size[1]*scale))), Image.LANCZOS)
+            data = encode_jpeg(img, quality)
+            metrics.count("jpeg_encodes")
+        return data
+
+def limit_base64_size(jpeg_bytes, max_b64_bytes=5_000_000):
+    """
+    Ensures the base64-encoded image is under the Bedrock limit. If not, re-targets it with compress_image.
+    The base64 size is computed from the byte count, so nothing is actually encoded.
+    """
+    metrics.count("base64_checks")
+    if base64_length(len(jpeg_bytes)) <= max_b64_bytes:
+        return jpeg_bytes
+    metrics.count("base64_recompressions")
+    with Image.open(io.BytesIO(jpeg_bytes)) as img:
+        return compress_image(img, max_size_bytes=len(jpeg_bytes), max_b64_bytes=max_b64_bytes, jpeg_quality_max=60, jpeg_quality_min=20)
+
+def resize_and_compress_image(image_path, max_size_bytes=3_700_000, max_dim=4096, jpeg_quality_min=30):
+    """
+    File-based wrapper around compress_image. Overwrites image_path with the JPEG result.
+    """
+    with Image.open(image_path) as img:
+        data = compress_image(img, max_size_bytes=max_size_bytes, max_dim=max_dim, jpeg_quality_min=jpeg_quality_min)
+    with open(image_path, "wb") as f:
+        f.write(data)
 
 def ensure_base64_under_limit(image_path, max_b64_bytes=5_000_000):
     """
-    Ensures the base64-encoded image is under the Bedrock limit. If not, further compresses.
+    File-based wrapper around limit_base64_size. Rewrites image_path only if it had to shrink.
     """
     with open(image_path, "rb") as img_file:
-        b64 = base64.b64encode(img_file.read())
-    if len(b64) <= max_b64_bytes:
-        return
-    # If too large, further reduce size/quality
-    with Image.open(image_path) as img:
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-        quality = 60
-        while len(b64) > max_b64_bytes and quality >= 20:
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=quality, optimize=True)
-            with open(image_path, "wb") as f:
-                f.write(buffer.getvalue())
-            with open(image_path, "rb") as img_file:
-                b64 = base64.b64encode(img_file.read())
-            quality -= 10
-        # If still too large, reduce dimensions
-        while len(b64) > max_b64_bytes and max(img.size) > 500:
-            img = img.resize((int(img.size[0]*0.9), int(img.size[1]*0.9)), Image.LANCZOS)
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=quality, optimize=True)
-            with open(image_path, "wb") as f:
-                f.write(buffer.getvalue())
-            with open(image_path, "rb") as img_file:
-                b64 = base64.b64encode(img_file.read())
-
-def pdf_to_images(pdf_path, output_dir):
-    doc = fitz.open(pdf_path)
-    output_dir = Path(output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
-    image_paths = []
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        pix = page.get_pixmap(dpi=300)
-        img_path = output_dir / f"{Path(pdf_path).stem}_{page_num+1}.jpg"
-        pix.save(str(img_path))
-        resize_and_compress_image(img_path)  # Ensure image fits raw size limit
-        ensure_base64_under_limit(img_path)  # Ensure base64 fits Bedrock limit
-        image_paths.append(img_path)
-    return image_paths
+        original = img_file.read()
+    data = limit_base64_size(original, max_b64_bytes=max_b64_bytes)
+    if data is not original:
+        with open(image_path, "wb") as f:
+            f.write(data)
+
+def content_clip(page, margin=18):
+    """
+    Bounding box of everything drawn on the page (text, images, vector graphics), padded by
+    margin points and clamped to the page. Returns None for blank or rotated pages.
+    """
+    if page.rotation:
+        return None
+    bbox = fitz.Rect()
+    for _, rect in page.get_bboxlog():
+        bbox |= fitz.Rect(rect)
+    if bbox.is_empty:
+        return None
+    bbox = fitz.Rect(bbox.x0 - margin, bbox.y0 - margin, bbox.x1 + margin, bbox.y1 + margin)
+    return bbox & page.rect
+
+def render_page_image(page, dpi=RENDER_DPI, max_dim=MAX_IMAGE_DIM, clip_to_content=None):
+    """
+    Rasterizes a PyMuPDF page straight into a PIL image and returns the size-limited JPEG bytes.
+    The zoom is chosen per page so the pixmap comes out at or just under max_dim pixels
+    (never above dpi), instead of rendering oversized plats at full DPI and downsampling.
+    """
+    clip_to_content = CLIP_TO_CONTENT if clip_to_content is None else clip_to_content
+    clip = content_clip(page) if clip_to_content else None
+    rect = clip or page.rect
+    # -1 px keeps rounding in get_pixmap from landing one pixel over max_dim
+    zoom = min(dpi / 72, (max_dim - 1) / max(rect.width, rect.height, 1))
+    with metrics.timed("rasterize"):
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip)
+        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    return compress_image(img, max_dim=max_dim)
+
+def configure_render_pool(workers=None, min_pages=None):
+    """
+    Sets the page-rendering process pool size (independent of the Bedrock worker count)
+    and the page count at which a document is fanned out to it. workers <= 1 disables the pool.
+    """
+    global RENDER_WORKERS, RENDER_POOL_MIN_PAGES, _RENDER_POOL
+    with _RENDER_POOL_LOCK:
+        if _RENDER_POOL is not None:
+            _RENDER_POOL.shutdown(wait=True)
+            _RENDER_POOL = None
+        if workers is not None:
+            RENDER_WORKERS = workers
+        if min_pages is not None:
+            RENDER_POOL_MIN_PAGES = min_pages
+
+def get_render_pool():
+    """
+    Returns the shared rendering process pool, creating it on first use (None if disabled).
+    Workers are spawned rather than forked because the parent runs Bedrock threads.
+    """
+    global _RENDER_POOL
+    if RENDER_WORKERS <= 1:
+        return None
+    with _RENDER_POOL_LOCK:
+        if _RENDER_POOL is None:
+            _RENDER_POOL = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _RENDER_POOL
+
+# Per-worker-process open documents, so a worker rendering several pages of one PDF opens it once.
+# Keyed by (path, mtime, size) so a PDF replaced at the same path is reopened rather than
+# rendered stale into PAGE_CACHE under the new file's hash.
+_WORKER_DOCS = OrderedDict()
+
+def render_page_in_worker(pdf_path, page_num, dpi, max_dim, clip_to_content):
+    """
+    Process-pool entry point: renders one page using this worker's own fitz handle.
+    Returns (jpeg_bytes, captured metrics) for the parent to merge.
+    """
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_mtime_ns, stat.st_size)
+    for stale in [k for k in _WORKER_DOCS if k[0] == pdf_path and k != key]:
+        _WORKER_DOCS.pop(stale).close()
+    doc = _WORKER_DOCS.pop(key, None) or fitz.open(pdf_path)
+    _WORKER_DOCS[key] = doc
+    while len(_WORKER_DOCS) > 4:
+        _WORKER_DOCS.popitem(last=False)[1].close()
+    with metrics.capture() as captured:
+        img_bytes = render_page_image(doc[page_num], dpi=dpi, max_dim=max_dim, clip_to_content=clip_to_content)
+    return img_bytes, captured
+
+def configure_page_cache(mode="use", cache_dir=None, max_bytes=2_000_000_000):
+    """
+    Sets the page-image cache mode ("use", "refresh" or "off") and location.
+    """
+    global PAGE_CACHE, PAGE_CACHE_MODE
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unknown cache mode {mode!r}; expected one of {CACHE_MODES}")
+    PAGE_CACHE_MODE = mode
+    if cache_dir is not None or max_bytes != PAGE_CACHE.max_bytes:
+        PAGE_CACHE = DiskCache(cache_dir or PAGE_CACHE.root, max_bytes=max_bytes)
+    return PAGE_CACHE
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def page_cache_key(pdf_hash, page_num, dpi=RENDER_DPI):
+    """
+    Key for one rendered page. Includes every setting that changes the output bytes, so
+    changing DPI, clipping or the compression limits never serves a stale image.
+    """
+    settings = {
+        "dpi": dpi,
+        "max_dim": MAX_IMAGE_DIM,
+        "clip_to_content": CLIP_TO_CONTENT,
+        "compress_image": compress_image.__defaults__,
+    }
+    return content_key("page-v4", pdf_hash, str(page_num), json.dumps(settings, sort_keys=True))
+
+def pdf_to_images(pdf_path, output_dir=None, cache_mode=None, write_chunks=None, analysis=None, pages=None, pool_min_pages=None):
+    """
+    Renders each page (or only the page indices in pages) to a size-limited JPEG and
+    returns the JPEG bytes in that order.
+    Pages already in PAGE_CACHE (same PDF bytes and settings) are reused instead of re-rendered.
+    Chunk files are only written to output_dir when write_chunks (default WRITE_CHUNK_FILES) is set.
+    Pass the analyze_pdf result as analysis to reuse its open document and content hash.
+    Documents with at least pool_min_pages (default RENDER_POOL_MIN_PAGES) pages to render
+    go to the render process pool; the PDF is only opened in this thread when it isn't.
+    """
+    cache_mode = cache_mode or PAGE_CACHE_MODE
+    write_chunks = WRITE_CHUNK_FILES if write_chunks is None else write_chunks
+    pool_min_pages = RENDER_POOL_MIN_PAGES if pool_min_pages is None else pool_min_pages
+    doc = analysis.get("doc") if analysis is not None else None
+    owns_doc = False
+    if doc is None and pages is None:
+        with FITZ_LOCK:
+            doc, owns_doc = fitz.open(pdf_path), True
+            pages = range(len(doc))
+    if write_chunks and output_dir is not None:
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        output_dir = None
+    pdf_hash = None
+    if cache_mode != "off":
+        pdf_hash = analysis["sha256"] if analysis is not None else file_sha256(pdf_path)
+    page_nums = list(range(analysis["page_count"])) if pages is None else list(pages)
+    images = {page_num: None for page_num in page_nums}
+    cache_keys = {page_num: page_cache_key(pdf_hash, page_num) if pdf_hash else None for page_num in page_nums}
+    if cache_mode == "use":
+        images = {page_num: PAGE_CACHE.get(key) if key else None for page_num, key in cache_keys.items()}
+    misses = [page_num for page_num, img_bytes in images.items() if img_bytes is None]
+    pool = get_render_pool() if misses and len(misses) >= pool_min_pages else None
+    if pool is not None:
+        futures = {
+            page_num: pool.submit(render_page_in_worker, str(pdf_path), page_num, RENDER_DPI, MAX_IMAGE_DIM, CLIP_TO_CONTENT)
+            for page_num in misses
+        }
+        rendered = {}
+        for page_num, future in futures.items():
+            rendered[page_num], captured = future.result()
+            metrics.merge(captured)
+    else:
+        with FITZ_LOCK:
+            if misses and doc is None:
+                doc, owns_doc = fitz.open(pdf_path), True
+            rendered = {page_num: render_page_image(doc[page_num]) for page_num in misses}
+    metrics.count("pages_rendered", len(misses))
+    metrics.count("page_cache_hits", len(page_nums) - len(misses))
+    for page_num, img_bytes in rendered.items():
+        images[page_num] = img_bytes
+        if cache_keys[page_num]:
+            PAGE_CACHE.put(cache_keys[page_num], img_bytes)
+    if output_dir is not None:
+        for page_num, img_bytes in images.items():
+            (output_dir / f"{Path(pdf_path).stem}_{page_num+1}.jpg").write_bytes(img_bytes)
+    if owns_doc:
+        with FITZ_LOCK:
+            doc.close()
+    return [images[page_num] for page_num in page_nums]
+
+def load_image_bytes(image):
+    """
+    Returns JPEG bytes for an in-memory image (bytes) or an image file path.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    with open(image, "rb") as img_file:
+        return img_file.read()
 
 def image_to_base64(image_path):
     with open(image_path, "rb") as img_file:
         return base64.b64encode(img_file.read()).decode("utf-8")
 
-def ask_bedrock_vision_model(document_image_paths, example_image_paths, prompt, model_id="us.amazon.nova-pro-v1:0"):
+def configure_rate_limiter(requests_per_second=1.0, tokens_per_minute=None, max_requests_per_second=10.0, max_retries=5):
     """
-    Sends all document images first, then all example images, with a dynamically constructed prompt.
+    Replaces the shared Bedrock rate limiter (e.g. to match the account's Converse quotas).
     """
-    debug_log_path = os.path.join(os.getcwd(), 'bedrock_api_debug.log')
-    client = boto3.client("bedrock-runtime")
-    max_retries = 5
-    delay = 2
-    # Read all document images
-    doc_images_bytes = []
-    for img_path in document_image_paths:
-        with open(img_path, "rb") as img_file:
-            doc_images_bytes.append(img_file.read())
-    # Read all example images
-    ex_images_bytes = []
-    for ex_path in example_image_paths:
-        with open(ex_path, "rb") as ex_img_file:
-            ex_images_bytes.append(ex_img_file.read())
+    global BEDROCK_RATE_LIMITER
+    BEDROCK_RATE_LIMITER = RateLimiter(
+        requests_per_second=requests_per_second,
+        tokens_per_minute=tokens_per_minute,
+        max_requests_per_second=max_requests_per_second,
+        max_retries=max_retries,
+    )
+    return BEDROCK_RATE_LIMITER
+
+def configure_bedrock_client(max_pool_connections=50, connect_timeout=10, read_timeout=300, endpoint_url=None, sign=True,
+                             region_name=None):
+    """
+    Sets the connection pool size and timeouts for the shared client; the next
+    get_bedrock_client call builds a fresh client with them. endpoint_url points the
+    client at a Converse-compatible server such as converse_stub; sign=False sends
+    unsigned requests, so no AWS credentials are needed for a local stub. region_name
+    defaults to the AWS configuration's region, or us-east-1 if none is configured.
+    """
+    global _BEDROCK_CLIENT
+    with _BEDROCK_CLIENT_LOCK:
+        BEDROCK_CLIENT_CONFIG.update(
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            endpoint_url=endpoint_url,
+            sign=sign,
+            region_name=region_name,
+        )
+        _BEDROCK_CLIENT = None
+
+def get_bedrock_client():
+    """
+    Returns the process-wide bedrock-runtime client, creating it on first use.
+    boto3 clients are thread-safe, so every worker shares one client and its HTTPS
+    connection pool instead of re-resolving credentials and endpoints per call.
+    Retries are left to BEDROCK_RATE_LIMITER, so botocore's own retries are disabled.
+    """
+    global _BEDROCK_CLIENT
+    if _BEDROCK_CLIENT is not None:
+        return _BEDROCK_CLIENT
+    with _BEDROCK_CLIENT_LOCK:
+        if _BEDROCK_CLIENT is None:
+            # Same fallback as AsyncConverseClient, so a local stub works without any AWS config
+            region_name = boto3.session.Session(region_name=BEDROCK_CLIENT_CONFIG["region_name"]).region_name or "us-east-1"
+            config = botocore.config.Config(
+                max_pool_connections=BEDROCK_CLIENT_CONFIG["max_pool_connections"],
+                connect_timeout=BEDROCK_CLIENT_CONFIG["connect_timeout"],
+                read_timeout=BEDROCK_CLIENT_CONFIG["read_timeout"],
+                retries={"max_attempts": 1, "mode": "standard"},
+                signature_version=None if BEDROCK_CLIENT_CONFIG["sign"] else botocore.UNSIGNED,
+            )
+            _BEDROCK_CLIENT = boto3.client("bedrock-runtime", config=config, region_name=region_name,
+                                           endpoint_url=BEDROCK_CLIENT_CONFIG["endpoint_url"])
+        return _BEDROCK_CLIENT
+
+def configure_response_cache(mode="use", cache_dir=None, max_bytes=500_000_000):
+    """
+    Sets the default response cache mode ("use", "refresh" or "off") and location.
+    """
+    global RESPONSE_CACHE, RESPONSE_CACHE_MODE
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unknown cache mode {mode!r}; expected one of {CACHE_MODES}")
+    RESPONSE_CACHE_MODE = mode
+    if cache_dir is not None or max_bytes != RESPONSE_CACHE.max_bytes:
+        RESPONSE_CACHE = DiskCache(cache_dir or RESPONSE_CACHE.root, max_bytes=max_bytes)
+    return RESPONSE_CACHE
+
+def converse_content_parts(converse_kwargs):
+    """
+    Flattens the user message content of a Converse request into hashable parts, in order.
+    """
+    parts = []
+    for message in converse_kwargs["messages"]:
+        for block in message["content"]:
+            if "text" in block:
+                parts += ["text", block["text"]]
+            elif "image" in block:
+                parts += ["image", block["image"]["format"], block["image"]["source"]["bytes"]]
+            else:
+                parts.append(json.dumps(block, sort_keys=True))
+    return parts
+
+def response_cache_key(converse_kwargs):
+    """
+    Cache key over everything that determines the model's answer: model id, inference
+    config and every prompt text and image byte, in the order they are sent.
+    """
+    return content_key(
+        "converse-v2",
+        converse_kwargs["modelId"],
+        json.dumps(converse_kwargs.get("inferenceConfig", {}), sort_keys=True),
+        json.dumps(converse_kwargs.get("system", []), sort_keys=True),
+        *converse_content_parts(converse_kwargs),
+    )
+
+def converse_response_text(response_body):
+    """
+    Returns the raw model text from a Converse response (or a string fallback).
+    """
+    if "output" in response_body and "message" in response_body["output"]:
+        content = response_body["output"]["message"]["content"]
+        text_parts = [part["text"] for part in content if "text" in part]
+        if text_parts:
+            return "".join(text_parts)
+        return str(content)
+    return str(response_body)
+
+def strip_code_fence(text):
+    code_block = re.match(r"^```(?:json)?\s*([\s\S]+?)\s*```$", text.strip())
+    if code_block:
+        return code_block.group(1).strip()
+    return text.strip()
+
+def estimate_input_tokens(converse_kwargs):
+    """
+    Rough pre-call token estimate used to gate the tokens/min budget (~4 chars per text
+    token, ~1 token per 750 px for images, capped at the per-image maximum).
+    """
+    tokens = 0
+    for message in converse_kwargs["messages"]:
+        for block in message["content"]:
+            if "text" in block:
+                tokens += len(block["text"]) // 4
+            elif "image" in block:
+                try:
+                    with Image.open(io.BytesIO(block["image"]["source"]["bytes"])) as img:
+                        tokens += min(1600, (img.size[0] * img.size[1]) // 750)
+                except Exception:
+                    tokens += 1600
+    return tokens
+
+def supports_prompt_caching(model_id):
+    """
+    True for Bedrock models that accept cachePoint blocks in Converse requests.
+    """
+    return any(name in model_id for name in PROMPT_CACHING_MODELS)
+
+@functools.lru_cache(maxsize=32)
+def read_example_image(path):
+    """
+    Example images are read from disk once per process and reused for every document.
+    """
+    with open(path, "rb") as ex_img_file:
+        return ex_img_file.read()
+
+def build_converse_request(document_images, example_image_paths, prompt, model_id="us.amazon.nova-pro-v1:0", static_prompt=None, document_text=None):
+    """
+    Builds the Converse request. document_images may be JPEG bytes (from pdf_to_images) or image file paths.
+    document_text, if given, is sent as a delimited text block right after the document images.
+
+    Without static_prompt: the prompt, then all document images, then all example images.
+    With static_prompt: a fixed prefix (static_prompt, then the example images) followed by
+    the per-document part (document images, then prompt). The prefix is byte-identical for
+    every document, so on models that support it a cachePoint marks it for prompt caching.
+    """
+    start = time.perf_counter()
+    doc_images_bytes = [load_image_bytes(image) for image in document_images]
+    ex_images_bytes = [read_example_image(str(ex_path)) for ex_path in example_image_paths]
     # Build messages for Converse API
-    content = [{"text": prompt}]
-    for img_bytes in doc_images_bytes:
-        content.append({"image": {"format": "jpeg", "source": {"bytes": img_bytes}}})
-    for img_bytes in ex_images_bytes:
-        content.append({"image": {"format": "jpeg", "source": {"bytes": img_bytes}}})
+    if static_prompt is None:
+        content = [{"text": prompt}]
+        for img_bytes in doc_images_bytes:
+            content.append({"image": {"format": "jpeg", "source": {"bytes": img_bytes}}})
+        if document_text is not None:
+            content.append({"text": f"--- DOCUMENT TEXT ---\n{document_text}\n--- END DOCUMENT TEXT ---"})
+        for img_bytes in ex_images_bytes:
+            content.append({"image": {"format": "jpeg", "source": {"bytes": img_bytes}}})
+    else:
+        content = [{"text": static_prompt}]
+        for img_bytes in ex_images_bytes:
+            content.append({"image": {"format": "jpeg", "source": {"bytes": img_bytes}}})
+        if supports_prompt_caching(model_id):
+            content.append({"cachePoint": {"type": "default"}})
+        for img_bytes in doc_images_bytes:
+            content.append({"image": {"format": "jpeg", "source": {"bytes": img_bytes}}})
+        if document_text is not None:
+            content.append({"text": f"--- DOCUMENT TEXT ---\n{document_text}\n--- END DOCUMENT TEXT ---"})
+        content.append({"text": prompt})
     messages = [{"role": "user", "content": content}]
-    converse_kwargs = {
+    metrics.count("images_sent", len(doc_images_bytes) + len(ex_images_bytes))
+    metrics.count("bytes_sent", sum(len(b["image"]["source"]["bytes"]) if "image" in b else len(b.get("text", "").encode("utf-8")) for b in content))
+    metrics.add_time("build", time.perf_counter() - start)
+    return {
         "modelId": model_id,
         "messages": messages,
         "inferenceConfig": {"temperature": 0.0, "topP": 0.1}
     }
-    # Log the full payload (with image bytes redacted)
-    safe_converse_kwargs = json.loads(json.dumps(converse_kwargs, default=lambda o: '[BINARY]' if isinstance(o, (bytes, bytearray)) else str(o)))
-    with open(debug_log_path, 'a', encoding='utf-8') as dbg:
-        dbg.write(f"[{datetime.datetime.now().isoformat()}] [DEBUG] converse_kwargs payload (image bytes redacted):\n{json.dumps(safe_converse_kwargs, indent=2)}\n")
-    for attempt in range(max_retries):
+
+def document_converse_request(document, model_id="us.amazon.nova-pro-v1:0", chunk=None):
+    """
+    Builds the Converse request for a prepare_document result, or for one of its
+    document["chunks"].
+    """
+    part = chunk or document
+    return build_converse_request(
+        part["page_images"], document["example_image_paths"], part["prompt"],
+        model_id=model_id, static_prompt=document.get("static_prompt"), document_text=part.get("document_text"),
+    )
+
+def serialize_converse_request(converse_kwargs):
+    """
+    Returns a JSON-safe copy of a Converse request with image bytes base64-encoded, i.e. the
+    wire format of the Converse REST API (modelId is left in; REST callers move it to the URL).
+    """
+    def encode(value):
+        if isinstance(value, (bytes, bytearray)):
+            return base64.b64encode(value).decode("ascii")
+        if isinstance(value, dict):
+            return {k: encode(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [encode(v) for v in value]
+        return value
+    return encode(converse_kwargs)
+
+def count_usage(usage):
+    """
+    Adds a Converse `usage` block to the current document's counters.
+    """
+    metrics.count("requests")
+    for key, name in (("inputTokens", "input_tokens"), ("outputTokens", "output_tokens"),
+                      ("cacheReadInputTokens", "cache_read_tokens"), ("cacheWriteInputTokens", "cache_write_tokens")):
+        if usage and usage.get(key):
+            metrics.count(name, usage[key])
+
+def invoke_converse(converse_kwargs, cache_mode=None):
+    """
+    Sends a Converse request through the shared client and rate limiter (which retries
+    throttling with backoff) and returns the model text with any code fence stripped.
+    Responses are cached on disk by request content; cache_mode overrides RESPONSE_CACHE_MODE.
+    """
+    log = get_debug_logger()
+    cache_mode = cache_mode or RESPONSE_CACHE_MODE
+    limiter = BEDROCK_RATE_LIMITER
+    model_id = converse_kwargs["modelId"]
+    cache_key = None
+    if cache_mode != "off":
+        cache_key = response_cache_key(converse_kwargs)
+        if cache_mode == "use":
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                metrics.count("response_cache_hits")
+                log.debug("Response cache hit %s for %s", cache_key[:12], model_id)
+                return strip_code_fence(cached.decode("utf-8"))
+    client = get_bedrock_client()
+    # Full payload (image bytes redacted); only serialized when DEBUG is enabled
+    log.debug("converse_kwargs payload (image bytes redacted):\n%s", RedactedPayload(converse_kwargs))
+
+    def log_retry(attempt, exc, delay):
+        metrics.count("retries")
+        log.warning("Bedrock call failed (%s: %s); retry %d/%d in %.1fs (rate now %.2f req/s)",
+                    type(exc).__name__, exc, attempt, limiter.max_retries, delay, limiter.rate)
+
+    estimated_tokens = estimate_input_tokens(converse_kwargs)
+    try:
+        # API latency includes rate-limiter waits and retries
+        with metrics.timed("api"):
+            response = limiter.call(
+                lambda: client.converse(**converse_kwargs),
+                tokens=estimated_tokens,
+                usage_tokens=lambda r: r.get("usage", {}).get("totalTokens"),
+                on_retry=log_retry,
+            )
+        count_usage(response.get("usage"))
+        log.debug("Received response from Bedrock. Keys: %s", list(response.keys()))
+    except Exception:
+        log.exception("Exception in invoke_converse for %s", model_id)
+        raise
+    text = converse_response_text(response)
+    if cache_key is not None:
+        RESPONSE_CACHE.put(cache_key, text.encode("utf-8"))
+    return strip_code_fence(text)
+
+def invoke_converse_stream(converse_kwargs, on_record=None, max_preamble_chars=200, cache_mode=None):
+    """
+    Streaming counterpart of invoke_converse using ConverseStream. Text deltas are fed to an
+    IncrementalJSONParser and on_record(record) is called as soon as each JSON object closes.
+    Once the JSON is complete the rest of the stream is read without parsing, up to the
+    trailing metadata event, so token usage is counted and reconciled with the rate limiter.
+    A reply that derails into prose is abandoned at once; it is returned as-is (so parsing
+    falls back to raw_response) and not cached. Returns the model text with any code fence
+    stripped.
+    """
+    log = get_debug_logger()
+    cache_mode = cache_mode or RESPONSE_CACHE_MODE
+    limiter = BEDROCK_RATE_LIMITER
+    delivered = [0]
+
+    def deliver(parser):
+        # A retried stream replays records that were already delivered; only pass on new ones
+        for record in parser.records[delivered[0]:]:
+            if on_record is not None:
+                on_record(record)
+        delivered[0] = max(delivered[0], len(parser.records))
+
+    cache_key = None
+    if cache_mode != "off":
+        cache_key = response_cache_key(converse_kwargs)
+        cached = RESPONSE_CACHE.get(cache_key) if cache_mode == "use" else None
+        if cached is not None:
+            metrics.count("response_cache_hits")
+            text = cached.decode("utf-8")
+            parser = IncrementalJSONParser(max_preamble_chars)
+            try:
+                parser.feed(text)
+            except StreamDerailed:
+                pass
+            deliver(parser)
+            return strip_code_fence(text)
+
+    def consume_stream():
+        parser = IncrementalJSONParser(max_preamble_chars)
+        text_parts = []
+        derailed = False
+        usage = None
+        response = get_bedrock_client().converse_stream(**converse_kwargs)
+        stream = response["stream"]
         try:
-            with open(debug_log_path, 'a', encoding='utf-8') as dbg:
-                dbg.write(f"\n[{datetime.datetime.now().isoformat()}] [DEBUG] About to call Bedrock Converse API...\n")
-            response = client.converse(**converse_kwargs)
-            with open(debug_log_path, 'a', encoding='utf-8') as dbg:
-                dbg.write(f"[{datetime.datetime.now().isoformat()}] [DEBUG] Received response from Bedrock. Type: {type(response)}, Keys: {list(response.keys())}\n")
-            response_body = response
-            if "output" in response_body and "message" in response_body["output"]:
-                content = response_body["output"]["message"]["content"]
-                text_parts = [part["text"] for part in content if "text" in part]
-                if text_parts:
-                    text = "".join(text_parts)
-                    import re
-                    code_block = re.match(r"^```(?:json)?\s*([\s\S]+?)\s*```$", text.strip())
-                    if code_block:
-                        return code_block.group(1).strip()
-                    return text.strip()
-                return str(content)
-            else:
-                return str(response_body)
-        except Exception as e:
-            import traceback
-            with open(debug_log_path, 'a', encoding='utf-8') as dbg:
-                dbg.write(f"[{datetime.datetime.now().isoformat()}] [ERROR] Exception in ask_bedrock_vision_model:\n")
-                dbg.write(traceback.format_exc())
-            raise
+            for event in stream:
+                if "metadata" in event:
+                    usage = event["metadata"].get("usage")
+                    break
+                delta = event.get("contentBlockDelta", {}).get("delta", {}).get("text")
+                if delta is None:
+                    continue
+                text_parts.append(delta)
+                if parser.done:
+                    # Anything after the JSON is kept in the raw reply but not parsed
+                    continue
+                try:
+                    parser.feed(delta)
+                except StreamDerailed:
+                    derailed = True
+                    break
+                deliver(parser)
+        finally:
+            # Closing the event stream stops a derailed transfer (and output billing) early
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        count_usage(usage)
+        return "".join(text_parts), derailed, usage
+
+    def log_retry(attempt, exc, delay):
+        metrics.count("retries")
+        log.warning("Bedrock stream failed (%s: %s); retry %d/%d in %.1fs (rate now %.2f req/s)",
+                    type(exc).__name__, exc, attempt, limiter.max_retries, delay, limiter.rate)
+
+    try:
+        with metrics.timed("api"):
+            text, derailed, _ = limiter.call(
+                consume_stream,
+                tokens=estimate_input_tokens(converse_kwargs),
+                usage_tokens=lambda r: (r[2] or {}).get("totalTokens"),
+                on_retry=log_retry,
+            )
+    except Exception:
+        log.exception("Exception in invoke_converse_stream for %s", converse_kwargs["modelId"])
+        raise
+    if derailed:
+        log.warning("Aborted derailed stream for %s after %d chars", converse_kwargs["modelId"], len(text))
+    elif cache_key is not None:
+        RESPONSE_CACHE.put(cache_key, text.encode("utf-8"))
+    return strip_code_fence(text)
+
+def ask_bedrock_vision_model(document_images, example_image_paths, prompt, model_id="us.amazon.nova-pro-v1:0", cache_mode=None, static_prompt=None):
+    """
+    Sends all document images first, then all example images, with a dynamically constructed prompt.
+    document_images may be JPEG bytes (from pdf_to_images) or image file paths.
+    With static_prompt, uses the cacheable prefix layout described in build_converse_request.
+    """
+    converse_kwargs = build_converse_request(document_images, example_image_paths, prompt, model_id=model_id, static_prompt=static_prompt)
+    return invoke_converse(converse_kwargs, cache_mode=cache_mode)
 
 def run_ner_on_claude_json(claude_json):
     try:
@@ -227,108 +866,363 @@ def fix_missing_commas_in_json_array(json_str):
     fixed = re.sub(r'}\s*\[', '}, [', fixed)
     return fixed
 
-def process_pdf(pdf_path, chunk_dir=None, prompt=None, model_id="us.amazon.nova-pro-v1:0"):
-    pdf_type = detect_pdf_type(pdf_path)
-    chunks = []
-    aggregated_results = []
+# Prompt template version (data/prompts/<version>.txt) used by default
+PROMPT_VERSION = DEFAULT_PROMPT_VERSION
+
+EXAMPLE_IMAGE_PATHS = [
+    "data/prompt_hints/redline_examples.jpg",
+    "data/prompt_hints/adoption_date_examples.jpg"
+]
+
+def configure_prompt_template(version=None):
+    """
+    Selects the prompt template version used when process_pdf isn't given one.
+    """
+    global PROMPT_VERSION
+    template = load_prompt_template(version or DEFAULT_PROMPT_VERSION)
+    PROMPT_VERSION = template.version
+    return template
+
+def plan_page_chunks(image_sizes, example_image_paths=(), max_images=None, max_bytes=None):
+    """
+    Splits a document's page images (given by their JPEG sizes) into consecutive groups
+    that each fit one Converse request next to the example images: at most max_images
+    images and max_bytes of image data per request (defaults MAX_IMAGES_PER_REQUEST and
+    MAX_REQUEST_IMAGE_BYTES). Groups are balanced by page count so chunked requests
+    finish at about the same time. Returns lists of indices into image_sizes.
+    """
+    example_sizes = [len(read_example_image(str(path))) for path in example_image_paths]
+    max_images = (max_images or MAX_IMAGES_PER_REQUEST) - len(example_sizes)
+    max_bytes = (max_bytes or MAX_REQUEST_IMAGE_BYTES) - sum(example_sizes)
+    if max_images < 1:
+        raise ValueError("The example images alone exceed the per-request image limit")
+
+    def greedy(cap):
+        groups, current, current_bytes = [], [], 0
+        for i, size in enumerate(image_sizes):
+            if current and (len(current) >= cap or current_bytes + size > max_bytes):
+                groups.append(current)
+                current, current_bytes = [], 0
+            current.append(i)
+            current_bytes += size
+        if current:
+            groups.append(current)
+        return groups
+
+    groups = greedy(max_images)
+    if len(groups) > 1:
+        # Same number of requests, page counts differing by at most one where the byte limit allows
+        base, extra = divmod(len(image_sizes), len(groups))
+        balanced, start = [], 0
+        for k in range(len(groups)):
+            end = start + base + (k < extra)
+            balanced.append(list(range(start, end)))
+            start = end
+        if all(len(g) == 1 or sum(image_sizes[i] for i in g) <= max_bytes for g in balanced):
+            groups = balanced
+    return groups
+
+def plan_document(pdf_path, prompt_version=None, text_first=None, rules_mode=None):
+    """
+    The analysis half of prepare_document: analyzes the PDF, picks the pages to send, reads
+    the text layer and runs the rules. Returns a plan for render_planned_document, which
+    holds the analysis's open fitz document (released by render_planned_document, or by
+    close_analysis(plan["analysis"]) if the plan is abandoned).
+    """
+    template = load_prompt_template(prompt_version or PROMPT_VERSION)
+    text_first = TEXT_FIRST if text_first is None else text_first
+    rules_mode = rules_mode or RULES_MODE
+    if rules_mode == "hints" and template.rule_hints is None:
+        raise ValueError(f"Prompt template {template.version!r} has no rule hints section; use rules mode 'off'")
+    # Page texts and hashes are only read when a feature below uses them
+    analysis = analyze_pdf(pdf_path, details=FILTER_PAGES or text_first or rules_mode != "off")
+    document_text = None
+    rule_fields = None
+    try:
+        with metrics.timed("filter"):
+            if FILTER_PAGES:
+                with FITZ_LOCK:
+                    page_numbers, dropped_pages = select_pages(analysis["doc"], analysis["pages"])
+            else:
+                page_numbers, dropped_pages = list(range(analysis["page_count"])), {}
+        metrics.count("pages_dropped", len(dropped_pages))
+        has_text_layer = analysis["type"] == "text"
+        text_mode = text_first and has_text_layer and template.text_document is not None
+        if has_text_layer and (text_mode or rules_mode != "off"):
+            has_text = {p["index"] for p in analysis["pages"] if p["text_length"] >= MIN_TEXT_CHARS}
+            with metrics.timed("text_layer"):
+                with FITZ_LOCK:
+                    markups = {n: page_markup_text(analysis["doc"][n]) for n in page_numbers if n in has_text}
+            if rules_mode != "off":
+                rule_fields = extract_fields([text for text, _ in markups.values()], sum(struck for _, struck in markups.values()))
+            if text_mode:
+                document_text = format_document_text({n: text for n, (text, _) in markups.items()})
+                page_numbers = [n for n in page_numbers if n == page_numbers[0] or n not in has_text]
+    except Exception:
+        close_analysis(analysis)
+        raise
+    return {
+        "pdf_path": Path(pdf_path),
+        "analysis": analysis,
+        "template": template,
+        "text_mode": text_mode,
+        "rule_fields": rule_fields,
+        "page_numbers": page_numbers,
+        "dropped_pages": dropped_pages,
+        "document_text": document_text,
+    }
+
+def render_planned_document(plan, chunk_dir=None, pool_min_pages=None):
+    """
+    The rendering half of prepare_document: renders the planned pages, closes the
+    analysis and builds the prompt and request chunks. If the analysis was already
+    closed, pages are rendered from a fresh open of the PDF (see pdf_to_images for
+    pool_min_pages).
+    """
+    pdf_path = plan["pdf_path"]
+    analysis = plan["analysis"]
+    template = plan["template"]
+    text_mode = plan["text_mode"]
+    page_numbers = plan["page_numbers"]
+    document_text = plan["document_text"]
+    rule_fields = plan["rule_fields"]
     if chunk_dir is None:
         chunk_dir = Path(pdf_path).parent / "chunks"
-    image_paths = pdf_to_images(pdf_path, chunk_dir)
-    # Example images
-    example_image_paths = [
-        "data/prompt_hints/redline_examples.jpg",
-        "data/prompt_hints/adoption_date_examples.jpg"
-    ]
-    # Dynamically construct prompt with correct indices
-    N = len(image_paths)
-    M = len(example_image_paths)
-    prompt_dynamic = (
-        f"You will receive multiple images in this order:\n"
-        f"- Images 1 to {N}: Legislative document pages to analyze and extract fields from.\n"
-        f"- Images {N+1} to {N+M}: Example images for reference only (not for extraction).\n"
-        f"\n"
-        f"--- BEGIN DOCUMENT IMAGES (1-{N}) ---\n"
-        f"[Images 1 to {N}: analyze and extract fields from these]\n"
-        f"--- END DOCUMENT IMAGES (1-{N}) ---\n"
-        f"\n"
-        f"--- BEGIN EXAMPLES ({N+1}-{N+M}) ---\n"
-        f"[Images {N+1} to {N+M}: use only as visual reference for REDLINE and ADOPTION_DATE. Do NOT extract any fields from these.]\n"
-        f"--- END EXAMPLES ({N+1}-{N+M}) ---\n"
-        f"\n"
-        f"Extract the required fields ONLY from the document images. Ignore the example images for extraction. Use the example images ONLY as visual reference for REDLINE and ADOPTION_DATE.\n"
-    )
-    # Append the rest of the static prompt
-    prompt_dynamic += (
-        "\nYou are a legislative document analysis assistant. Given the following page image from a legislative or ordinance document, extract ONLY the following fields as a JSON object or array (one object per legislative action if needed). Use the rules, patterns, and examples from the specification document 'AI Analyzing the Legislation and Extracting Data.pdf'. Return ONLY valid JSON. Do not include any explanation, preamble, or formatting outside the JSON object or array.\n"
-        "\nFields to extract:\n"
-        "- LEGNO: Legislation number or identifier (e.g., '2025-04'), (e.g., 'No. 2 of 2025' from 'Ordinance No. 2 of 2025'). Only search for this on the first page/chunk; for subsequent pages, enter a blank value ('').\n"
-        "- STATE: Output the official two-letter U.S. state abbreviation (e.g., 'RI' for Rhode Island) only if the full state name (e.g., 'Rhode Island') appears as a complete word anywhere in the document, including in legal citations, headers, or body text. Do NOT infer the state from city names, abbreviations, or context. If the state name appears in a legal citation (e.g., 'R.I. Gen. Laws'), treat this as a valid mention and output the corresponding two-letter abbreviation. If more than one state name is present, select the one that appears most frequently; if tied, use the first found. If no valid state name is found, output an empty string (''). Output only the two-letter abbreviation in uppercase (e.g., 'RI'), not the full name.\n"
-        "- CITY/TOWN: City or Town (output only if explicitly mentioned on the page; never infer from context; search all chunks and use the value if found).\n"
-        "- LEGTYPE: Legislation type (e.g., ordinance, resolution, bill, etc.). Only search for this on the first page/chunk; for subsequent pages, enter a blank value ('').\n"
-        "- ADOPTION_DATE: Extract the adoption date only if it visually matches the attached example image (adoption_date_examples.jpg) and is clearly labeled as adopted, passed, approved, or enacted. Use the example image ONLY as a reference; do NOT extract any data from the example image itself. Do not extract vote tallies, numbers in parentheses, or unrelated dates. If no such date is found, return an empty string.\n"
-        "- CHAPTER/TITLE: The chapter or title number (e.g., '255' from 'CHAPTER 255 Nonconforming Development') or ('Chapter 07' from 'Section 4 of Chapter 07. 14'); 'Chapter' and 'Title' are interchangeable—extract whichever is present. Just provide the number in the response.\n"
-        "- LONG_TITLE: The long title of the legislation (often all caps, near the top of the first image); if all caps, convert to sentence case. Only get from the first chunk_filename in the array (e.g. '2343853_1.jpg', and not '2343853_[2-30].jpg').\n"
-        "- LONG_TITLE_SUMMARY: Write a concise summary (2 to 6 words) that captures the main subject or action described in the LONG_TITLE field. Base the summary only on the extracted LONG_TITLE text; do not use information from other parts of the document. Use clear, specific language that reflects the core purpose or effect of the legislation. Avoid generic phrases (e.g., 'An ordinance' or 'A bill'); instead, focus on the unique topic or action (e.g., 'Rezoning residential lots' or 'Third-party billing procedures'). Output only for the first chunk/page containing the LONG_TITLE; for all others, output an empty string ('').\n"
-        "- ARTICLE: Examples:('VIII' from 'Article VIII, Chapter 255 - Zoning') or ('XII' from 'SECTION 1. Chapter 140, Article XII, Schedule IV') or ('1' from 'Article 1'). Be 99 percent confident. Do NOT extract from any strikethrough text. \n"
-        "- SECTION: (e.g., 'Section 1' from 'Section 1. The Town of' or 'Section 2' of 'Section 2. Amend § 1- 16 of the Code of Ordinances') or ('Section 4' of 'Section 4. That Section 07. 14.030 of Chapter 07. 14'). Do NOT extract if the section number itself is strikethrough text. Just provide the number in the response. \n"
-        "- ACTION_CLASSIFICATION: One of Add, Amend, Repeal, or NCM (Non-Code Material). If any page or chunk has REDLINE marked as 'X', the aggregated ACTION_CLASSIFICATION for the document must be only 'Amend'. Do not include 'Add' if REDLINE is present anywhere in the document. If there is any evidence of amendment (e.g., redline, strikethrough, or language indicating changes to existing code), always classify as 'Amend' and do NOT classify as 'Add'. Only use 'Add' if the document is clearly introducing entirely new material, with no indication of amendment or redline. If in doubt, prefer 'Amend' over 'Add'. Only flag as NCM if it matches the definition in the specification document.\n"
-        "- DISPOSITION: The lowest level part of the legislative code hierarchy (e.g., '§1-16' from 'Section 1. Amend §1-16 of the Code of Ordinances'), or ('14.030' from 'Section 4. That Section 07. 14.030 of Chapter 07. 14'). Often begins with a '§' character. If multiple, separate with semicolons. Do not extract if the disposition itslef is strikethrough text. Always change the extracted input to the short form with the § symbol in the response. \n"
-        "- REDLINE: Mark REDLINE as 'X' only if you see text visually matching the attached example image (redline.jpg) under the 'Strikethrough' section. Use the example image ONLY as a reference; do NOT extract any data from the example image itself. DO NOT mark with an 'X' if it more visually matches the example images under the 'Not Strikethrough' section of example image (redline.jpg). Do not infer or assume strikethrough or redline from context or language. Do not extract if visually matches a hand-written signature or human-writing that overlaps words or lines. Do not extract if the strikethrough lines are vertical (only horizontal). \n"
-        "\nAdditional Instructions:\n"
-        "- Ignore line numbers or document metadata in all analysis and extracted values.\n"
-        "- For multi-page documents, aggregate all chunk results into a single record. For fields with differing values across chunks, deduplicate case-insensitively and reason as a senior legislation, summarization, and date-identification specialist to select the correct value. For ARTICLE, SECTION, ACTION_CLASSIFICATION, and DISPOSITION, allow multiple values (separated by semicolons). Allow only a single value in all other fields, and if the value is a date, select the most recent date only. Output all fields in sentence case (except for dates and numbers). Convert roman numerals to whole numbers.\n"
-        "- For multi-page documents, if more than one date is found, return only the ONE most recent date in the entire document (closest to today).\n"
-        "- For multi-page documents, if more than one LONG_TITLE_SUMMARY is found, return only the ONE from the first page of the entire document.\n"
-    )
-    # Call the LLM once for all images
-    model_response = ask_bedrock_vision_model(image_paths, example_image_paths, prompt_dynamic, model_id=model_id)
     try:
-        json_str = extract_json_from_response(model_response)
-        chunk_json = json.loads(json_str)
-    except Exception as e:
-        # Redact base64-like blobs from the raw response for safety
-        import re
-        def redact_base64(s):
-            return re.sub(r'[A-Za-z0-9+/=]{50,}', '[REDACTED_BASE64]', s)
-        redacted_response = redact_base64(repr(model_response))
-        debug_filename = os.path.join(os.getcwd(), f"debug_model_response_{Path(pdf_path).stem}.txt")
-        with open(debug_filename, "w", encoding="utf-8") as debug_file:
-            debug_file.write(redacted_response[:1000])
+        with metrics.timed("render"):
+            page_images = pdf_to_images(pdf_path, chunk_dir, analysis=analysis, pages=page_numbers, pool_min_pages=pool_min_pages)
+    finally:
+        close_analysis(analysis)
+    # Only the page-count-dependent part of the prompt is rendered per document
+    render_document = template.render_text_document if text_mode else template.render_document
+    hints = template.render_rule_hints(format_hints(rule_fields)) if rule_fields and template.rule_hints else ""
+    prompt = render_document(len(page_images), len(EXAMPLE_IMAGE_PATHS)) + hints
+    chunks = [{"page_numbers": page_numbers, "page_images": page_images, "document_text": document_text, "prompt": prompt}]
+    plan_chunks = plan_page_chunks([len(img) for img in page_images], EXAMPLE_IMAGE_PATHS)
+    if len(plan_chunks) > 1:
+        chunks = []
+        for k, indices in enumerate(plan_chunks):
+            chunk_pages = [page_numbers[i] for i in indices]
+            # The document text rides with the first chunk; later chunks are plain vision requests
+            render_chunk = render_document if k == 0 else template.render_document
+            chunks.append({
+                "page_numbers": chunk_pages,
+                "page_images": [page_images[i] for i in indices],
+                "document_text": document_text if k == 0 else None,
+                "prompt": render_chunk(len(indices), len(EXAMPLE_IMAGE_PATHS)) + template.render_chunk_note(
+                    part=k + 1, parts=len(plan_chunks), first=chunk_pages[0] + 1, last=chunk_pages[-1] + 1,
+                    page_count=analysis["page_count"], first_image=len(EXAMPLE_IMAGE_PATHS) + 1,
+                ) + hints,
+            })
+    return {
+        "pdf_path": Path(pdf_path),
+        "type": analysis["type"],
+        "mode": "text" if text_mode else "vision",
+        "rule_fields": rule_fields,
+        "page_images": page_images,
+        "page_numbers": page_numbers,
+        "document_text": document_text,
+        "dropped_pages": plan["dropped_pages"],
+        "example_image_paths": EXAMPLE_IMAGE_PATHS,
+        "static_prompt": template.render_static(len(EXAMPLE_IMAGE_PATHS)),
+        "prompt": prompt,
+        "chunks": chunks,
+        "prompt_version": template.version,
+    }
+
+def prepare_document(pdf_path, chunk_dir=None, prompt_version=None, text_first=None, rules_mode=None):
+    """
+    Everything before the model call: analyzes and renders the PDF and builds its prompt.
+    With FILTER_PAGES, blank/duplicate/boilerplate pages are dropped before rendering (see
+    page_filter.select_pages). With text_first (default TEXT_FIRST), "text" PDFs send the
+    marked-up text layer of their kept pages plus images of only the first page and any
+    page without a text layer; other PDFs, or templates without a text section, use full
+    vision. rules_mode (default RULES_MODE) runs rule_extractor over the text layer of
+    "text" PDFs: "hints" appends its fields to the prompt through the template's rule
+    hints section. Chunked requests carry the template's chunk note, so the prompt text
+    always comes from the versioned template.
+    Returns a dict with the PDF type, input mode ("vision" or "text"), the rule fields, the imaged page indices and their JPEG bytes, the document text (text
+    mode), the dropped pages with reasons, example image paths, the shared static prompt,
+    the per-document prompt, the request chunks (see plan_page_chunks; one chunk unless the
+    images exceed a single request's limits) and the prompt template version.
+    """
+    plan = plan_document(pdf_path, prompt_version, text_first, rules_mode)
+    return render_planned_document(plan, chunk_dir)
+
+def parse_model_response(model_response, pdf_path):
+    """
+    Parses the model's JSON, falling back to json5 and comma repair. Unparseable replies are
+    returned as {"raw_response": ...} and a redacted copy is written to debug_model_response_<stem>.txt.
+    """
+    with metrics.timed("parse"):
+        json_str = model_response
         try:
-            import json5
-            chunk_json = json5.loads(json_str)
+            json_str = extract_json_from_response(model_response)
+            return json.loads(json_str)
         except Exception:
-            fixed_str = fix_missing_commas_in_json_array(json_str)
+            # Redact base64-like blobs from the raw response for safety
+            def redact_base64(s):
+                return re.sub(r'[A-Za-z0-9+/=]{50,}', '[REDACTED_BASE64]', s)
+            redacted_response = redact_base64(repr(model_response))
+            debug_filename = os.path.join(os.getcwd(), f"debug_model_response_{Path(pdf_path).stem}.txt")
+            with open(debug_filename, "w", encoding="utf-8") as debug_file:
+                debug_file.write(redacted_response[:1000])
             try:
-                chunk_json = json.loads(fixed_str)
+                import json5
+                return json5.loads(json_str)
             except Exception:
-                chunk_json = {"raw_response": model_response}
-    # Only keep 'model_json' in output
+                fixed_str = fix_missing_commas_in_json_array(json_str)
+                try:
+                    return json.loads(fixed_str)
+                except Exception:
+                    return {"raw_response": model_response}
+
+def build_pdf_result(pdf_path, pdf_type, chunk_json, prompt_version=None, raw_response=None):
+    chunks = []
+    aggregated_results = []
+    # The parsed JSON and the model's raw reply (None if no reply came back)
     chunks.append({
         "chunk_filename": str(Path(pdf_path).name),
-        "model_json": chunk_json
+        "model_json": chunk_json,
+        "raw_response": raw_response,
     })
     # Aggregate for summary if needed
     if isinstance(chunk_json, list):
         aggregated_results.extend(chunk_json)
     else:
         aggregated_results.append(chunk_json)
-    time.sleep(2)  # Add delay to avoid Bedrock throttling
     return {
         "filename": str(Path(pdf_path).name),
         "type": pdf_type,
+        "prompt_version": prompt_version or "",
         "chunks": chunks,
         "aggregated_results": aggregated_results
     }
 
-def process_folder(folder_path, prompt, model_id="us.amazon.nova-pro-v1:0"):
-    folder = Path(folder_path)
-    clean_chunks_folders(folder)
-    results = []
-    for pdf_file in folder.glob("*.pdf"):
-        result = process_pdf(pdf_file, chunk_dir=folder/"chunks", prompt=prompt, model_id=model_id)
-        # Add LFID as the PDF name (without .pdf)
-        lfid = Path(pdf_file).stem
+# Fields whose values from all chunks are kept, semicolon-joined
+MULTI_VALUE_FIELDS = ("ARTICLE", "SECTION", "ACTION_CLASSIFICATION", "DISPOSITION")
+# Fields the prompt reads from the document's first page only
+FIRST_PAGE_FIELDS = ("LEGNO", "LEGTYPE", "LONG_TITLE", "LONG_TITLE_SUMMARY")
+
+def merge_chunk_records(chunk_jsons, chunks=None):
+    """
+    Merges the records of every chunk of one document into a single record with the
+    aggregation rules the prompt gives for multi-page documents: the most recent ADOPTION_DATE, semicolon-joined
+    case-insensitively deduplicated multi-value fields, REDLINE 'X' if any chunk saw
+    one, the most frequent STATE, FIRST_PAGE_FIELDS only from the chunk holding the first
+    sent page (chunks gives each chunk's page_numbers; the first chunk if omitted), even
+    if that chunk left them blank, and for everything else the value from the earliest
+    chunk that has one. Unparseable chunk replies are skipped.
+    """
+    first_chunk = 0
+    if chunks:
+        first_chunk = min(range(len(chunks)), key=lambda k: min(chunks[k]["page_numbers"], default=float("inf")))
+    records = []
+    for k, chunk_json in enumerate(chunk_jsons):
+        for record in chunk_json if isinstance(chunk_json, list) else [chunk_json]:
+            if isinstance(record, dict) and "raw_response" not in record:
+                records.append((k, record))
+    if not records:
+        return {"raw_response": "No chunk of this document returned parseable JSON"}
+    merged = {}
+    keys = list(OrderedDict.fromkeys(key for _, record in records for key in record))
+    for key in keys:
+        sources = [record for k, record in records if key not in FIRST_PAGE_FIELDS or k == first_chunk]
+        values = [str(record.get(key) or "").strip() for record in sources]
+        values = [v for v in values if v]
+        if not values:
+            merged[key] = ""
+        elif key in MULTI_VALUE_FIELDS:
+            parts = [part.strip() for v in values for part in v.split(";") if part.strip()]
+            unique_parts = {}
+            for part in parts:
+                unique_parts.setdefault(part.lower(), part)
+            merged[key] = "; ".join(unique_parts.values())
+        elif key == "ADOPTION_DATE":
+            dated = [d for v in values for d in parse_dates(v)]
+            merged[key] = max(dated, key=lambda x: x[0])[1] if dated else values[0]
+        elif key == "REDLINE":
+            merged[key] = "X" if any(v.upper() == "X" for v in values) else values[0]
+        elif key == "STATE":
+            merged[key] = max(values, key=values.count)
+        else:
+            merged[key] = values[0]
+    return merged
+
+def build_chunked_pdf_result(pdf_path, pdf_type, chunks, chunk_jsons, prompt_version=None, raw_responses=None):
+    """
+    build_pdf_result for a document sent as several requests: one "chunks" entry per
+    request and a single merged aggregated record.
+    """
+    name = Path(pdf_path).name
+    raw_responses = raw_responses or [None] * len(chunk_jsons)
+    return {
+        "filename": str(name),
+        "type": pdf_type,
+        "prompt_version": prompt_version or "",
+        "chunks": [
+            {
+                "chunk_filename": f"{name} (pages {chunk['page_numbers'][0] + 1}-{chunk['page_numbers'][-1] + 1})",
+                "model_json": chunk_json,
+                "raw_response": raw_response,
+            }
+            for chunk, chunk_json, raw_response in zip(chunks, chunk_jsons, raw_responses)
+        ],
+        "aggregated_results": [merge_chunk_records(chunk_jsons, chunks)],
+    }
+
+def process_pdf(pdf_path, chunk_dir=None, prompt=None, model_id="us.amazon.nova-pro-v1:0", stream=False, on_record=None):
+    """
+    Extracts the fields for one PDF. prompt is a prompt template version (default:
+    PROMPT_VERSION). With stream=True the reply is streamed and on_record(pdf_path, record)
+    fires as each extracted record completes.
+    """
+    document = prepare_document(pdf_path, chunk_dir, prompt_version=prompt)
+
+    def run_chunk(chunk):
+        converse_kwargs = document_converse_request(document, model_id=model_id, chunk=chunk)
+        if stream:
+            model_response = invoke_converse_stream(
+                converse_kwargs,
+                on_record=(lambda record: on_record(pdf_path, record)) if on_record else None,
+            )
+        else:
+            model_response = invoke_converse(converse_kwargs)
+        return parse_model_response(model_response, pdf_path), model_response
+
+    chunks = document["chunks"]
+    if len(chunks) == 1:
+        # Call the LLM once for all images
+        chunk_json, model_response = run_chunk(chunks[0])
+        return build_pdf_result(pdf_path, document["type"], chunk_json, document["prompt_version"], model_response)
+    with ThreadPoolExecutor(max_workers=min(len(chunks), CHUNK_WORKERS)) as executor:
+        chunk_jsons, model_responses = zip(*executor.map(metrics.bind(run_chunk), chunks))
+    return build_chunked_pdf_result(pdf_path, document["type"], chunks, list(chunk_jsons), document["prompt_version"],
+                                    list(model_responses))
+
+def parse_dates(date_str):
+    """
+    Returns (datetime, matched text) for every date in date_str that parses.
+    """
+    date_candidates = re.findall(r'(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4}|[A-Za-z]+ \d{1,2}, \d{4})', date_str)
+    parsed_dates = []
+    for d in date_candidates:
+        for fmt in ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%B %d, %Y", "%b %d, %Y"):
+            try:
+                parsed = datetime.datetime.strptime(d, fmt)
+                parsed_dates.append((parsed, d))
+                break
+            except Exception:
+                continue
+    return parsed_dates
+
+def normalize_result(result, lfid):
+    """
+    Flattens a process_pdf result into the ordered output row (ending with the prompt
+    template version) and applies the ACTION_CLASSIFICATION, ADOPTION_DATE and STATE
+    post-processing rules.
+    """
+    with metrics.timed("postprocess"):
         agg_ordered = {'LFID': lfid}
         ordered_keys = [
             'CITY/TOWN', 'STATE', 'LEGTYPE', 'LEGNO', 'ADOPTION_DATE',
@@ -337,22 +1231,13 @@ def process_folder(folder_path, prompt, model_id="us.amazon.nova-pro-v1:0"):
         ]
         agg = result["aggregated_results"][0] if isinstance(result["aggregated_results"], list) and result["aggregated_results"] else {}
         agg_ordered.update({k: agg.get(k, '') for k in ordered_keys})
+        agg_ordered['PROMPT_VERSION'] = result.get("prompt_version", "")
         # Post-processing for ACTION_CLASSIFICATION, ADOPTION_DATE, and STATE output
         if agg_ordered.get('REDLINE', '').strip().upper() == 'X':
             agg_ordered['ACTION_CLASSIFICATION'] = 'Amend'
-        import re
         date_str = agg_ordered.get('ADOPTION_DATE', '')
         if date_str:
-            date_candidates = re.findall(r'(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{2,4}|[A-Za-z]+ \d{1,2}, \d{4})', date_str)
-            parsed_dates = []
-            for d in date_candidates:
-                for fmt in ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%B %d, %Y", "%b %d, %Y"):
-                    try:
-                        parsed = datetime.datetime.strptime(d, fmt)
-                        parsed_dates.append((parsed, d))
-                        break
-                    except Exception:
-                        continue
+            parsed_dates = parse_dates(date_str)
             if parsed_dates:
                 most_recent = max(parsed_dates, key=lambda x: x[0])[1]
                 agg_ordered['ADOPTION_DATE'] = most_recent
@@ -369,8 +1254,14 @@ def process_folder(folder_path, prompt, model_id="us.amazon.nova-pro-v1:0"):
         if 'LONG_TITLE' in agg_ordered:
             agg_ordered.pop('LONG_TITLE')
         result["aggregated_results"] = agg_ordered
-        results.append(result)
-    df = pd.DataFrame([r["aggregated_results"] for r in results])
+        return result
+
+def write_index_excel(rows, folder, model_id):
+    """
+    Writes the output rows to index_<parent>_<folder>_<model>_<timestamp>.xlsx and returns the path.
+    """
+    folder = Path(folder)
+    df = pd.DataFrame(rows)
     model_map = {
         'nova-micro': 'NovaMicro',
         'nova-lite': 'NovaLite',
@@ -403,12 +1294,165 @@ def process_folder(folder_path, prompt, model_id="us.amazon.nova-pro-v1:0"):
     output_dir.mkdir(parents=True, exist_ok=True)
     excel_path = output_dir / excel_filename
     df.to_excel(excel_path, index=False)
-    return results
+    return excel_path
+
+class FolderRunError(RuntimeError):
+    """
+    Raised by the folder runners when some documents failed, after the failures were
+    journaled and the Excel index of the other documents was written. failures maps each
+    failed LFID to its error; results holds the finished documents' results in filename order.
+    """
+
+    def __init__(self, failures, results):
+        super().__init__(f"{len(failures)} document(s) failed: " + "; ".join(f"{lfid}: {error}" for lfid, error in failures.items()))
+        self.failures = failures
+        self.results = results
+
+def folder_results(pdf_files, results, failures):
+    """
+    The results of a folder run in filename order, or FolderRunError if any document failed.
+    """
+    finished = [results[p.stem] for p in pdf_files if p.stem in results]
+    if failures:
+        raise FolderRunError(failures, finished)
+    return finished
+
+def open_run_journal(folder, resume=True):
+    """
+    The RunJournal of a folder run; resume=False starts a fresh one.
+    """
+    journal = RunJournal(Path(folder) / JOURNAL_FILENAME)
+    if not resume:
+        journal.reset()
+    return journal
+
+def run_settings():
+    """
+    The module settings that change what is sent to the model for a document.
+    """
+    return {
+        "text_first": TEXT_FIRST,
+        "rules_mode": RULES_MODE,
+        "filter_pages": FILTER_PAGES,
+        "clip_to_content": CLIP_TO_CONTENT,
+        "render_dpi": RENDER_DPI,
+        "max_image_dim": MAX_IMAGE_DIM,
+        "max_images_per_request": MAX_IMAGES_PER_REQUEST,
+        "max_request_image_bytes": MAX_REQUEST_IMAGE_BYTES,
+    }
+
+def document_fingerprint(pdf_path, prompt_version=None, model_id="us.amazon.nova-pro-v1:0"):
+    """
+    Journal fingerprint of one document's run: the PDF bytes, prompt template version,
+    model and run_settings(), so a resumed run with other settings reprocesses the document.
+    """
+    return content_key(file_sha256(pdf_path), prompt_version or PROMPT_VERSION, model_id,
+                       json.dumps(run_settings(), sort_keys=True))
+
+def process_folder(folder_path, prompt, model_id="us.amazon.nova-pro-v1:0", max_workers=1, stream=False, on_record=None, resume=True,
+                   metrics_path=None):
+    """
+    Processes every PDF in folder_path and writes the aggregated rows to Excel.
+    With max_workers > 1, documents are processed concurrently on a thread pool so
+    rasterization and Bedrock calls for different PDFs overlap. Results are always
+    returned (and written) in filename order, regardless of completion order.
+    prompt (a prompt template version), stream and on_record are passed through to process_pdf.
+
+    Each finished document is appended to the folder's run journal as it completes, and
+    the Excel file is assembled from the journal. When a run dies part-way, rerunning it
+    skips the documents already journaled; resume=False starts over. A document that fails
+    is journaled as an error (so a rerun retries it) without stopping the others; once the
+    Excel file has been written for the rest, FolderRunError reports the failures.
+
+    Stage timings and counters for the run are collected in metrics.METRICS (see
+    metrics.RunMetrics.summary_table) and, with metrics_path, written there as JSON lines.
+    """
+    folder = Path(folder_path)
+    clean_chunks_folders(folder)
+    pdf_files = sorted(folder.glob("*.pdf"), key=lambda p: p.name)
+    journal = open_run_journal(folder, resume)
+    metrics.METRICS.reset()
+
+    def process_one(pdf_file):
+        # Add LFID as the PDF name (without .pdf)
+        lfid = Path(pdf_file).stem
+        fingerprint = document_fingerprint(pdf_file, prompt, model_id)
+        done = journal.completed(lfid, fingerprint)
+        if done is not None:
+            results[lfid] = done
+            return
+        with metrics.document(lfid):
+            try:
+                result = process_pdf(pdf_file, chunk_dir=folder/"chunks", prompt=prompt, model_id=model_id, stream=stream, on_record=on_record)
+                result = normalize_result(result, lfid)
+            except Exception as e:
+                failures[lfid] = f"{type(e).__name__}: {e}"
+                journal.record(lfid, fingerprint, error=failures[lfid])
+                return
+        journal.record(lfid, fingerprint, result)
+        results[lfid] = result
+
+    results = {}
+    failures = {}
+    if max_workers <= 1:
+        for pdf_file in pdf_files:
+            process_one(pdf_file)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(process_one, pdf_files))
+    write_index_excel(journal.rows([p.stem for p in pdf_files]), folder, model_id)
+    if metrics_path:
+        metrics.METRICS.write_jsonl(metrics_path)
+    return folder_results(pdf_files, results, failures)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python pipeline.py <folder_path>")
-        exit(1)
-    folder_path = sys.argv[1]
-    output = process_folder(folder_path, None, model_id="us.amazon.nova-pro-v1:0")
-    print(json.dumps(output, indent=2)) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract legislation fields from a folder of PDFs.")
+    parser.add_argument("folder_path", help="Folder containing the PDFs to process")
+    parser.add_argument("--workers", type=int, default=1, help="Number of PDFs to process concurrently (default: 1)")
+    parser.add_argument("--rps", type=float, default=1.0, help="Initial Bedrock requests/sec; adapts up to --max-rps and backs off on throttling")
+    parser.add_argument("--max-rps", type=float, default=10.0, help="Upper bound for the adaptive request rate")
+    parser.add_argument("--tpm", type=int, default=None, help="Bedrock tokens/min budget (default: unlimited)")
+    parser.add_argument("--cache", choices=CACHE_MODES, default="use", help="Bedrock response cache: use, refresh (re-call and overwrite) or off")
+    parser.add_argument("--cache-max-mb", type=int, default=500, help="Size limit for the response cache before LRU eviction")
+    parser.add_argument("--page-cache", choices=CACHE_MODES, default="use", help="Rendered page-image cache: use, refresh (re-render and overwrite) or off")
+    parser.add_argument("--write-chunks", action="store_true", help="Also write rendered page JPEGs to <folder>/chunks for debugging")
+    parser.add_argument("--clip-to-content", action="store_true", help="Crop pages to their content bounding box before rendering")
+    parser.add_argument("--page-filter", action="store_true", help="Drop blank, duplicate, boilerplate and appendix pages before the model call")
+    parser.add_argument("--text-first", action="store_true", help="For PDFs with a text layer, send the extracted text plus the first page image instead of every page image")
+    parser.add_argument("--rules", choices=RULES_MODES, default="off", help="Rule-based pre-extraction for text PDFs: off or hints (pass the rule fields to the model)")
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count() or 1, help="Processes for rendering pages of long PDFs (default: CPU count; 1 disables)")
+    parser.add_argument("--max-pool-connections", type=int, default=50, help="HTTPS connection pool size of the shared Bedrock client")
+    parser.add_argument("--endpoint-url", default=None, help="Converse-compatible endpoint, e.g. a local converse_stub (default: regional bedrock-runtime)")
+    parser.add_argument("--no-sign", action="store_true", help="Don't SigV4-sign requests (for local stub servers)")
+    parser.add_argument("--region", default=None, help="AWS region (default: from the AWS config, else us-east-1)")
+    parser.add_argument("--stream", action="store_true", help="Stream model replies and print each record to stderr as soon as it is parsed")
+    parser.add_argument("--prompt-version", choices=list_prompt_versions(), default=DEFAULT_PROMPT_VERSION, help="Prompt template from data/prompts")
+    parser.add_argument("--fresh", action="store_true", help=f"Ignore the folder's {JOURNAL_FILENAME} and reprocess every PDF (the old journal is kept as a .bak)")
+    parser.add_argument("--metrics", default=None, help="Write per-document stage timings and counters to this JSON-lines file")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="INFO", help="bedrock_api_debug.log level; DEBUG also logs every request payload")
+    args = parser.parse_args()
+    configure_debug_log(level=args.log_level)
+    configure_bedrock_client(max_pool_connections=max(args.max_pool_connections, args.workers),
+                             endpoint_url=args.endpoint_url, sign=not args.no_sign, region_name=args.region)
+    WRITE_CHUNK_FILES = args.write_chunks
+    CLIP_TO_CONTENT = args.clip_to_content
+    FILTER_PAGES = args.page_filter
+    TEXT_FIRST = args.text_first
+    RULES_MODE = args.rules
+    configure_render_pool(workers=args.render_workers)
+    configure_response_cache(mode=args.cache, max_bytes=args.cache_max_mb * 1_000_000)
+    configure_page_cache(mode=args.page_cache)
+    configure_rate_limiter(requests_per_second=args.rps, tokens_per_minute=args.tpm, max_requests_per_second=args.max_rps)
+    def print_record(pdf_path, record):
+        print(json.dumps({"LFID": Path(pdf_path).stem, **record}), file=sys.stderr, flush=True)
+    configure_prompt_template(args.prompt_version)
+    try:
+        output, failures = process_folder(args.folder_path, args.prompt_version, model_id="us.amazon.nova-pro-v1:0", max_workers=args.workers,
+                                          stream=args.stream, on_record=print_record, resume=not args.fresh, metrics_path=args.metrics), {}
+    except FolderRunError as e:
+        output, failures = e.results, e.failures
+    print(json.dumps(output, indent=2))
+    print(metrics.METRICS.summary_table(), file=sys.stderr)
+    for lfid, error in failures.items():
+        print(f"FAILED {lfid}: {error}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
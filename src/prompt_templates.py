@@ -0,0 +1,114 @@
+import functools
+import re
+import string
+import threading
+from pathlib import Path
+
+PROMPT_TEMPLATE_DIR = Path("data/prompts")
+DEFAULT_PROMPT_VERSION = "extraction_v2"
+DOCUMENT_SECTION_MARKER = "=== document ==="
+# Section marker lines ("=== <name> ===") and the placeholders each section may use
+SECTION_MARKER_PATTERN = re.compile(r"\n=== ([a-z ]+) ===\n")
+STATIC_PLACEHOLDERS = {"M"}
+DOCUMENT_PLACEHOLDERS = {"M", "N", "total", "first_doc", "last_doc"}
+CHUNK_NOTE_PLACEHOLDERS = {"part", "parts", "page_count", "first", "last", "first_image"}
+RULE_HINTS_PLACEHOLDERS = {"fields"}
+OPTIONAL_SECTIONS = ("text document", "chunk note", "rule hints")
+
+class PromptTemplate:
+    """
+    A versioned extraction prompt, loaded from <PROMPT_TEMPLATE_DIR>/<version>.txt.
+
+    The file holds the static part (instructions, field rules, example markers), a line
+    "=== document ===", then the per-document part. Optional sections follow, each
+    introduced by its own marker line:
+
+    - "=== text document ===": the per-document part used when the document's text layer
+      is sent instead of every page image;
+    - "=== chunk note ===": appended to each request of a document split into chunks
+      ($part, $parts, $page_count, $first, $last, $first_image);
+    - "=== rule hints ===": appended when rule_extractor hints are sent ($fields).
+
+    All parts are string.Template text. The static part may only use $M (number of
+    example images), so it is rendered once per example count and reused; the document
+    parts may also use $N (document images), $total, $first_doc and $last_doc (image
+    indices). Everything sent to the model comes from the file, so the version
+    identifies the prompt.
+    """
+
+    def __init__(self, version, static_text, document_text, text_document_text=None, chunk_note_text=None,
+                 rule_hints_text=None):
+        self.version = version
+        self.static = string.Template(static_text)
+        self.document = string.Template(document_text)
+        self.text_document = string.Template(text_document_text) if text_document_text else None
+        self.chunk_note = string.Template(chunk_note_text.strip("\n")) if chunk_note_text else None
+        self.rule_hints = string.Template(rule_hints_text.strip("\n")) if rule_hints_text else None
+        parts = [("static", self.static, STATIC_PLACEHOLDERS), ("document", self.document, DOCUMENT_PLACEHOLDERS)]
+        if self.text_document is not None:
+            parts.append(("text document", self.text_document, DOCUMENT_PLACEHOLDERS))
+        if self.chunk_note is not None:
+            parts.append(("chunk note", self.chunk_note, CHUNK_NOTE_PLACEHOLDERS))
+        if self.rule_hints is not None:
+            parts.append(("rule hints", self.rule_hints, RULE_HINTS_PLACEHOLDERS))
+        for name, template, allowed in parts:
+            if not template.is_valid():
+                raise ValueError(f"Prompt template {version!r}: invalid placeholder in the {name} part")
+            unknown = set(template.get_identifiers()) - allowed
+            if unknown:
+                raise ValueError(f"Prompt template {version!r}: unknown placeholders {sorted(unknown)} in the {name} part")
+        self._static_rendered = {}
+        self._lock = threading.Lock()
+
+    def render_static(self, M):
+        with self._lock:
+            if M not in self._static_rendered:
+                self._static_rendered[M] = self.static.substitute(M=M)
+            return self._static_rendered[M]
+
+    def render_document(self, N, M):
+        return self.document.substitute(M=M, N=N, total=M + N, first_doc=M + 1, last_doc=M + N)
+
+    def render_text_document(self, N, M):
+        return self.text_document.substitute(M=M, N=N, total=M + N, first_doc=M + 1, last_doc=M + N)
+
+    def render_chunk_note(self, part, parts, page_count, first, last, first_image):
+        """
+        The chunk note for one request, on its own lines ("" if the template has none).
+        """
+        if self.chunk_note is None:
+            return ""
+        return "\n" + self.chunk_note.substitute(part=part, parts=parts, page_count=page_count, first=first,
+                                                  last=last, first_image=first_image) + "\n"
+
+    def render_rule_hints(self, fields):
+        """
+        The rule hints block for the formatted field lines, on its own lines.
+        """
+        return "\n" + self.rule_hints.substitute(fields=fields) + "\n"
+
+def list_prompt_versions(template_dir=None):
+    return sorted(p.stem for p in Path(template_dir or PROMPT_TEMPLATE_DIR).glob("*.txt"))
+
+@functools.lru_cache(maxsize=None)
+def load_prompt_template(version=DEFAULT_PROMPT_VERSION, template_dir=None):
+    """
+    Reads and compiles a prompt template; each version is read from disk once per process.
+    """
+    path = Path(template_dir or PROMPT_TEMPLATE_DIR) / f"{version}.txt"
+    text = path.read_text(encoding="utf-8")
+    # [static, name1, part1, name2, part2, ...]; every part but the last keeps the newline
+    # that ends it before the next marker
+    pieces = SECTION_MARKER_PATTERN.split(text)
+    names = pieces[1::2]
+    parts = [part + "\n" for part in pieces[0::2][:-1]] + [pieces[-1]]
+    if not names or names[0] != "document":
+        raise ValueError(f"Prompt template {path} has no '{DOCUMENT_SECTION_MARKER}' line after the static part")
+    sections = dict(zip(names, parts[1:]))
+    unknown = set(names[1:]) - set(OPTIONAL_SECTIONS)
+    if unknown or len(sections) != len(names):
+        raise ValueError(f"Prompt template {path} has unknown or repeated sections: {names}")
+    return PromptTemplate(
+        version, parts[0], sections["document"], sections.get("text document"),
+        sections.get("chunk note"), sections.get("rule hints"),
+    )
@@ -0,0 +1,195 @@
+import asyncio
+import random
+import threading
+import time
+
+# Codes are compared case-insensitively: ConverseStream's mid-stream EventStreamErrors carry
+# the camelCase event names (throttlingException, modelStreamErrorException, ...)
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "ServiceQuotaExceededException",
+}
+TRANSIENT_ERROR_CODES = {
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "ModelStreamErrorException",
+}
+
+def error_code(exc):
+    """
+    Returns the AWS error code of a botocore ClientError-like exception, or None.
+    """
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    return None
+
+def has_error_code(exc, codes):
+    code = error_code(exc)
+    return code is not None and code.lower() in {c.lower() for c in codes}
+
+def is_throttling_error(exc):
+    return has_error_code(exc, THROTTLING_ERROR_CODES)
+
+def is_transient_error(exc):
+    """
+    True for errors worth retrying without slowing down (5xx, timeouts, dropped connections).
+    """
+    if has_error_code(exc, TRANSIENT_ERROR_CODES):
+        return True
+    return type(exc).__name__ in {
+        "EndpointConnectionError", "ConnectionClosedError", "ReadTimeoutError", "ConnectTimeoutError",
+        "ConnectError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError",
+    }
+
+class RateLimiter:
+    """
+    Shared token-bucket limiter for Bedrock calls.
+
+    Two buckets gate every call: one for requests per second and an optional one for
+    tokens per minute. The request rate adapts with AIMD: it grows by increase_step
+    after each success (up to max_requests_per_second) and is multiplied by
+    decrease_factor whenever the service throttles us. Throttled and transient
+    failures are retried with full-jitter exponential backoff.
+    """
+
+    def __init__(self, requests_per_second=1.0, tokens_per_minute=None, max_requests_per_second=10.0,
+                 min_requests_per_second=0.05, increase_step=0.05, decrease_factor=0.5,
+                 max_retries=5, base_delay=2.0, max_delay=60.0):
+        self.rate = float(requests_per_second)
+        self.max_rate = float(max(max_requests_per_second, requests_per_second))
+        self.min_rate = float(min_requests_per_second)
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._request_tokens = 1.0
+        self._token_budget = float(tokens_per_minute) if tokens_per_minute else 0.0
+        self._last_refill = now
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_tokens = min(max(1.0, self.rate), self._request_tokens + elapsed * self.rate)
+        if self.tokens_per_minute:
+            self._token_budget = min(float(self.tokens_per_minute),
+                                     self._token_budget + elapsed * self.tokens_per_minute / 60.0)
+
+    def _try_acquire(self, tokens):
+        """
+        Consumes one request and `tokens` model tokens if available and returns 0, otherwise
+        returns how many seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = 0.0
+            if self._request_tokens < 1.0:
+                wait = (1.0 - self._request_tokens) / self.rate
+            if self.tokens_per_minute:
+                needed = min(tokens, self.tokens_per_minute)
+                if self._token_budget < needed:
+                    wait = max(wait, (needed - self._token_budget) * 60.0 / self.tokens_per_minute)
+            if wait <= 0:
+                self._request_tokens -= 1.0
+                if self.tokens_per_minute:
+                    self._token_budget -= tokens
+            return wait
+
+    def acquire(self, tokens=0):
+        """
+        Blocks until one request and `tokens` model tokens are available, then consumes them.
+        A single call larger than the whole per-minute budget is let through once the bucket is full.
+        """
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """
+        Event-loop counterpart of acquire; shares the same buckets, so sync and async callers
+        draw from one budget.
+        """
+        while (wait := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def reconcile_tokens(self, estimated, actual):
+        """
+        Corrects the token bucket once the real usage of a call is known.
+        """
+        if not self.tokens_per_minute or actual is None:
+            return
+        with self._lock:
+            self._token_budget -= actual - estimated
+
+    def record_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def record_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            # Drain the request bucket so concurrent callers back off together
+            self._request_tokens = min(self._request_tokens, 0.0)
+
+    def backoff_delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, fn, tokens=0, usage_tokens=None, on_retry=None):
+        """
+        Runs fn() under the limiter, retrying throttled/transient failures.
+
+        tokens is the estimated token cost used to gate the call; usage_tokens, if given,
+        maps fn's result to the actual token count so the budget can be corrected.
+        on_retry(attempt, exc, delay) is called before each backoff sleep.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                if not (throttled or is_transient_error(e)) or attempt >= self.max_retries:
+                    raise
+                if throttled:
+                    self.record_throttle()
+                delay = self.backoff_delay(attempt)
+                if on_retry is not None:
+                    on_retry(attempt + 1, e, delay)
+                time.sleep(delay)
+                continue
+            self.record_success()
+            if usage_tokens is not None:
+                self.reconcile_tokens(tokens, usage_tokens(result))
+            return result
+
+    async def call_async(self, fn, tokens=0, usage_tokens=None, on_retry=None):
+        """
+        Async counterpart of call: fn is a zero-argument callable returning an awaitable.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(tokens)
+            try:
+                result = await fn()
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                if not (throttled or is_transient_error(e)) or attempt >= self.max_retries:
+                    raise
+                if throttled:
+                    self.record_throttle()
+                delay = self.backoff_delay(attempt)
+                if on_retry is not None:
+                    on_retry(attempt + 1, e, delay)
+                await asyncio.sleep(delay)
+                continue
+            self.record_success()
+            if usage_tokens is not None:
+                self.reconcile_tokens(tokens, usage_tokens(result))
+            return result
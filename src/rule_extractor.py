@@ -0,0 +1,161 @@
+import datetime
+import re
+from collections import Counter
+
+US_STATES = {
+    "Alabama": "AL", "Alaska": "AK", "Arizona": "AZ", "Arkansas": "AR", "California": "CA",
+    "Colorado": "CO", "Connecticut": "CT", "Delaware": "DE", "Florida": "FL", "Georgia": "GA",
+    "Hawaii": "HI", "Idaho": "ID", "Illinois": "IL", "Indiana": "IN", "Iowa": "IA",
+    "Kansas": "KS", "Kentucky": "KY", "Louisiana": "LA", "Maine": "ME", "Maryland": "MD",
+    "Massachusetts": "MA", "Michigan": "MI", "Minnesota": "MN", "Mississippi": "MS", "Missouri": "MO",
+    "Montana": "MT", "Nebraska": "NE", "Nevada": "NV", "New Hampshire": "NH", "New Jersey": "NJ",
+    "New Mexico": "NM", "New York": "NY", "North Carolina": "NC", "North Dakota": "ND", "Ohio": "OH",
+    "Oklahoma": "OK", "Oregon": "OR", "Pennsylvania": "PA", "Rhode Island": "RI", "South Carolina": "SC",
+    "South Dakota": "SD", "Tennessee": "TN", "Texas": "TX", "Utah": "UT", "Vermont": "VT",
+    "Virginia": "VA", "Washington": "WA", "West Virginia": "WV", "Wisconsin": "WI", "Wyoming": "WY",
+}
+# Longest names first so "West Virginia" wins over "Virginia"
+STATE_NAMES = "|".join(re.escape(name).replace(r"\ ", r"\s+") for name in sorted(US_STATES, key=len, reverse=True))
+# A bare name is too ambiguous ("Washington Township", "Lincoln, Nebraska Avenue"), so a state
+# only counts in "State/Commonwealth of X" or an address ("Trenton, New Jersey 08608", "NJ 08608")
+STATE_PATTERNS = [
+    re.compile(r"\b(?:state|commonwealth)\s+of\s+(" + STATE_NAMES + r")\b", re.IGNORECASE),
+    re.compile(r",\s*(" + STATE_NAMES + r")\s+\d{5}(?:-\d{4})?\b", re.IGNORECASE),
+    re.compile(r",\s*(" + "|".join(US_STATES.values()) + r")\.?\s+\d{5}(?:-\d{4})?\b"),
+]
+STATE_ABBREVIATIONS = set(US_STATES.values())
+# "Ordinance No. 12", "Bill #4" anywhere, or a bare "ORDINANCE 9-2025" heading line
+LEGNO_PATTERN = re.compile(
+    r"(?:\b(ordinance|resolution|local\s+law|bill)\s+(?:no\.?|number|#)|^\s*(ordinance|resolution|local\s+law|bill))"
+    r"\s*:?\s*([A-Z]?\d[\w.]*(?:\s?-\s?[\w.]+)*(?:\s+of\s+\d{4})?)",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Preferred legislation types when the first page numbers several (e.g. a bill and its ordinance)
+LEGTYPE_PRIORITY = ("ordinance", "local law", "resolution", "bill")
+CHAPTER_PATTERN = re.compile(r"\b(?:chapter|title)\s+(\d+[A-Z]?(?:\.\s?\d+)*)\b", re.IGNORECASE)
+SECTION_HEADING_PATTERN = re.compile(r"^\s*section\s+(\d+)\s*[.:]", re.IGNORECASE | re.MULTILINE)
+DISPOSITION_PATTERN = re.compile(r"§+\s*(\d+[A-Z]?(?:\s?[-.:]\s?\d+[A-Z]?)*)")
+DATE_PATTERN = (
+    r"(?:(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}"
+    r"|\d{1,2}/\s?\d{1,2}/\s?\d{2,4}"
+    r"|\d{1,2}(?:st|nd|rd|th)?\s+day\s+of\s+(?:January|February|March|April|May|June|July|August|September|October|November|December),?\s+\d{4})"
+)
+# The date may sit a few lines below the label (signature blocks)
+ADOPTION_DATE_PATTERN = re.compile(
+    r"\b(?:adopted|passed|approved|enacted|final\s+adoption)\b[^.;]{0,80}?(" + DATE_PATTERN + r")",
+    re.IGNORECASE,
+)
+# Lines about first readings and publication carry other dates ("Introduced and passed", "Published upon final adoption")
+NON_ADOPTION_LINE = re.compile(r"\b(?:introduced|published|first\s+reading)\b", re.IGNORECASE)
+DATE_FORMATS = ("%B %d, %Y", "%B %d %Y", "%m/%d/%Y", "%m/%d/%y", "%d day of %B, %Y", "%d day of %B %Y")
+ACTION_PATTERNS = [
+    ("Repeal", re.compile(r"\b(?:repeal|repealing|rescind|rescinding)\b", re.IGNORECASE)),
+    ("Amend", re.compile(r"\b(?:amend|amending|amended|amendment)\b", re.IGNORECASE)),
+    ("Add", re.compile(r"\b(?:adding|add\s+a\s+new|create|creating|establish|establishing|enact\s+a\s+new)\b", re.IGNORECASE)),
+]
+STRUCK_TEXT = re.compile(r"~~.*?~~", re.DOTALL)
+# Recitals ("WHEREAS, ... adopted on <date>") cite earlier legislation, not this one
+RECITAL_PATTERN = re.compile(r"\bwhereas\b", re.IGNORECASE)
+ENACTING_PATTERN = re.compile(r"\b(?:be\s+it|now,?\s+therefore|ordained|enacted\s+by)\b", re.IGNORECASE)
+
+def field(value, confidence):
+    return {"value": value, "confidence": confidence}
+
+def unique(values):
+    seen = {}
+    for value in values:
+        seen.setdefault(value.lower(), value)
+    return list(seen.values())
+
+def parse_date(text):
+    """
+    Returns the datetime for a DATE_PATTERN match, or None.
+    """
+    text = re.sub(r"(?<=/)\s+", "", re.sub(r"\s+", " ", text)).strip()
+    text = re.sub(r"(?<=\d)(?:st|nd|rd|th)\b", "", text)
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+def in_recital(text, pos):
+    """
+    True if pos falls in a WHEREAS recital, i.e. after the last WHEREAS and before any
+    enacting clause.
+    """
+    last_recital = max((m.start() for m in RECITAL_PATTERN.finditer(text, 0, pos)), default=-1)
+    last_enacting = max((m.start() for m in ENACTING_PATTERN.finditer(text, 0, pos)), default=-1)
+    return last_recital > last_enacting
+
+def extract_fields(page_texts, struck_words=0):
+    """
+    Runs the compiled rules over a document's text layer and returns
+    {field: {"value": str, "confidence": float}} for every field a rule decided.
+
+    page_texts are the per-page texts in order (text_layer markup; struck-through ~~runs~~
+    are ignored except as REDLINE evidence). Header fields (LEGNO, LEGTYPE, CHAPTER/TITLE,
+    ACTION_CLASSIFICATION) are read from the first page only, as the prompt instructs.
+    Confidences are fixed per rule: higher for the tightly anchored patterns.
+    """
+    if not page_texts:
+        return {}
+    pages = [STRUCK_TEXT.sub(" ", text) for text in page_texts]
+    first, full = pages[0], "\n".join(pages)
+    fields = {}
+    numbered = []
+    for m in LEGNO_PATTERN.finditer(first):
+        legtype = " ".join((m.group(1) or m.group(2)).lower().split())
+        numbered.append((LEGTYPE_PRIORITY.index(legtype), m.start(), legtype, m.group(3)))
+    if numbered:
+        _, start, legtype, number = min(numbered)
+        fields["LEGNO"] = field(re.sub(r"\s+(?=-)|(?<=-)\s+", "", number).strip(" ."), 0.9 if start < 800 else 0.6)
+        fields["LEGTYPE"] = field(legtype.capitalize(), 0.9)
+    states = []
+    for pattern in STATE_PATTERNS:
+        for m in pattern.finditer(full):
+            name = " ".join(m.group(1).split())
+            states.append((m.start(), name if name in STATE_ABBREVIATIONS else US_STATES[name.title()]))
+    states = [state for _, state in sorted(states)]
+    if states:
+        counts = Counter(states)
+        top = max(counts.values())
+        # Most frequent, ties broken by first appearance
+        fields["STATE"] = field(next(s for s in states if counts[s] == top), 0.95)
+    if m := CHAPTER_PATTERN.search(first):
+        fields["CHAPTER/TITLE"] = field(re.sub(r"\s+", "", m.group(1)), 0.7)
+    sections = unique(SECTION_HEADING_PATTERN.findall(full))
+    if sections:
+        fields["SECTION"] = field("; ".join(sections), 0.6)
+    # In the prompt's "§1-16" form; labels often use other forms (e.g. "1:III"), so this is a hint only
+    dispositions = unique("§" + re.sub(r"\s+", "", d) for d in DISPOSITION_PATTERN.findall(full))
+    if dispositions:
+        fields["DISPOSITION"] = field("; ".join(dispositions), 0.6)
+    dates = [parse_date(m.group(1)) for m in ADOPTION_DATE_PATTERN.finditer(full)
+             if not in_recital(full, m.start())
+             and not NON_ADOPTION_LINE.search(full[full.rfind("\n", 0, m.start()) + 1:m.start()])]
+    dates = [d for d in dates if d is not None]
+    if dates:
+        # Most recent, as the prompt asks for multi-page documents, in a format
+        # pipeline.normalize_result parses
+        latest = max(dates)
+        fields["ADOPTION_DATE"] = field(f"{latest:%B} {latest.day}, {latest.year}", 0.8)
+    title = first[:1500]
+    for action, pattern in ACTION_PATTERNS:
+        if pattern.search(title):
+            fields["ACTION_CLASSIFICATION"] = field(action, 0.8 if action != "Add" else 0.6)
+            break
+    # Struck words are good evidence of a redline, but finding none isn't evidence of its
+    # absence (redlines drawn as images, or strike styles text_layer doesn't recognize)
+    fields["REDLINE"] = field("X" if struck_words else "", 0.9 if struck_words else 0.4)
+    if struck_words:
+        fields["ACTION_CLASSIFICATION"] = field("Amend", 0.9)
+    return fields
+
+def format_hints(fields):
+    """
+    One line per pre-extracted field, for the $fields placeholder of a prompt template's
+    rule hints section.
+    """
+    return "\n".join(f"- {name}: {f['value'] or '(none found)'} (confidence {f['confidence']:.2f})" for name, f in fields.items())
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+class RunJournal:
+    """
+    Append-only JSONL journal of a folder run, one line per finished document:
+    {"lfid", "fingerprint", "status", "time", "result" | "error"}. The result keeps each
+    request's raw model reply next to its parsed JSON (see pipeline.build_pdf_result).
+
+    Every line is flushed and fsynced before record() returns, so a run that dies keeps
+    everything it finished. The last line for an LFID wins; a document counts as done
+    only if its last line is "done" with the same fingerprint, so a changed PDF, prompt
+    version, model or run setting is processed again. A torn last line from a crash is
+    cut off when the journal is opened, so the next record starts on a line of its own.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries = {}
+        if self.path.exists():
+            data = self.path.read_bytes()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                with open(self.path, "r+b") as f:
+                    f.truncate(end)
+                    os.fsync(f.fileno())
+                data = data[:end]
+            for line in data.decode("utf-8", errors="replace").splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._entries[entry["lfid"]] = entry
+
+    def reset(self):
+        """
+        Starts a fresh journal, keeping the previous one as <name>.<timestamp>.bak
+        (<name>.<timestamp>-<n>.bak if that backup already exists).
+        """
+        with self._lock:
+            if self.path.exists():
+                stamp = time.strftime("%Y%m%d-%H%M%S")
+                backup = self.path.with_name(f"{self.path.name}.{stamp}.bak")
+                n = 1
+                while backup.exists():
+                    backup = self.path.with_name(f"{self.path.name}.{stamp}-{n}.bak")
+                    n += 1
+                self.path.rename(backup)
+            self._entries = {}
+
+    def completed(self, lfid, fingerprint):
+        """
+        The journaled result for lfid if it finished with this fingerprint, else None.
+        """
+        entry = self._entries.get(lfid)
+        if entry and entry["status"] == "done" and entry["fingerprint"] == fingerprint:
+            return entry["result"]
+        return None
+
+    def record(self, lfid, fingerprint, result=None, error=None):
+        entry = {
+            "lfid": lfid,
+            "fingerprint": fingerprint,
+            "status": "error" if error is not None else "done",
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        if error is not None:
+            entry["error"] = error
+        else:
+            entry["result"] = result
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._entries[lfid] = entry
+
+    def rows(self, lfids):
+        """
+        The output rows of the given LFIDs that are done, in the given order.
+        """
+        entries = [self._entries.get(lfid) for lfid in lfids]
+        return [e["result"]["aggregated_results"] for e in entries if e and e["status"] == "done"]
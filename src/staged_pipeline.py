@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+import metrics
+import pipeline
+from debug_log import configure_debug_log
+
+_DONE = object()
+
+class StageFailure:
+    """
+    Stands in for an item whose stage raised; later stages pass it through to the sink.
+    """
+
+    def __init__(self, stage, item, exc):
+        self.stage = stage
+        self.item = item
+        self.exc = exc
+
+class Stage:
+    """
+    One step of a StagedPipeline: fn(item) returns an iterable of output items (none, one,
+    or several to fan out) and runs on `workers` threads.
+    """
+
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+
+class StagedPipeline:
+    """
+    Producer/consumer chain of stages connected by bounded queues.
+
+    Each stage's workers read from the stage's input queue and write to the next stage's;
+    the last queue feeds the sink (the caller iterating run()). A full queue blocks its
+    producers, so a slow stage throttles the ones before it instead of letting rendered
+    pages pile up in memory, while every stage keeps working on different documents at once.
+    """
+
+    def __init__(self, stages, queue_size=8):
+        self.stages = list(stages)
+        self.queue_names = [stage.name for stage in self.stages] + ["sink"]
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in self.queue_names]
+        self.peak_depths = dict.fromkeys(self.queue_names, 0)
+        self._stop = threading.Event()
+
+    def queue_depths(self):
+        """
+        Items waiting in front of each stage (and the sink) right now.
+        """
+        return {name: q.qsize() for name, q in zip(self.queue_names, self.queues)}
+
+    def _put(self, index, item):
+        q = self.queues[index]
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            name = self.queue_names[index]
+            self.peak_depths[name] = max(self.peak_depths[name], q.qsize())
+            return
+
+    def _get(self, index):
+        q = self.queues[index]
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self, items):
+        for item in items:
+            if self._stop.is_set():
+                return
+            self._put(0, item)
+        for _ in range(self.stages[0].workers):
+            self._put(0, _DONE)
+
+    def _work(self, index, remaining, lock):
+        stage = self.stages[index]
+        while True:
+            item = self._get(index)
+            if item is _DONE:
+                break
+            if isinstance(item, StageFailure):
+                self._put(index + 1, item)
+                continue
+            try:
+                for output in stage.fn(item):
+                    self._put(index + 1, output)
+            except Exception as e:
+                self._put(index + 1, StageFailure(stage.name, item, e))
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        # The stage's last worker to finish tells every worker of the next stage to stop
+        if last:
+            next_workers = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            for _ in range(next_workers):
+                self._put(index + 1, _DONE)
+
+    def run(self, items):
+        """
+        Feeds items through every stage and yields the last stage's outputs (and
+        StageFailure items) in completion order.
+        """
+        self._stop.clear()
+        threads = [threading.Thread(target=self._feed, args=(items,), daemon=True)]
+        for index, stage in enumerate(self.stages):
+            remaining, lock = [stage.workers], threading.Lock()
+            threads += [threading.Thread(target=self._work, args=(index, remaining, lock), daemon=True,
+                                         name=f"{stage.name}-{n}") for n in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(len(self.stages))
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+def process_folder_staged(folder_path, prompt, model_id="us.amazon.nova-pro-v1:0", analyze_workers=2,
+                          render_workers=None, build_workers=1, inference_workers=8, parse_workers=1,
+                          queue_size=8, resume=True, metrics_interval=None, metrics_path=None):
+    """
+    Pipelined counterpart of pipeline.process_folder. Documents flow through
+    analyze (open, filter pages, text layer, rules) -> render (rasterize and compress) ->
+    build (one Converse request per chunk) -> inference -> parse -> sink (merge chunks,
+    normalize, journal), each stage with its own worker count and a bounded queue in
+    front of it, so rendering the next documents overlaps waiting on Bedrock for earlier
+    ones. With metrics_interval, queue depths are printed to stderr as JSON lines every
+    metrics_interval seconds. Uses the same run journal, stage metrics (written to
+    metrics_path as JSON lines if given), Excel output and failure reporting as process_folder.
+
+    PyMuPDF isn't thread-safe, so fitz work in the analyze and render threads is serialized
+    by pipeline.FITZ_LOCK, and the analyze stage closes each document it opened. Rendering
+    runs in parallel in pipeline's spawn render pool, which gets every page. With the pool
+    disabled (pipeline.configure_render_pool(workers=1)), pages are rendered in the render
+    thread from a fresh open under the lock, so render_workers then defaults to one thread.
+    """
+    folder = Path(folder_path)
+    pipeline.clean_chunks_folders(folder)
+    pdf_files = sorted(folder.glob("*.pdf"), key=lambda p: p.name)
+    journal = pipeline.open_run_journal(folder, resume)
+    metrics.METRICS.reset()
+    results = {}
+    jobs = []
+    for pdf_file in pdf_files:
+        fingerprint = pipeline.document_fingerprint(pdf_file, prompt, model_id)
+        done = journal.completed(pdf_file.stem, fingerprint)
+        if done is not None:
+            results[pdf_file.stem] = done
+        else:
+            jobs.append({"lfid": pdf_file.stem, "pdf_path": pdf_file, "fingerprint": fingerprint})
+
+    def analyze(job):
+        plan = pipeline.plan_document(job["pdf_path"], prompt)
+        # The open document must not cross to a render thread
+        pipeline.close_analysis(plan["analysis"])
+        yield {**job, "plan": plan}
+
+    def render(job):
+        plan = job.pop("plan")
+        yield {**job, "document": pipeline.render_planned_document(plan, folder/"chunks", pool_min_pages=1)}
+
+    def build(job):
+        document = job.pop("document")
+        meta = {
+            **job,
+            "type": document["type"],
+            "prompt_version": document["prompt_version"],
+            "chunks": [{"page_numbers": chunk["page_numbers"]} for chunk in document["chunks"]],
+        }
+        for k, chunk in enumerate(document["chunks"]):
+            converse_kwargs = pipeline.document_converse_request(document, model_id=model_id, chunk=chunk)
+            yield {**meta, "part": k, "parts": len(document["chunks"]), "converse_kwargs": converse_kwargs}
+
+    def inference(item):
+        if "converse_kwargs" in item:
+            item["model_response"] = pipeline.invoke_converse(item.pop("converse_kwargs"))
+        yield item
+
+    def parse(item):
+        if "model_response" in item:
+            item["chunk_json"] = pipeline.parse_model_response(item["model_response"], item["pdf_path"])
+        yield item
+
+    def attributed(fn):
+        # Items hop between threads, so each stage re-enters the item's document
+        def run(item):
+            with metrics.document(item["lfid"]):
+                return list(fn(item))
+        return run
+
+    staged = StagedPipeline([
+        Stage("analyze", attributed(analyze), analyze_workers),
+        Stage("render", attributed(render), render_workers or (2 if pipeline.RENDER_WORKERS > 1 else 1)),
+        Stage("build", attributed(build), build_workers),
+        Stage("inference", attributed(inference), inference_workers),
+        Stage("parse", attributed(parse), parse_workers),
+    ], queue_size=queue_size)
+
+    stop_metrics = threading.Event()
+    def report_metrics():
+        while not stop_metrics.wait(metrics_interval):
+            print(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "done": len(results),
+                              "queues": staged.queue_depths()}), file=sys.stderr, flush=True)
+    if metrics_interval:
+        threading.Thread(target=report_metrics, daemon=True).start()
+
+    parts = {}
+    failures = {}
+    try:
+        for item in staged.run(jobs):
+            if isinstance(item, StageFailure):
+                lfid = item.item["lfid"]
+                if lfid not in failures:
+                    failures[lfid] = f"{item.stage}: {type(item.exc).__name__}: {item.exc}"
+                    journal.record(lfid, item.item["fingerprint"], error=failures[lfid])
+                continue
+            lfid = item["lfid"]
+            if lfid in failures:
+                continue
+            parts.setdefault(lfid, {})[item["part"]] = (item["chunk_json"], item.get("model_response"))
+            if len(parts[lfid]) < item["parts"]:
+                continue
+            done_parts = parts.pop(lfid)
+            chunk_jsons, model_responses = zip(*(done_parts[k] for k in range(item["parts"])))
+            if len(chunk_jsons) == 1:
+                result = pipeline.build_pdf_result(item["pdf_path"], item["type"], chunk_jsons[0], item["prompt_version"],
+                                                   model_responses[0])
+            else:
+                result = pipeline.build_chunked_pdf_result(item["pdf_path"], item["type"], item["chunks"],
+                                                           list(chunk_jsons), item["prompt_version"], list(model_responses))
+            with metrics.document(lfid):
+                results[lfid] = pipeline.normalize_result(result, lfid)
+            journal.record(lfid, item["fingerprint"], results[lfid])
+    finally:
+        stop_metrics.set()
+    pipeline.write_index_excel(journal.rows([p.stem for p in pdf_files]), folder, model_id)
+    if metrics_path:
+        metrics.METRICS.write_jsonl(metrics_path)
+    # Like process_folder: failures are journaled and reported after the others are written
+    return pipeline.folder_results(pdf_files, results, failures)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract legislation fields from a folder of PDFs with pipelined render and inference stages.")
+    parser.add_argument("folder_path", help="Folder containing the PDFs to process")
+    parser.add_argument("--analyze-workers", type=int, default=2, help="Threads opening PDFs, filtering pages and reading the text layer")
+    parser.add_argument("--render-workers", type=int, default=None, help="Documents rendered at once (default: 2, or 1 with --render-processes 1)")
+    parser.add_argument("--render-processes", type=int, default=os.cpu_count() or 1, help="Processes rendering and compressing pages (default: CPU count; 1 renders in the render thread)")
+    parser.add_argument("--build-workers", type=int, default=1, help="Threads building Converse requests")
+    parser.add_argument("--inference-workers", type=int, default=8, help="Concurrent Bedrock requests (still paced by the rate limiter)")
+    parser.add_argument("--parse-workers", type=int, default=1, help="Threads parsing model replies")
+    parser.add_argument("--queue-size", type=int, default=8, help="Items each stage may have waiting before its producers block")
+    parser.add_argument("--metrics-interval", type=float, default=None, help="Print queue depths to stderr every N seconds")
+    parser.add_argument("--metrics", default=None, help="Write per-document stage timings and counters to this JSON-lines file")
+    parser.add_argument("--endpoint-url", default=None, help="Converse-compatible endpoint, e.g. a local converse_stub (default: regional bedrock-runtime)")
+    parser.add_argument("--no-sign", action="store_true", help="Don't SigV4-sign requests (for local stub servers)")
+    parser.add_argument("--region", default=None, help="AWS region (default: from the AWS config, else us-east-1)")
+    parser.add_argument("--rps", type=float, default=1.0, help="Initial Bedrock requests/sec; adapts up to --max-rps and backs off on throttling")
+    parser.add_argument("--max-rps", type=float, default=10.0, help="Upper bound for the adaptive request rate")
+    parser.add_argument("--tpm", type=int, default=None, help="Bedrock tokens/min budget (default: unlimited)")
+    parser.add_argument("--cache", choices=pipeline.CACHE_MODES, default="use", help="Bedrock response cache: use, refresh or off")
+    parser.add_argument("--prompt-version", choices=pipeline.list_prompt_versions(), default=pipeline.DEFAULT_PROMPT_VERSION, help="Prompt template from data/prompts")
+    parser.add_argument("--fresh", action="store_true", help=f"Ignore the folder's {pipeline.JOURNAL_FILENAME} and reprocess every PDF")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="INFO", help="bedrock_api_debug.log level; DEBUG also logs every request payload")
+    args = parser.parse_args()
+    configure_debug_log(level=args.log_level)
+    pipeline.configure_render_pool(workers=args.render_processes)
+    pipeline.configure_bedrock_client(max_pool_connections=max(50, args.inference_workers),
+                                      endpoint_url=args.endpoint_url, sign=not args.no_sign, region_name=args.region)
+    pipeline.configure_rate_limiter(requests_per_second=args.rps, tokens_per_minute=args.tpm, max_requests_per_second=args.max_rps)
+    pipeline.configure_response_cache(mode=args.cache)
+    pipeline.configure_prompt_template(args.prompt_version)
+    try:
+        output, failures = process_folder_staged(
+            args.folder_path, args.prompt_version, model_id="us.amazon.nova-pro-v1:0",
+            analyze_workers=args.analyze_workers, render_workers=args.render_workers, build_workers=args.build_workers,
+            inference_workers=args.inference_workers, parse_workers=args.parse_workers, queue_size=args.queue_size,
+            resume=not args.fresh, metrics_interval=args.metrics_interval, metrics_path=args.metrics,
+        ), {}
+    except pipeline.FolderRunError as e:
+        output, failures = e.results, e.failures
+    print(json.dumps(output, indent=2))
+    print(metrics.METRICS.summary_table(), file=sys.stderr)
+    for lfid, error in failures.items():
+        print(f"FAILED {lfid}: {error}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
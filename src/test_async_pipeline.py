@@ -0,0 +1,80 @@
+import asyncio
+import shutil
+
+import pytest
+
+import async_pipeline
+import converse_stub
+import metrics
+import pipeline
+from rate_limiter import RateLimiter
+
+def copy_samples(folder, copies):
+    for pdf in sorted(folder.glob("*.pdf")):
+        for n in range(1, copies):
+            shutil.copy(pdf, folder / f"{pdf.stem}_{n}.pdf")
+    return sorted(folder.glob("*.pdf"))
+
+def test_process_folder_async_against_stub(sample_folder, stub_server, monkeypatch):
+    pdfs = copy_samples(sample_folder, 4)
+    server, url = stub_server(latency=0.05)
+    in_progress, peak = [0], [0]
+    process_pdf_async = async_pipeline.process_pdf_async
+
+    async def counting_process_pdf_async(*args, **kwargs):
+        in_progress[0] += 1
+        peak[0] = max(peak[0], in_progress[0])
+        try:
+            return await process_pdf_async(*args, **kwargs)
+        finally:
+            in_progress[0] -= 1
+
+    monkeypatch.setattr(async_pipeline, "process_pdf_async", counting_process_pdf_async)
+    results = asyncio.run(async_pipeline.process_folder_async(
+        sample_folder, pipeline.DEFAULT_PROMPT_VERSION, max_in_flight=3, cpu_workers=2, endpoint_url=url, sign=False,
+    ))
+    rows = [result["aggregated_results"] for result in results]
+    assert [row["LFID"] for row in rows] == [p.stem for p in pdfs]
+    assert all(row["LEGNO"] == converse_stub.CANNED_RECORD["LEGNO"] for row in rows)
+    # The semaphore bounds documents in progress, and documents did overlap
+    assert peak[0] == 3
+    assert server.stats_snapshot()["requests"] == len(pdfs)
+    assert len(list(sample_folder.glob("index_*.xlsx"))) == 1
+
+def test_process_folder_async_retries_throttling(sample_folder, stub_server, monkeypatch):
+    pdfs = copy_samples(sample_folder, 3)
+    # A 2 req/s quota against 6 documents sent at once throttles some of them
+    server, url = stub_server(latency=0.01, max_rps=2)
+    monkeypatch.setattr(pipeline, "BEDROCK_RATE_LIMITER", RateLimiter(
+        requests_per_second=50.0, max_requests_per_second=50.0, max_retries=10, base_delay=0.1, max_delay=1.0,
+    ))
+    results = asyncio.run(async_pipeline.process_folder_async(
+        sample_folder, pipeline.DEFAULT_PROMPT_VERSION, max_in_flight=len(pdfs), endpoint_url=url, sign=False,
+    ))
+    stats = server.stats_snapshot()
+    assert stats["throttled"] > 0
+    assert stats["ok"] == len(pdfs)
+    assert all(result["aggregated_results"]["LEGNO"] == converse_stub.CANNED_RECORD["LEGNO"] for result in results)
+    retries = sum(doc["counters"].get("retries", 0) for doc in metrics.METRICS.documents())
+    assert retries == stats["throttled"]
+    assert pipeline.BEDROCK_RATE_LIMITER.rate < 50.0
+
+def test_failed_document_does_not_cancel_the_others(sample_folder, stub_server, monkeypatch):
+    pdfs = copy_samples(sample_folder, 2)
+    failing = pdfs[0].stem
+    server, url = stub_server(latency=0.05)
+    process_pdf_async = async_pipeline.process_pdf_async
+
+    async def failing_process_pdf_async(pdf_file, *args, **kwargs):
+        if pdf_file.stem == failing:
+            raise RuntimeError("model unavailable")
+        return await process_pdf_async(pdf_file, *args, **kwargs)
+
+    monkeypatch.setattr(async_pipeline, "process_pdf_async", failing_process_pdf_async)
+    with pytest.raises(pipeline.FolderRunError) as excinfo:
+        asyncio.run(async_pipeline.process_folder_async(
+            sample_folder, pipeline.DEFAULT_PROMPT_VERSION, max_in_flight=4, cpu_workers=2, endpoint_url=url, sign=False,
+        ))
+    assert list(excinfo.value.failures) == [failing]
+    assert [result["aggregated_results"]["LFID"] for result in excinfo.value.results] == [p.stem for p in pdfs[1:]]
+    assert len(list(sample_folder.glob("index_*.xlsx"))) == 1
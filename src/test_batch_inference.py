@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import batch_inference
+import converse_stub
+import pipeline
+
+def nova_output(record):
+    return {"output": {"message": {"role": "assistant", "content": [{"text": json.dumps(record)}]}}}
+
+def test_failed_record_is_retried_on_resume(sample_folder, tmp_path):
+    pdfs = sorted(sample_folder.glob("*.pdf"))
+    calls = []
+
+    def invoke(model_input, model_id):
+        calls.append(model_id)
+        if len(calls) == 1:
+            raise RuntimeError("ThrottlingException")
+        return nova_output(converse_stub.CANNED_RECORD)
+
+    store = batch_inference.LocalBatchStore(tmp_path / "store")
+    # One worker keeps the manifest order, so the first document's record is the one that fails
+    runner = batch_inference.LocalBatchJobRunner(store, invoke=invoke, max_workers=1)
+    with pytest.raises(pipeline.FolderRunError) as excinfo:
+        batch_inference.process_folder_batch(sample_folder, pipeline.DEFAULT_PROMPT_VERSION, store, runner,
+                                             job_name="first", poll_interval=0, max_workers=1)
+    assert list(excinfo.value.failures) == [pdfs[0].stem]
+    assert "RuntimeError: ThrottlingException" in excinfo.value.failures[pdfs[0].stem]
+    assert [result["aggregated_results"]["LFID"] for result in excinfo.value.results] == [p.stem for p in pdfs[1:]]
+    assert len(list(sample_folder.glob("index_*.xlsx"))) == 1
+
+    sent = len(calls)
+    results = batch_inference.process_folder_batch(sample_folder, pipeline.DEFAULT_PROMPT_VERSION, store, runner,
+                                                   job_name="second", poll_interval=0, max_workers=1)
+    assert [result["aggregated_results"]["LFID"] for result in results] == [p.stem for p in pdfs]
+    assert all(result["aggregated_results"]["LEGNO"] == converse_stub.CANNED_RECORD["LEGNO"] for result in results)
+    # Only the failed document's records go into the second job
+    resent = list(store.read_manifest(store.input_uri("second")))
+    assert len(calls) - sent == len(resent)
+    assert {record["recordId"].split("_part")[0] for record in resent} == {pdfs[0].stem}
+
+def test_local_batch_job(sample_folder, tmp_path):
+    pdfs = sorted(sample_folder.glob("*.pdf"))
+    store = batch_inference.LocalBatchStore(tmp_path / "store")
+    runner = batch_inference.LocalBatchJobRunner(store, invoke=lambda model_input, model_id: nova_output(converse_stub.CANNED_RECORD))
+    results = batch_inference.process_folder_batch(sample_folder, pipeline.DEFAULT_PROMPT_VERSION, store, runner,
+                                                   job_name="job", poll_interval=0)
+    rows = [result["aggregated_results"] for result in results]
+    assert [row["LFID"] for row in rows] == [p.stem for p in pdfs]
+    assert all(row["STATE"] == converse_stub.CANNED_RECORD["STATE"] for row in rows)
+    assert len(list(sample_folder.glob("index_*.xlsx"))) == 1
+    # Every manifest record got exactly one output line, in Bedrock's format
+    manifest = list(store.read_manifest(store.input_uri("job")))
+    outputs = list(store.read_outputs(store.output_uri("job")))
+    assert sorted(line["recordId"] for line in outputs) == sorted(record["recordId"] for record in manifest)
+    assert all("modelOutput" in line and "messages" in line["modelInput"] for line in outputs)
+
+    # A rerun finds every document in the journal and submits no job
+    assert batch_inference.process_folder_batch(sample_folder, pipeline.DEFAULT_PROMPT_VERSION, store, runner,
+                                                job_name="again", poll_interval=0) == results
+    assert not (tmp_path / "store" / "output" / "again").exists()
+
+def test_local_runner_writes_error_lines(tmp_path):
+    store = batch_inference.LocalBatchStore(tmp_path)
+    input_uri = store.write_manifest("job", [{"recordId": "a", "modelInput": {"n": 1}}, {"recordId": "b", "modelInput": {"n": 2}}])
+
+    def invoke(model_input, model_id):
+        if model_input["n"] == 2:
+            raise ValueError("bad input")
+        return nova_output({"LEGNO": "1"})
+
+    runner = batch_inference.LocalBatchJobRunner(store, invoke=invoke)
+    job_id = runner.submit("job", "us.amazon.nova-pro-v1:0", input_uri, store.output_uri("job"))
+    assert runner.status(job_id) == "Completed"
+    lines = {line["recordId"]: line for line in store.read_outputs(store.output_uri("job"))}
+    assert json.loads(batch_inference.model_output_text(lines["a"]["modelOutput"])) == {"LEGNO": "1"}
+    assert lines["b"]["error"] == {"errorCode": "ValueError", "errorMessage": "bad input"}
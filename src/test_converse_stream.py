@@ -0,0 +1,44 @@
+import converse_stub
+import metrics
+import pipeline
+from rate_limiter import RateLimiter
+
+def stream_request(text="Extract the fields."):
+    return {
+        "modelId": "us.amazon.nova-pro-v1:0",
+        "messages": [{"role": "user", "content": [{"text": text}]}],
+        "inferenceConfig": {"temperature": 0.0},
+    }
+
+def test_stream_reads_through_to_metadata(sample_folder, stub_server, monkeypatch):
+    server, url = stub_server(latency=0.01)
+    pipeline.configure_bedrock_client(endpoint_url=url, sign=False)
+    limiter = RateLimiter(requests_per_second=50.0, tokens_per_minute=1_000_000)
+    monkeypatch.setattr(pipeline, "BEDROCK_RATE_LIMITER", limiter)
+    records = []
+    try:
+        with metrics.document("doc"):
+            text = pipeline.invoke_converse_stream(stream_request(), on_record=records.append)
+    finally:
+        pipeline.configure_bedrock_client()
+    assert records == [converse_stub.CANNED_RECORD]
+    assert pipeline.parse_model_response(text, "doc.pdf") == [converse_stub.CANNED_RECORD]
+    counters = next(doc["counters"] for doc in metrics.METRICS.documents() if doc["lfid"] == "doc")
+    assert counters["requests"] == 1
+    assert counters["input_tokens"] > 0 and counters["output_tokens"] > 0
+    # The estimate was corrected with the usage from the metadata event
+    assert limiter._token_budget < 1_000_000 - counters["input_tokens"]
+    assert server.stats_snapshot()["ok"] == 1
+
+def test_derailed_stream_is_abandoned(sample_folder, stub_server, monkeypatch):
+    server, url = stub_server(latency=0.01, malformed_rate=1.0)
+    pipeline.configure_bedrock_client(endpoint_url=url, sign=False)
+    monkeypatch.setattr(pipeline, "BEDROCK_RATE_LIMITER", RateLimiter(requests_per_second=50.0))
+    records = []
+    try:
+        text = pipeline.invoke_converse_stream(stream_request(), on_record=records.append, max_preamble_chars=10)
+    finally:
+        pipeline.configure_bedrock_client()
+    assert records == []
+    assert converse_stub.MALFORMED_REPLY.startswith(text)
+    assert len(text) < len(converse_stub.MALFORMED_REPLY)
@@ -0,0 +1,91 @@
+import shutil
+import time
+
+import pandas as pd
+import pytest
+
+import converse_stub
+import pipeline
+
+def test_process_folder_against_stub(sample_folder, stub_bedrock):
+    pdfs = sorted(sample_folder.glob("*.pdf"))
+    results = pipeline.process_folder(sample_folder, pipeline.DEFAULT_PROMPT_VERSION)
+    rows = [result["aggregated_results"] for result in results]
+    assert [row["LFID"] for row in rows] == [p.stem for p in pdfs]
+    for row in rows:
+        assert row["STATE"] == converse_stub.CANNED_RECORD["STATE"]
+        assert row["LEGNO"] == converse_stub.CANNED_RECORD["LEGNO"]
+        assert row["PROMPT_VERSION"] == pipeline.DEFAULT_PROMPT_VERSION
+    assert all(chunk["raw_response"] for result in results for chunk in result["chunks"])
+    assert len(list(sample_folder.glob("index_*.xlsx"))) == 1
+    requests = stub_bedrock.stats_snapshot()["requests"]
+    assert requests >= len(pdfs)
+
+    # A rerun resumes from the journal without calling the model again
+    assert pipeline.process_folder(sample_folder, pipeline.DEFAULT_PROMPT_VERSION) == results
+    assert stub_bedrock.stats_snapshot()["requests"] == requests
+
+def test_failed_document_is_retried_on_resume(sample_folder, stub_bedrock, monkeypatch):
+    pdfs = sorted(sample_folder.glob("*.pdf"))
+    failing = pdfs[-1].stem
+    process_pdf = pipeline.process_pdf
+
+    def failing_process_pdf(pdf_path, *args, **kwargs):
+        if pdf_path.stem == failing:
+            raise RuntimeError("model unavailable")
+        return process_pdf(pdf_path, *args, **kwargs)
+
+    monkeypatch.setattr(pipeline, "process_pdf", failing_process_pdf)
+    with pytest.raises(pipeline.FolderRunError) as excinfo:
+        pipeline.process_folder(sample_folder, pipeline.DEFAULT_PROMPT_VERSION, max_workers=2)
+    assert excinfo.value.failures == {failing: "RuntimeError: model unavailable"}
+    assert [result["aggregated_results"]["LFID"] for result in excinfo.value.results] == [p.stem for p in pdfs[:-1]]
+    # The index is still written for the documents that finished
+    [index] = sample_folder.glob("index_*.xlsx")
+    assert pd.read_excel(index)["LFID"].astype(str).tolist() == [p.stem for p in pdfs[:-1]]
+
+    monkeypatch.setattr(pipeline, "process_pdf", process_pdf)
+    requests = stub_bedrock.stats_snapshot()["requests"]
+    results = pipeline.process_folder(sample_folder, pipeline.DEFAULT_PROMPT_VERSION)
+    assert [result["aggregated_results"]["LFID"] for result in results] == [p.stem for p in pdfs]
+    # Only the failed document is sent again
+    assert stub_bedrock.stats_snapshot()["requests"] == requests + 1
+
+def test_threads_render_one_page_at_a_time(sample_folder, stub_bedrock, monkeypatch):
+    for pdf in sorted(sample_folder.glob("*.pdf")):
+        for n in range(1, 4):
+            shutil.copy(pdf, sample_folder / f"{pdf.stem}_{n}.pdf")
+    in_progress, peak = [0], [0]
+    render_page_image = pipeline.render_page_image
+
+    def counting_render_page_image(*args, **kwargs):
+        in_progress[0] += 1
+        peak[0] = max(peak[0], in_progress[0])
+        try:
+            time.sleep(0.01)
+            return render_page_image(*args, **kwargs)
+        finally:
+            in_progress[0] -= 1
+
+    # RENDER_WORKERS=1 keeps rendering in the worker threads, where fitz calls are serialized
+    monkeypatch.setattr(pipeline, "render_page_image", counting_render_page_image)
+    results = pipeline.process_folder(sample_folder, pipeline.DEFAULT_PROMPT_VERSION, max_workers=4)
+    assert len(results) == len(list(sample_folder.glob("*.pdf")))
+    assert peak[0] == 1
+
+def test_sampled_replies_come_from_the_labels(sample_folder, stub_server, monkeypatch):
+    monkeypatch.setattr(pipeline, "BEDROCK_CLIENT_CONFIG", dict(pipeline.BEDROCK_CLIENT_CONFIG))
+    server, url = stub_server(latency=0.01, reply_mode="sampled", labels_path=converse_stub.LABELS_PATH)
+    pipeline.configure_bedrock_client(endpoint_url=url, sign=False)
+    try:
+        results = pipeline.process_folder(sample_folder, pipeline.DEFAULT_PROMPT_VERSION, resume=False)
+        # Same requests, same records
+        assert pipeline.process_folder(sample_folder, pipeline.DEFAULT_PROMPT_VERSION, resume=False) == results
+    finally:
+        pipeline.configure_bedrock_client()
+    labelled = {record["LEGNO"] for record in server.records}
+    assert all(result["aggregated_results"]["LEGNO"] in labelled for result in results)
+
+def test_unknown_reply_mode_is_rejected():
+    with pytest.raises(ValueError):
+        converse_stub.ConverseStubServer(("127.0.0.1", 0), reply_mode="labels")
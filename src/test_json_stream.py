@@ -0,0 +1,40 @@
+import pytest
+
+from json_stream import IncrementalJSONParser, StreamDerailed
+
+def feed_in_pieces(parser, text, size):
+    records = []
+    for i in range(0, len(text), size):
+        records.extend(parser.feed(text[i:i + size]))
+    return records
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_array_records_emitted_as_they_close(size):
+    text = '```json\n[{"LEGNO": "12", "NOTE": "a } in \\"quotes\\""}, {"LEGNO": "13", "NESTED": {"x": [1, 2]}}]\n```'
+    parser = IncrementalJSONParser()
+    records = feed_in_pieces(parser, text, size)
+    assert records == [
+        {"LEGNO": "12", "NOTE": 'a } in "quotes"'},
+        {"LEGNO": "13", "NESTED": {"x": [1, 2]}},
+    ]
+    assert parser.done
+
+def test_record_emitted_before_array_closes():
+    parser = IncrementalJSONParser()
+    assert parser.feed('[{"A": 1}, {"B"') == [{"A": 1}]
+    assert parser.feed(': 2}]') == [{"B": 2}]
+
+def test_bare_object():
+    parser = IncrementalJSONParser()
+    assert parser.feed('Here it is: {"A": {"B": 1}} trailing') == [{"A": {"B": 1}}]
+    assert parser.done
+
+def test_invalid_record_kept_aside():
+    parser = IncrementalJSONParser()
+    assert parser.feed('[{"A": 1,}, {"B": 2}]') == [{"B": 2}]
+    assert parser.invalid_records == ['{"A": 1,}']
+
+def test_prose_derails():
+    parser = IncrementalJSONParser(max_preamble_chars=10)
+    with pytest.raises(StreamDerailed):
+        parser.feed("I'm sorry, I could not find any legislation.")
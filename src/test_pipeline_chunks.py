@@ -0,0 +1,60 @@
+import pytest
+
+from pipeline import merge_chunk_records, plan_page_chunks
+
+def test_single_request_when_everything_fits():
+    assert plan_page_chunks([100] * 5, max_images=20, max_bytes=10_000) == [[0, 1, 2, 3, 4]]
+
+def test_chunks_are_balanced_by_page_count():
+    # 7 pages at 3 per request: 3+2+2 rather than 3+3+1
+    groups = plan_page_chunks([100] * 7, max_images=3, max_bytes=10_000)
+    assert [i for group in groups for i in group] == list(range(7))
+    assert len(groups) == 3
+    assert max(map(len, groups)) - min(map(len, groups)) <= 1
+
+def test_chunks_respect_byte_limit():
+    groups = plan_page_chunks([400, 400, 400, 400], max_images=20, max_bytes=1000)
+    assert groups == [[0, 1], [2, 3]]
+    # An oversized page still goes out, on its own
+    assert plan_page_chunks([2000, 100], max_images=20, max_bytes=1000) == [[0], [1]]
+
+def test_example_images_count_against_the_limit(tmp_path):
+    example = tmp_path / "example.jpg"
+    example.write_bytes(b"x" * 10)
+    assert plan_page_chunks([1, 1], example_image_paths=[example], max_images=2, max_bytes=1000) == [[0], [1]]
+    with pytest.raises(ValueError):
+        plan_page_chunks([1], example_image_paths=[example], max_images=1, max_bytes=1000)
+
+def test_merge_chunk_records():
+    merged = merge_chunk_records([
+        [{"LEGNO": "2025-14", "STATE": "NJ", "ADOPTION_DATE": "March 3, 2025", "SECTION": "1; 2", "REDLINE": ""}],
+        {"raw_response": "not JSON"},
+        [{"LEGNO": "", "STATE": "NY", "ADOPTION_DATE": "April 28, 2025", "SECTION": "2; 3", "REDLINE": "X"}],
+        [{"LEGNO": "9", "STATE": "NJ", "ADOPTION_DATE": "", "SECTION": "1", "REDLINE": ""}],
+    ])
+    assert merged == {
+        "LEGNO": "2025-14",
+        "STATE": "NJ",
+        "ADOPTION_DATE": "April 28, 2025",
+        "SECTION": "1; 2; 3",
+        "REDLINE": "X",
+    }
+
+def test_merge_without_parseable_chunks():
+    assert "raw_response" in merge_chunk_records([{"raw_response": "nope"}, []])
+
+def test_first_page_fields_come_from_the_first_chunk_only():
+    chunk_jsons = [
+        [{"LEGNO": "", "LEGTYPE": "Ordinance", "LONG_TITLE_SUMMARY": "Zoning changes", "CITY/TOWN": ""}],
+        [{"LEGNO": "2019-3", "LEGTYPE": "Resolution", "LONG_TITLE_SUMMARY": "Cited ordinance", "CITY/TOWN": "Trenton"}],
+    ]
+    merged = merge_chunk_records(chunk_jsons, [{"page_numbers": [0, 1]}, {"page_numbers": [2, 3]}])
+    # A later chunk's guess never fills a first-page field, even one the first chunk left blank
+    assert merged["LEGNO"] == ""
+    assert merged["LEGTYPE"] == "Ordinance"
+    assert merged["LONG_TITLE_SUMMARY"] == "Zoning changes"
+    assert merged["CITY/TOWN"] == "Trenton"
+    # The chunk holding the first sent page decides, wherever it sits in the list
+    merged = merge_chunk_records(chunk_jsons, [{"page_numbers": [4, 5]}, {"page_numbers": [1, 3]}])
+    assert merged["LEGNO"] == "2019-3"
+    assert merged["LEGTYPE"] == "Resolution"
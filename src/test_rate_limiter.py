@@ -0,0 +1,98 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, is_throttling_error, is_transient_error
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+def test_aimd_rate():
+    limiter = RateLimiter(requests_per_second=1.0, max_requests_per_second=1.2, min_requests_per_second=0.3,
+                          increase_step=0.1, decrease_factor=0.5)
+    limiter.record_success()
+    assert limiter.rate == pytest.approx(1.1)
+    limiter.record_success()
+    limiter.record_success()
+    assert limiter.rate == pytest.approx(1.2)
+    limiter.record_throttle()
+    assert limiter.rate == pytest.approx(0.6)
+    limiter.record_throttle()
+    limiter.record_throttle()
+    assert limiter.rate == pytest.approx(0.3)
+
+def test_request_bucket(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    limiter = RateLimiter(requests_per_second=2.0)
+    assert limiter._try_acquire(0) == 0
+    assert limiter._try_acquire(0) == pytest.approx(0.5)
+    now[0] += 0.5
+    assert limiter._try_acquire(0) == 0
+
+def test_throttle_drains_request_bucket(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    limiter = RateLimiter(requests_per_second=2.0, decrease_factor=0.5)
+    limiter.record_throttle()
+    assert limiter._try_acquire(0) == pytest.approx(1.0)
+
+def test_token_bucket(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    limiter = RateLimiter(requests_per_second=100.0, tokens_per_minute=600)
+    assert limiter._try_acquire(500) == 0
+    # 100 tokens left, refilled at 10 per second
+    assert limiter._try_acquire(300) == pytest.approx(20.0)
+    # A call larger than the whole budget waits for a full bucket, then goes through
+    now[0] += 50.0
+    assert limiter._try_acquire(1000) == 0
+    limiter.reconcile_tokens(1000, 100)
+    assert limiter._token_budget == pytest.approx(500.0)
+
+def test_call_retries_throttling_then_succeeds():
+    limiter = RateLimiter(requests_per_second=100.0, base_delay=0, max_retries=3)
+    failures = [FakeClientError("ThrottlingException"), FakeClientError("ServiceUnavailableException")]
+    retries = []
+
+    def fn():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert limiter.call(fn, on_retry=lambda attempt, exc, delay: retries.append(attempt)) == "ok"
+    assert retries == [1, 2]
+    # One throttle halved the rate, the success added a step back
+    assert limiter.rate == pytest.approx(100.0 * 0.5 + 0.05)
+
+def test_call_does_not_retry_other_errors():
+    limiter = RateLimiter(requests_per_second=100.0, base_delay=0)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise FakeClientError("ValidationException")
+
+    with pytest.raises(FakeClientError):
+        limiter.call(fn)
+    assert len(calls) == 1
+
+def test_call_gives_up_after_max_retries():
+    limiter = RateLimiter(requests_per_second=100.0, base_delay=0, max_retries=2)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise FakeClientError("InternalServerException")
+
+    with pytest.raises(FakeClientError):
+        limiter.call(fn)
+    assert len(calls) == 3
+
+def test_error_codes_match_case_insensitively():
+    # ConverseStream's mid-stream errors carry camelCase event names
+    assert is_throttling_error(FakeClientError("ThrottlingException"))
+    assert is_throttling_error(FakeClientError("throttlingException"))
+    assert is_transient_error(FakeClientError("modelStreamErrorException"))
+    assert not is_transient_error(FakeClientError("ValidationException"))
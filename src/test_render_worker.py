@@ -0,0 +1,19 @@
+import os
+import shutil
+
+import pipeline
+from conftest import SAMPLE_FOLDER
+
+def test_worker_reopens_a_replaced_pdf(tmp_path):
+    first, second = sorted(SAMPLE_FOLDER.glob("*.pdf"))[:2]
+    path = tmp_path / "doc.pdf"
+    shutil.copy(first, path)
+    before, _ = pipeline.render_page_in_worker(str(path), 0, 72, 800, False)
+    shutil.copy(second, path)
+    # Same path, different file; make sure the stamp differs even on coarse-mtime filesystems
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1_000_000_000))
+    after, _ = pipeline.render_page_in_worker(str(path), 0, 72, 800, False)
+    expected, _ = pipeline.render_page_in_worker(str(second), 0, 72, 800, False)
+    assert after == expected
+    assert after != before
+    assert [key for key in pipeline._WORKER_DOCS if key[0] == str(path)] == [(str(path), os.stat(path).st_mtime_ns, os.stat(path).st_size)]
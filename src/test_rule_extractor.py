@@ -0,0 +1,41 @@
+from rule_extractor import extract_fields, field, format_hints
+
+FIRST_PAGE = """ORDINANCE NO. 2025-14
+AN ORDINANCE AMENDING CHAPTER 17 OF THE CODE OF THE CITY OF TRENTON
+City Hall, 319 East State Street, Trenton, New Jersey 08608
+WHEREAS, Ordinance No. 2019-3 was adopted on March 1, 2019; and
+NOW, THEREFORE, BE IT ORDAINED by the City Council:
+Section 1. Section § 17-4 of the Code is amended.
+Adopted: April 28, 2025
+"""
+
+def test_header_fields():
+    fields = extract_fields([FIRST_PAGE])
+    assert fields["LEGNO"]["value"] == "2025-14"
+    assert fields["LEGTYPE"]["value"] == "Ordinance"
+    assert fields["STATE"]["value"] == "NJ"
+    assert fields["CHAPTER/TITLE"]["value"] == "17"
+    assert fields["ACTION_CLASSIFICATION"]["value"] == "Amend"
+    # The recital's 2019 date belongs to earlier legislation
+    assert fields["ADOPTION_DATE"]["value"] == "April 28, 2025"
+
+def test_state_needs_an_anchor():
+    fields = extract_fields(["Washington Township Ordinance No. 4\nLincoln Avenue, Nebraska Street"])
+    assert "STATE" not in fields
+    fields = extract_fields(["Resolution No. 7 of the Commonwealth of Pennsylvania"])
+    assert fields["STATE"]["value"] == "PA"
+
+def test_redline_evidence():
+    assert extract_fields([FIRST_PAGE], struck_words=3)["REDLINE"] == field("X", 0.9)
+    # No struck words found is not proof of no redline
+    no_redline = extract_fields([FIRST_PAGE])["REDLINE"]
+    assert no_redline["value"] == ""
+    assert no_redline["confidence"] < 0.8
+
+def test_disposition_in_the_prompts_form():
+    fields = extract_fields([FIRST_PAGE + "Section 2. §§ 17 - 5 and §17-4 are repealed.\n"])
+    assert fields["DISPOSITION"]["value"] == "§17-4; §17-5"
+
+def test_format_hints():
+    hints = format_hints({"LEGNO": field("2025-14", 0.9), "REDLINE": field("", 0.4)})
+    assert hints.splitlines() == ["- LEGNO: 2025-14 (confidence 0.90)", "- REDLINE: (none found) (confidence 0.40)"]
@@ -0,0 +1,47 @@
+import json
+
+from run_journal import RunJournal
+
+def result(lfid):
+    return {"aggregated_results": {"LFID": lfid}}
+
+def test_resume_by_fingerprint(tmp_path):
+    path = tmp_path / "run_journal.jsonl"
+    journal = RunJournal(path)
+    journal.record("a", "fp1", result("a"))
+    journal.record("b", "fp1", error="ValueError: boom")
+    journal.record("c", "fp1", result("c"))
+    journal.record("c", "fp1", error="RuntimeError: later failure")
+
+    resumed = RunJournal(path)
+    assert resumed.completed("a", "fp1") == result("a")
+    assert resumed.completed("a", "fp2") is None
+    assert resumed.completed("b", "fp1") is None
+    # The last line for an LFID wins
+    assert resumed.completed("c", "fp1") is None
+    assert resumed.rows(["c", "a", "b"]) == [{"LFID": "a"}]
+
+def test_torn_last_line_is_cut_off(tmp_path):
+    path = tmp_path / "run_journal.jsonl"
+    journal = RunJournal(path)
+    journal.record("a", "fp", result("a"))
+    with open(path, "ab") as f:
+        f.write(b'{"lfid": "b", "fingerprint": "fp", "sta')
+
+    resumed = RunJournal(path)
+    assert resumed.completed("a", "fp") == result("a")
+    assert resumed.completed("b", "fp") is None
+    resumed.record("b", "fp", result("b"))
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["lfid"] for line in lines] == ["a", "b"]
+    assert RunJournal(path).completed("b", "fp") == result("b")
+
+def test_reset_keeps_every_backup(tmp_path):
+    path = tmp_path / "run_journal.jsonl"
+    for lfid in ("a", "b", "c"):
+        journal = RunJournal(path)
+        journal.reset()
+        journal.record(lfid, "fp", result(lfid))
+    assert RunJournal(path).completed("c", "fp") == result("c")
+    assert RunJournal(path).completed("a", "fp") is None
+    assert len(list(tmp_path.glob("run_journal.jsonl.*.bak"))) == 2
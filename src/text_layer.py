@@ -0,0 +1,82 @@
+import fitz
+
+# Struck-through words are wrapped in these markers in the text sent to the model
+STRIKE_OPEN = "~~"
+STRIKE_CLOSE = "~~"
+# A drawn line/rect counts as a rule if it is flatter than this (points) and longer than MIN_RULE_WIDTH
+MAX_RULE_HEIGHT = 3.0
+MIN_RULE_WIDTH = 4.0
+# A rule strikes a word if it crosses the middle band of the word box (fractions of its height)
+# and covers at least this much of the word's width; underlines sit below the band
+STRIKE_BAND = (0.3, 0.75)
+MIN_STRIKE_COVERAGE = 0.6
+
+def strike_rules(page):
+    """
+    Horizontal segments that may strike text: thin drawn lines and rectangles, plus the
+    quads of StrikeOut annotations. Returns (x0, x1, y) tuples in page coordinates.
+    """
+    rules = []
+    for path in page.get_drawings():
+        for item in path["items"]:
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.y - p2.y) <= MAX_RULE_HEIGHT and abs(p1.x - p2.x) >= MIN_RULE_WIDTH:
+                    rules.append((min(p1.x, p2.x), max(p1.x, p2.x), (p1.y + p2.y) / 2))
+            elif item[0] == "re":
+                rect = item[1]
+                if rect.height <= MAX_RULE_HEIGHT and rect.width >= MIN_RULE_WIDTH:
+                    rules.append((rect.x0, rect.x1, (rect.y0 + rect.y1) / 2))
+    for annot in page.annots(types=[fitz.PDF_ANNOT_STRIKE_OUT]):
+        vertices = annot.vertices or []
+        for i in range(0, len(vertices) - 3, 4):
+            quad = fitz.Quad(vertices[i:i + 4])
+            rect = quad.rect
+            rules.append((rect.x0, rect.x1, (rect.y0 + rect.y1) / 2))
+    return rules
+
+def is_struck(word_rect, rules):
+    x0, y0, x1, y1 = word_rect
+    height = y1 - y0
+    width = max(x1 - x0, 1e-6)
+    band_top = y0 + STRIKE_BAND[0] * height
+    band_bottom = y0 + STRIKE_BAND[1] * height
+    for rx0, rx1, ry in rules:
+        if band_top <= ry <= band_bottom and (min(x1, rx1) - max(x0, rx0)) / width >= MIN_STRIKE_COVERAGE:
+            return True
+    return False
+
+def page_markup_text(page):
+    """
+    The page's text in reading order, one line per text line, with struck-through words
+    wrapped in STRIKE_OPEN/STRIKE_CLOSE. Returns (text, struck_word_count).
+    """
+    rules = strike_rules(page)
+    lines = {}
+    struck_words = 0
+    for x0, y0, x1, y1, word, block, line, _ in page.get_text("words", sort=True):
+        struck = bool(rules) and is_struck((x0, y0, x1, y1), rules)
+        struck_words += struck
+        lines.setdefault((block, line), []).append((word, struck))
+    out = []
+    for words in lines.values():
+        parts = []
+        run = []
+        for word, struck in words:
+            if struck:
+                run.append(word)
+                continue
+            if run:
+                parts.append(f"{STRIKE_OPEN}{' '.join(run)}{STRIKE_CLOSE}")
+                run = []
+            parts.append(word)
+        if run:
+            parts.append(f"{STRIKE_OPEN}{' '.join(run)}{STRIKE_CLOSE}")
+        out.append(" ".join(parts))
+    return "\n".join(out), struck_words
+
+def format_document_text(page_texts):
+    """
+    Joins {page_index: text} under "--- PAGE n ---" headers, in page order.
+    """
+    return "\n\n".join(f"--- PAGE {page_num + 1} ---\n{text}" for page_num, text in sorted(page_texts.items()))